@@ -0,0 +1,150 @@
+"""
+Alert feed: alerts in dashboard order, read a page at a time from an index.
+
+The feed lists alerts like view_alert_dashboard, highest priority first and
+newest first within a priority, but never sorts: idx_metrics_alert_feed holds
+(alert_flag, alert_priority, alert_timestamp, conversation_id) in that order,
+and each page continues strictly below the last entry of the previous one
+(keyset pagination), so a page costs an index range read however many alerts
+exist.
+
+Clients that poll keep the `since` value of their last response and ask for
+`since=<value>`; they get only the alerts raised or re-prioritized after it,
+oldest first, read from idx_metrics_alert_seq. Both values are maintained by
+schema.py's trg_alert_feed_raise.
+"""
+
+import base64
+import json
+import os
+
+FEED_PAGE_SIZE = int(os.environ.get("ALERT_FEED_PAGE_SIZE", "50"))
+FEED_MAX_PAGE_SIZE = 500
+
+COLUMNS = """
+    fcm.alert_seq,
+    fcm.conversation_id,
+    fcm.alert_timestamp as timestamp,
+    fcm.alert_type,
+    fcm.alert_priority,
+    fc.district,
+    fc.state,
+    du.full_name AS agent_name,
+    df.farmer_name,
+    fcs.urgency,
+    fcs.primary_topic,
+    fcs.overall_sentiment
+"""
+
+# fcm comes first so the feed is read from its index and the joins are
+# lookups for the rows of one page only.
+JOINS = """
+    FROM fact_conversation_metrics fcm
+    CROSS JOIN fact_conversations fc ON fcm.conversation_id = fc.conversation_id
+    LEFT JOIN dim_user du ON fc.user_id = du.user_id
+    LEFT JOIN dim_farmers df ON fc.farmer_id = df.farmer_id
+    LEFT JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+"""
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(alert):
+    key = [alert["alert_priority"], alert["timestamp"], alert["conversation_id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        priority, timestamp, conversation_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode())
+        )
+    except (ValueError, TypeError) as e:
+        raise CursorError(f"Invalid cursor: {cursor}") from e
+    return priority, timestamp, conversation_id
+
+
+def page_size(limit):
+    try:
+        return max(1, min(int(limit), FEED_MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return FEED_PAGE_SIZE
+
+
+def latest_seq(conn):
+    return conn.execute(
+        "SELECT COALESCE(MAX(alert_seq), 0) FROM fact_conversation_metrics"
+    ).fetchone()[0]
+
+
+def feed(conn, cursor=None, limit=None):
+    """One page of the feed, and the cursor of the next page (None at the end)"""
+    limit = page_size(limit)
+    keyset, params = "", []
+    if cursor:
+        # Row values compare left to right, which is exactly the index order
+        keyset = """
+            AND (fcm.alert_priority, fcm.alert_timestamp, fcm.conversation_id)
+                < (?, ?, ?)
+        """
+        params = list(decode_cursor(cursor))
+    rows = conn.execute(
+        f"""
+        SELECT {COLUMNS}
+        {JOINS}
+        WHERE fcm.alert_flag = 1
+        {keyset}
+        ORDER BY fcm.alert_priority DESC, fcm.alert_timestamp DESC, fcm.conversation_id DESC
+        LIMIT ?
+        """,
+        [*params, limit + 1],
+    ).fetchall()
+    alerts = [dict(row) for row in rows[:limit]]
+    return alerts, encode_cursor(alerts[-1]) if len(rows) > limit else None
+
+
+def changes_since(conn, since, limit=None):
+    """Alerts raised or re-prioritized after sequence number since, oldest first"""
+    rows = conn.execute(
+        f"""
+        SELECT {COLUMNS}
+        {JOINS}
+        WHERE fcm.alert_seq > ?
+        AND fcm.alert_flag = 1
+        ORDER BY fcm.alert_seq
+        LIMIT ?
+        """,
+        (since, page_size(limit)),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def alert_feed(conn, args):
+    """Response payload for /api/operations/alert-feed
+
+    Without `since`, a page of the feed (after `cursor`, if given) plus the
+    `since` value to poll with. With `since`, the alerts changed after it and
+    the `since` value for the next poll; when `more` is true, poll again
+    straight away.
+    """
+    limit = page_size(args.get("limit", FEED_PAGE_SIZE))
+    since = args.get("since")
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError as e:
+            raise CursorError(f"Invalid since: {since}") from e
+        alerts = changes_since(conn, since, limit)
+        return {
+            "alerts": alerts,
+            "since": alerts[-1]["alert_seq"] if alerts else since,
+            "more": len(alerts) == limit,
+        }
+
+    # Read the sequence first: alerts raised between the two reads are
+    # delivered again by the first poll rather than missed.
+    since = latest_seq(conn)
+    alerts, next_cursor = feed(conn, args.get("cursor"), limit)
+    return {"alerts": alerts, "next_cursor": next_cursor, "since": since}
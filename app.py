@@ -1,22 +1,56 @@
+import hmac
 import json
 import os
-import sqlite3
 import sys
 import traceback
-from datetime import datetime, timedelta
 from functools import wraps
+import alerts
 import auth
+import db
+import dimensions
+import exports
+import geo
+import live
+import profiling
+import rollups
+import schema
+import search
+from cache import cached, response_cache
+from pivot import OTHER, pivot
+from widgets import WIDGETS, run_bundle, widget
 
 # try to solve Azure issue
 from urllib.parse import urlencode
 
-from flask import Flask, jsonify, redirect, render_template, request, session, url_for
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    session,
+    url_for,
+)
 from flask_bcrypt import Bcrypt
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "your_super_secret_key")
 bcrypt = Bcrypt(app)
 
+# Proxies in front of the app whose X-Forwarded-For is trusted (Azure App
+# Service has one), so request.remote_addr is the client for login throttling
+TRUSTED_PROXIES = int(
+    os.environ.get(
+        "TRUSTED_PROXIES", "1" if os.environ.get("WEBSITE_INSTANCE_ID") else "0"
+    )
+)
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES
+    )
+
 
 #######################################################
 def login_required(f):
@@ -29,1544 +63,1335 @@ def login_required(f):
     return decorated_function
 
 
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if "logged_in" not in session:
+            return redirect(url_for("login"))
+        if session.get("user_role") != "admin":
+            return jsonify({"error": "Admin access required"}), 403
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
 #######################################################
-# Database configuration
-DB_PATH = "fieldforce.db"
+# Database configuration (path and pool settings live in db.py)
 COROMANDEL_COMPANY_CODE = 7007
 
 
 def get_db_connection():
-    global DB_PATH
-    if os.environ.get("WEBSITE_INSTANCE_ID"):  # Running on Azure
-        # DB_PATH = "/mnt/data/" + DB_PATH
-        DB_PATH = "/home/site/data/fieldforce.db"
-    _db_connection = sqlite3.connect(DB_PATH)
-    _db_connection.row_factory = sqlite3.Row
-    return _db_connection
-
-
-def dict_from_row(row):
-    return dict(zip(row.keys(), row))
+    """Borrow a pooled read connection; conn.close() hands it back to the pool"""
+    return db.get_read_connection()
 
 
-# Get competitor codes dynamically or use fallback
-def get_competitor_codes():
-    """Get actual competitor company codes from database"""
-    try:
-        conn = get_db_connection()
-        query = """
-            SELECT company_code, company_name
-            FROM dim_companies
-            WHERE company_name IN ('BAYER CROP SCIENCE', 'UPL LIMITED', 'SYNGENTA INDIA LTD')
-            OR company_code IN (7002, 7025, 7024)
-        """
-        results = conn.execute(query).fetchall()
+profiling.install()
+db.configure_database()
+schema.apply_migrations()
+rollups.refresh_quietly()
+dimensions.warm()
+db.log_reader_pragmas()
 
-        competitors = {}
-        for row in results:
-            name = row["company_name"].upper()
-            if "BAYER" in name:
-                competitors["BAYER"] = row["company_code"]
-            elif "UPL" in name:
-                competitors["UPL"] = row["company_code"]
-            elif "SYNGENTA" in name:
-                competitors["SYNGENTA"] = row["company_code"]
-
-        # Fallback to default codes if not found
-        if "BAYER" not in competitors:
-            competitors["BAYER"] = 7002
-        if "UPL" not in competitors:
-            competitors["UPL"] = 7025
-        if "SYNGENTA" not in competitors:
-            competitors["SYNGENTA"] = 7024
-
-        return competitors
-    except Exception as e:
-        print(f"Error loading competitor codes: {e}")
-        # Fallback
-        return {"BAYER": 7002, "UPL": 7025, "SYNGENTA": 7024}
-
-
-COMPETITORS = get_competitor_codes()
-
-
-def parse_date_filter(date_filter):
-    """Parse date filter and return start_date, end_date"""
-    end_date = datetime.now()
-
-    if date_filter == "all":
-        return None, None
-    elif date_filter.isdigit():
-        start_date = end_date - timedelta(days=int(date_filter))
-        return start_date, end_date
-    elif "-" in date_filter:  # Custom date range: "2024-01-01,2024-12-31"
-        dates = date_filter.split(",")
-        return dates[0], dates[1]
-    else:
-        start_date = end_date - timedelta(days=30)
-        return start_date, end_date
 
+@app.before_request
+def start_rollup_refresher():
+    # Keeps the trend marts current while the ETL loads new conversations
+    rollups.ensure_refresher()
 
-# ==================== FILTER OPTIONS APIs ====================
 
+@app.before_request
+def start_request_profile():
+    profiling.profiler.begin(
+        request.url_rule.rule if request.url_rule else "(unmatched)"
+    )
 
-@app.route("/api/filters/crops")
-@login_required
-def get_crop_options():
-    conn = get_db_connection()
-    try:
-        query = """
-            SELECT DISTINCT dc.crop_code, dc.crop_name, dc.crop_type
-            FROM dim_crops dc
-            JOIN fact_conversation_entities fce ON dc.crop_code = fce.entity_code
-            WHERE fce.entity_type = 'crop'
-            AND dc.crop_name != '_OTHERS (PLEASE SPECIFY)'
-            AND dc.crop_name != 'No Crop'
-            ORDER BY dc.crop_name
-        """
-        results = conn.execute(query).fetchall()
-        return jsonify([dict_from_row(row) for row in results])
-    finally:
-        conn.close()
 
+@app.after_request
+def end_request_profile(response):
+    profiling.profiler.end(response.status_code)
+    return response
 
-@app.route("/api/filters/crop-types")
-@login_required
-def get_crop_type_options():
-    conn = get_db_connection()
-    try:
-        query = """
-            SELECT DISTINCT crop_type
-            FROM dim_crops
-            WHERE crop_type IS NOT NULL
-            AND crop_type != '(blank)'
-            AND crop_type != 'No Crop'
-            ORDER BY crop_type
-        """
-        results = conn.execute(query).fetchall()
-        return jsonify([row["crop_type"] for row in results])
-    finally:
-        conn.close()
 
+@app.teardown_request
+def end_failed_request_profile(exc):
+    # after_request is skipped when the view raised
+    profiling.profiler.end(500)
 
-# ==================== HOME MODULE APIs ====================
 
+@app.errorhandler(db.PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({"error": "Database busy, please retry"}), 503
 
-@app.route("/api/home/kpis")
-@login_required
-def get_home_kpis():
-    conn = get_db_connection()
-    date_filter = request.args.get("date", "30")
-    crop_filter = request.args.get("crop", "all")
 
-    try:
-        start_date, end_date = parse_date_filter(date_filter)
-
-        date_clause = ""
-        params = []
-        if start_date and end_date:
-            date_clause = "AND fc.created_at >= ? AND fc.created_at <= ?"
-            params = [start_date, end_date]
-
-        # Alert Count KPI
-        alert_query = f"""
-            SELECT COUNT(*) as alert_count
-            FROM fact_conversation_metrics fcm
-            JOIN fact_conversations fc ON fcm.conversation_id = fc.conversation_id
-            WHERE fcm.alert_flag = 1 {date_clause}
-        """
+def dict_from_row(row):
+    return dict(zip(row.keys(), row))
 
-        # Market Health KPI
-        health_query = f"""
-            SELECT AVG(CASE
-                WHEN overall_sentiment = 'positive' THEN 100
-                WHEN overall_sentiment = 'neutral' THEN 50
-                WHEN overall_sentiment = 'negative' THEN 0
-            END) as health_score
-            FROM fact_conversation_semantics fcs
-            JOIN fact_conversations fc ON fcs.conversation_id = fc.conversation_id
-            WHERE 1=1 {date_clause}
-        """
 
-        # Activity KPI
-        activity_query = f"""
-            SELECT COUNT(*) as activity_count
-            FROM fact_conversations fc
-            WHERE 1=1 {date_clause}
-        """
-
-        alerts = conn.execute(alert_query, params).fetchone()
-        health = conn.execute(health_query, params).fetchone()
-        activity = conn.execute(activity_query, params).fetchone()
+# ==================== SHARED INTERMEDIATES ====================
+# Aggregates used by more than one widget. They are memoized on the scope, so
+# a module bundle computes each of them once for all of its widgets.
 
-        return jsonify(
-            {
-                "alert_count": alerts["alert_count"] or 0,
-                "market_health": round(health["health_score"] or 50, 1),
-                "activity_count": activity["activity_count"] or 0,
-            }
-        )
-    finally:
-        conn.close()
+EXCLUDED_CROP_NAMES = ("_OTHERS (PLEASE SPECIFY)", "No Crop")
 
 
-@app.route("/api/home/volume-sentiment")
-@login_required
-def get_volume_sentiment():
-    conn = get_db_connection()
-    date_filter = request.args.get("date", "30")
+def tracked_company_codes():
+    competitors = dimensions.get().competitors
+    return (
+        COROMANDEL_COMPANY_CODE,
+        competitors["BAYER"],
+        competitors["UPL"],
+        competitors["SYNGENTA"],
+    )
 
-    try:
-        start_date, end_date = parse_date_filter(date_filter)
-
-        if start_date and end_date:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    COUNT(*) as volume,
-                    AVG(CASE
-                        WHEN fcs.overall_sentiment = 'positive' THEN 1
-                        WHEN fcs.overall_sentiment = 'neutral' THEN 0
-                        WHEN fcs.overall_sentiment = 'negative' THEN -1
-                    END) as sentiment_score
-                FROM fact_conversations fc
-                JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-                WHERE fc.created_at >= ? AND fc.created_at <= ?
-                GROUP BY DATE(fc.created_at)
-                ORDER BY date
-            """
-            results = conn.execute(query, (start_date, end_date)).fetchall()
-        else:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    COUNT(*) as volume,
-                    AVG(CASE
-                        WHEN fcs.overall_sentiment = 'positive' THEN 1
-                        WHEN fcs.overall_sentiment = 'neutral' THEN 0
-                        WHEN fcs.overall_sentiment = 'negative' THEN -1
-                    END) as sentiment_score
-                FROM fact_conversations fc
-                JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-                GROUP BY DATE(fc.created_at)
-                ORDER BY date
-            """
-            results = conn.execute(query).fetchall()
 
-        return jsonify(
-            {
-                "labels": [row["date"] for row in results],
-                "volume": [row["volume"] for row in results],
-                "sentiment": [
-                    round(row["sentiment_score"] * 100, 2)
-                    if row["sentiment_score"]
-                    else 0
-                    for row in results
-                ],
-            }
-        )
-    finally:
-        conn.close()
+def daily_activity(scope):
+    """Per-day conversation, sentiment and alert totals for the date filter, from the daily rollup"""
 
+    def compute():
+        source, params = scope.mart("mart_daily_kpis")
+        day_clause, day_params = scope.day_clause()
 
-@app.route("/api/home/conversation-distribution")
-@login_required
-def get_conversation_distribution():
-    conn = get_db_connection()
-
-    try:
-        query = """
+        query = f"""
             SELECT
-                primary_topic,
-                COUNT(*) as count
-            FROM fact_conversation_semantics
-            GROUP BY primary_topic
-            ORDER BY count DESC
-            LIMIT 5
+                kpi_date as date,
+                total_conversations as activity,
+                COALESCE(semantics_count, 0) as volume,
+                COALESCE(100 * positive_count + 50 * neutral_count, 0) as health_sum,
+                COALESCE(positive_count - negative_count, 0) as sentiment_sum,
+                COALESCE(positive_count + neutral_count + negative_count, 0) as sentiment_n,
+                COALESCE(alert_count, 0) as alerts
+            FROM {source} m
+            WHERE 1 = 1
+            {day_clause}
+            ORDER BY kpi_date
         """
+        return [
+            dict_from_row(row)
+            for row in scope.conn.execute(query, [*params, *day_params]).fetchall()
+        ]
 
-        results = conn.execute(query).fetchall()
-
-        return jsonify(
-            {
-                "labels": [row["primary_topic"] for row in results],
-                "data": [row["count"] for row in results],
-            }
-        )
-    finally:
-        conn.close()
+    return scope.memo("daily_activity", compute)
 
 
-@app.route("/api/home/market-share")
-@login_required
-def get_market_share():
-    conn = get_db_connection()
+def company_mentions(scope):
+    """Conversations mentioning a brand of each tracked company, most first"""
 
-    try:
-        query = """
+    def compute():
+        query = f"""
             SELECT
-                dc.company_name,
-                COUNT(DISTINCT fce.conversation_id) as mentions
-            FROM fact_conversation_entities fce
-            JOIN dim_brands db ON fce.entity_code = db.brand_code
-            JOIN dim_companies dc ON db.company_code = dc.company_code
-            WHERE fce.entity_type = 'brand'
-            AND dc.company_code IN (?, ?, ?, ?)
-            GROUP BY dc.company_name
+                fcc.company_code,
+                COUNT(*) as mentions
+            FROM fact_conversation_companies fcc
+            WHERE fcc.company_code IN (SELECT value FROM json_each(?))
+            {scope.filter_clause("fcc", probe=True)}
+            GROUP BY fcc.company_code
             ORDER BY mentions DESC
         """
-
-        results = conn.execute(
-            query,
-            (
-                COROMANDEL_COMPANY_CODE,
-                COMPETITORS["BAYER"],
-                COMPETITORS["UPL"],
-                COMPETITORS["SYNGENTA"],
-            ),
-        ).fetchall()
-
-        return jsonify(
+        codes = json.dumps(tracked_company_codes())
+        companies = dimensions.get().companies
+        return [
             {
-                "labels": [row["company_name"] for row in results],
-                "data": [row["mentions"] for row in results],
+                "company_name": companies[row["company_code"]],
+                "mentions": row["mentions"],
             }
-        )
-    finally:
-        conn.close()
+            for row in scope.conn.execute(query, (codes,)).fetchall()
+            if row["company_code"] in companies
+        ]
 
+    return scope.memo("company_mentions", compute)
 
-@app.route("/api/home/competitive-position")
-@login_required
-def get_competitive_position():
-    conn = get_db_connection()
 
-    try:
-        query = """
-            SELECT
-                dc.company_name as brand,
-                COUNT(DISTINCT fce.conversation_id) as mentions,
-                ROUND(COUNT(DISTINCT fce.conversation_id) * 100.0 /
-                    (SELECT COUNT(DISTINCT conversation_id) FROM fact_conversation_entities WHERE entity_type = 'brand'), 1) as share,
-                0 as score
-            FROM fact_conversation_entities fce
-            JOIN dim_brands db ON fce.entity_code = db.brand_code
-            JOIN dim_companies dc ON db.company_code = dc.company_code
-            WHERE fce.entity_type = 'brand'
-            AND dc.company_code IN (?, ?, ?, ?)
-            GROUP BY dc.company_name
-            ORDER BY share DESC
-            LIMIT 3
+def brand_conversation_total(scope):
+    """Number of conversations mentioning any brand of a known company"""
+
+    def compute():
+        query = f"""
+            SELECT COUNT(DISTINCT fcc.conversation_id) as total
+            FROM fact_conversation_companies fcc
+            WHERE 1 = 1
+            {scope.filter_clause("fcc")}
         """
+        return scope.conn.execute(query).fetchone()["total"]
 
-        results = conn.execute(
-            query,
-            (
-                COROMANDEL_COMPANY_CODE,
-                COMPETITORS["BAYER"],
-                COMPETITORS["UPL"],
-                COMPETITORS["SYNGENTA"],
-            ),
-        ).fetchall()
+    return scope.memo("brand_conversation_total", compute)
 
-        return jsonify([dict_from_row(row) for row in results])
-    finally:
-        conn.close()
 
+def topic_counts(scope):
+    """Conversation count per primary topic, most first"""
 
-@app.route("/api/home/conversation-drivers")
-@login_required
-def get_conversation_drivers():
-    conn = get_db_connection()
-
-    try:
-        query = """
+    def compute():
+        query = f"""
             SELECT
-                intent as driver,
+                fcs.primary_topic,
                 COUNT(*) as count
-            FROM fact_conversation_semantics
-            GROUP BY intent
+            FROM fact_conversation_semantics fcs
+            WHERE 1 = 1
+            {scope.filter_clause("fcs")}
+            GROUP BY fcs.primary_topic
             ORDER BY count DESC
-            LIMIT 10
         """
+        return [dict_from_row(row) for row in scope.conn.execute(query).fetchall()]
 
-        results = conn.execute(query).fetchall()
-
-        return jsonify(
-            {
-                "labels": [row["driver"] for row in results],
-                "data": [row["count"] for row in results],
-            }
-        )
-    finally:
-        conn.close()
+    return scope.memo("topic_counts", compute)
 
 
-# ==================== MARKETING MODULE APIs ====================
-
+def intent_counts(scope):
+    """Conversation count per intent, most first"""
 
-@app.route("/api/marketing/brand-health-trend")
-@login_required
-def get_brand_health_trend():
-    conn = get_db_connection()
-    date_filter = request.args.get("date", "30")
-
-    try:
-        start_date, end_date = parse_date_filter(date_filter)
-
-        if start_date and end_date:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    COUNT(*) as volume,
-                    50 as health
-                FROM fact_conversations fc
-                JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
-                JOIN dim_brands db ON fce.entity_code = db.brand_code
-                WHERE db.company_code = ?
-                AND fce.entity_type = 'brand'
-                AND fc.created_at >= ? AND fc.created_at <= ?
-                GROUP BY DATE(fc.created_at)
-                ORDER BY date
-            """
-            results = conn.execute(
-                query, (COROMANDEL_COMPANY_CODE, start_date, end_date)
-            ).fetchall()
-        else:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    COUNT(*) as volume,
-                    50 as health
-                FROM fact_conversations fc
-                JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
-                JOIN dim_brands db ON fce.entity_code = db.brand_code
-                WHERE db.company_code = ?
-                AND fce.entity_type = 'brand'
-                GROUP BY DATE(fc.created_at)
-                ORDER BY date
-            """
-            results = conn.execute(query, (COROMANDEL_COMPANY_CODE,)).fetchall()
+    def compute():
+        query = f"""
+            SELECT
+                fcs.intent,
+                COUNT(*) as count
+            FROM fact_conversation_semantics fcs
+            WHERE 1 = 1
+            {scope.filter_clause("fcs")}
+            GROUP BY fcs.intent
+            ORDER BY count DESC
+        """
+        return [dict_from_row(row) for row in scope.conn.execute(query).fetchall()]
 
-        return jsonify(
-            {
-                "labels": [row["date"] for row in results],
-                "volume": [row["volume"] for row in results],
-                "health": [
-                    round(row["health"], 2) if row["health"] is not None else 50
-                    for row in results
-                ],
-            }
-        )
-    finally:
-        conn.close()
+    return scope.memo("intent_counts", compute)
 
 
-@app.route("/api/marketing/conv-volume-by-topic")
-@login_required
-def get_conv_volume_by_topic():
-    conn = get_db_connection()
-    date_filter = request.args.get("date", "30")
+def crop_mentions(scope):
+    """Mentions and distinct conversations per crop name, most mentioned first"""
 
-    try:
-        start_date, end_date = parse_date_filter(date_filter)
-
-        if start_date and end_date:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    fcs.primary_topic,
-                    COUNT(*) as count
-                FROM fact_conversations fc
-                JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-                WHERE fc.created_at >= ? AND fc.created_at <= ?
-                GROUP BY DATE(fc.created_at), fcs.primary_topic
-                ORDER BY date, count DESC
-            """
-            results = conn.execute(query, (start_date, end_date)).fetchall()
-        else:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    fcs.primary_topic,
-                    COUNT(*) as count
-                FROM fact_conversations fc
-                JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-                GROUP BY DATE(fc.created_at), fcs.primary_topic
-                ORDER BY date, count DESC
-            """
-            results = conn.execute(query).fetchall()
-
-        # Reorganize data
-        dates = sorted(list(set([row["date"] for row in results])))
-        topics = list(set([row["primary_topic"] for row in results]))[:5]  # Top 5 topics
-
-        datasets = {}
-        for topic in topics:
-            datasets[topic] = [0] * len(dates)
-
-        for row in results:
-            if row["primary_topic"] in topics:
-                date_idx = dates.index(row["date"])
-                datasets[row["primary_topic"]][date_idx] = row["count"]
+    def compute():
+        # Grouped by name, so a conversation naming two codes of one crop
+        # counts once
+        query = f"""
+            SELECT
+                n.name as crop_name,
+                COUNT(*) as mentions,
+                COUNT(DISTINCT fce.conversation_id) as conversations
+            FROM fact_conversation_entities fce
+            JOIN {dimensions.NAMES} n ON n.code = fce.entity_code
+            WHERE fce.entity_type = 'crop'
+            {scope.filter_clause("fce", probe=True)}
+            GROUP BY n.name
+            ORDER BY mentions DESC, crop_name
+        """
+        names = dimensions.name_pairs(dimensions.get().crop_names())
+        return [dict_from_row(row) for row in scope.conn.execute(query, (names,))]
 
-        return jsonify(
-            {
-                "labels": dates,
-                "datasets": [
-                    {"label": topic, "data": data} for topic, data in datasets.items()
-                ],
-            }
-        )
-    finally:
-        conn.close()
+    return scope.memo("crop_mentions", compute)
 
 
-@app.route("/api/marketing/brand-keywords")
-@login_required
-def get_brand_keywords():
-    conn = get_db_connection()
+def agent_summary(scope):
+    """Per-agent conversation, sentiment and urgency totals"""
 
-    try:
-        query = """
+    def compute():
+        query = f"""
             SELECT
-                db.brand_name as word,
-                COUNT(*) as weight
-            FROM fact_conversation_entities fce
-            JOIN dim_brands db ON fce.entity_code = db.brand_code
-            WHERE fce.entity_type = 'brand'
-            AND db.company_code = ?
-            GROUP BY db.brand_name
-            ORDER BY weight DESC
-            LIMIT 50
+                du.full_name as agent_name,
+                COUNT(fc.conversation_id) as conversations,
+                AVG(CASE
+                    WHEN fcs.overall_sentiment = 'positive' THEN 100
+                    WHEN fcs.overall_sentiment = 'neutral' THEN 50
+                    WHEN fcs.overall_sentiment = 'negative' THEN 0
+                END) as avg_sentiment,
+                AVG(CASE
+                    WHEN fcs.overall_sentiment = 'positive' THEN 3
+                    WHEN fcs.overall_sentiment = 'neutral' THEN 2
+                    WHEN fcs.overall_sentiment = 'negative' THEN 1
+                END) as performance_score,
+                COUNT(CASE WHEN fcs.urgency IN ('high', 'critical') THEN 1 END) as urgent_handled
+            FROM fact_conversations fc
+            JOIN dim_user du ON fc.user_id = du.user_id
+            JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+            WHERE 1 = 1
+            {scope.filter_clause("fc")}
+            GROUP BY du.full_name
         """
+        return [dict_from_row(row) for row in scope.conn.execute(query).fetchall()]
 
-        results = conn.execute(query, (COROMANDEL_COMPANY_CODE,)).fetchall()
+    return scope.memo("agent_summary", compute)
 
-        return jsonify(
-            [{"text": row["word"], "size": row["weight"]} for row in results]
-        )
-    finally:
-        conn.close()
+
+# ==================== FILTER OPTIONS APIs ====================
 
 
-@app.route("/api/marketing/market-share-trend")
+@app.route("/api/filters/crops")
 @login_required
-def get_market_share_trend():
+def get_crop_options():
     conn = get_db_connection()
-    date_filter = request.args.get("date", "30")
-
     try:
-        start_date, end_date = parse_date_filter(date_filter)
-
-        if start_date and end_date:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    dc.company_name,
-                    COUNT(DISTINCT fce.conversation_id) as mentions
-                FROM fact_conversations fc
-                JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
-                JOIN dim_brands db ON fce.entity_code = db.brand_code
-                JOIN dim_companies dc ON db.company_code = dc.company_code
-                WHERE fce.entity_type = 'brand'
-                AND dc.company_code IN (?, ?, ?, ?)
-                AND fc.created_at >= ? AND fc.created_at <= ?
-                GROUP BY DATE(fc.created_at), dc.company_name
-                ORDER BY date
-            """
-            results = conn.execute(
-                query,
-                (
-                    COROMANDEL_COMPANY_CODE,
-                    COMPETITORS["BAYER"],
-                    COMPETITORS["UPL"],
-                    COMPETITORS["SYNGENTA"],
-                    start_date,
-                    end_date,
-                ),
-            ).fetchall()
-        else:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    dc.company_name,
-                    COUNT(DISTINCT fce.conversation_id) as mentions
-                FROM fact_conversations fc
-                JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
-                JOIN dim_brands db ON fce.entity_code = db.brand_code
-                JOIN dim_companies dc ON db.company_code = dc.company_code
-                WHERE fce.entity_type = 'brand'
-                AND dc.company_code IN (?, ?, ?, ?)
-                GROUP BY DATE(fc.created_at), dc.company_name
-                ORDER BY date
-            """
-            results = conn.execute(
-                query,
-                (
-                    COROMANDEL_COMPANY_CODE,
-                    COMPETITORS["BAYER"],
-                    COMPETITORS["UPL"],
-                    COMPETITORS["SYNGENTA"],
-                ),
-            ).fetchall()
-
-        dates = sorted(list(set([row["date"] for row in results])))
-        companies = list(set([row["company_name"] for row in results]))
-
-        datasets = {}
-        for company in companies:
-            datasets[company] = [0] * len(dates)
-
-        for row in results:
-            date_idx = dates.index(row["date"])
-            datasets[row["company_name"]][date_idx] = row["mentions"]
-
-        return jsonify(
+        query = """
+            SELECT DISTINCT entity_code
+            FROM fact_conversation_entities
+            WHERE entity_type = 'crop'
+        """
+        crops = dimensions.get().crops
+        options = [
             {
-                "labels": dates,
-                "datasets": [
-                    {"label": company, "data": data}
-                    for company, data in datasets.items()
-                ],
+                "crop_code": code,
+                "crop_name": crops[code][0],
+                "crop_type": crops[code][1],
             }
-        )
+            for (code,) in conn.execute(query).fetchall()
+            if code in crops
+            and crops[code][0] is not None
+            and crops[code][0] not in EXCLUDED_CROP_NAMES
+        ]
+        options.sort(key=lambda row: row["crop_name"])
+        return jsonify(options)
     finally:
         conn.close()
 
 
-@app.route("/api/marketing/competitive-landscape")
+@app.route("/api/filters/crop-types")
 @login_required
-def get_competitive_landscape():
+def get_crop_type_options():
     conn = get_db_connection()
-
     try:
         query = """
-            SELECT
-                dc.company_name,
-                COUNT(DISTINCT fce.conversation_id) as x,
-                0 as y,
-                COUNT(DISTINCT fce.conversation_id) as r
-            FROM fact_conversation_entities fce
-            JOIN dim_brands db ON fce.entity_code = db.brand_code
-            JOIN dim_companies dc ON db.company_code = dc.company_code
-            WHERE fce.entity_type = 'brand'
-            AND dc.company_code IN (?, ?, ?, ?)
-            GROUP BY dc.company_name
+            SELECT DISTINCT crop_type
+            FROM dim_crops
+            WHERE crop_type IS NOT NULL
+            AND crop_type != '(blank)'
+            AND crop_type != 'No Crop'
+            ORDER BY crop_type
         """
-
-        results = conn.execute(
-            query,
-            (
-                COROMANDEL_COMPANY_CODE,
-                COMPETITORS["BAYER"],
-                COMPETITORS["UPL"],
-                COMPETITORS["SYNGENTA"],
-            ),
-        ).fetchall()
-
-        return jsonify([dict_from_row(row) for row in results])
+        results = conn.execute(query).fetchall()
+        return jsonify([row["crop_type"] for row in results])
     finally:
         conn.close()
 
 
-@app.route("/api/marketing/sentiment-by-competitor")
+@app.route("/api/filters/regions")
 @login_required
-def get_sentiment_by_competitor():
+def get_region_options():
     conn = get_db_connection()
-    date_filter = request.args.get("date", "30")
-
     try:
-        start_date, end_date = parse_date_filter(date_filter)
-
-        if start_date and end_date:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    dc.company_name,
-                    50 as sentiment
-                FROM fact_conversations fc
-                JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
-                JOIN dim_brands db ON fce.entity_code = db.brand_code
-                JOIN dim_companies dc ON db.company_code = dc.company_code
-                WHERE fce.entity_type = 'brand'
-                AND dc.company_code IN (?, ?, ?, ?)
-                AND fc.created_at >= ? AND fc.created_at <= ?
-                GROUP BY DATE(fc.created_at), dc.company_name
-                ORDER BY date
-            """
-            results = conn.execute(
-                query,
-                (
-                    COROMANDEL_COMPANY_CODE,
-                    COMPETITORS["BAYER"],
-                    COMPETITORS["UPL"],
-                    COMPETITORS["SYNGENTA"],
-                    start_date,
-                    end_date,
-                ),
-            ).fetchall()
-        else:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    dc.company_name,
-                    50 as sentiment
-                FROM fact_conversations fc
-                JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
-                JOIN dim_brands db ON fce.entity_code = db.brand_code
-                JOIN dim_companies dc ON db.company_code = dc.company_code
-                WHERE fce.entity_type = 'brand'
-                AND dc.company_code IN (?, ?, ?, ?)
-                AND fce.overall_sentiment IS NOT NULL
-                GROUP BY DATE(fc.created_at), dc.company_name
-                ORDER BY date
-            """
-            results = conn.execute(
-                query,
-                (
-                    COROMANDEL_COMPANY_CODE,
-                    COMPETITORS["BAYER"],
-                    COMPETITORS["UPL"],
-                    COMPETITORS["SYNGENTA"],
-                ),
-            ).fetchall()
-
-        # Get all unique dates and companies
-        dates = sorted(list(set([row["date"] for row in results])))
-
-        # Create datasets for each company
-        company_data = {}
-        for row in results:
-            if row["company_name"] not in company_data:
-                company_data[row["company_name"]] = {}
-            company_data[row["company_name"]][row["date"]] = (
-                round(row["sentiment"], 2) if row["sentiment"] is not None else 50
-            )
-
-        # Fill in missing dates with null or previous value
-        datasets = []
-        for company_name, data in company_data.items():
-            dataset_values = []
-            for date in dates:
-                dataset_values.append(data.get(date, None))
-            datasets.append({"label": company_name, "data": dataset_values})
-
-        return jsonify({"labels": dates, "datasets": datasets})
+        query = """
+            SELECT DISTINCT state, district
+            FROM fact_conversations
+            WHERE district IS NOT NULL
+            ORDER BY state, district
+        """
+        results = conn.execute(query).fetchall()
+        return jsonify([dict_from_row(row) for row in results])
     finally:
         conn.close()
 
 
-@app.route("/api/marketing/brand-crop-association")
+@app.route("/api/filters/companies")
 @login_required
-def get_brand_crop_association():
+def get_company_options():
     conn = get_db_connection()
-
     try:
-        # Get ALL Rallis brands with crop associations
         query = """
-            SELECT
-                db.brand_name as parent,
-                mbcm.crop_name as label,
-                mbcm.co_mentions as value
-            FROM mart_brand_crop_matrix mbcm
-            JOIN dim_brands db ON mbcm.brand_code = db.brand_code
-            WHERE db.company_code = ?
-            AND mbcm.co_mentions > 0
-            ORDER BY db.brand_name, mbcm.co_mentions DESC
+            SELECT dc.company_code, dc.company_name
+            FROM dim_companies dc
+            WHERE EXISTS (
+                SELECT 1 FROM fact_conversation_companies fcc
+                WHERE fcc.company_code = dc.company_code
+            )
+            ORDER BY dc.company_name
         """
-
-        results = conn.execute(query, (COROMANDEL_COMPANY_CODE,)).fetchall()
-
+        results = conn.execute(query).fetchall()
         return jsonify([dict_from_row(row) for row in results])
     finally:
         conn.close()
 
 
-# ==================== OPERATIONS MODULE APIs ====================
-
-
-@app.route("/api/operations/urgent-issues")
+@app.route("/api/filters/agents")
 @login_required
-def get_urgent_issues():
+def get_agent_options():
     conn = get_db_connection()
-
     try:
         query = """
-            SELECT
-                fc.conversation_id,
-                fc.created_at,
-                fc.user_text,
-                fcs.urgency,
-                fcs.primary_topic,
-                fcs.overall_sentiment
-            FROM fact_conversations fc
-            JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-            WHERE fcs.urgency IN ('high', 'critical')
-            ORDER BY fc.created_at DESC
-            LIMIT 50
+            SELECT du.user_id, du.full_name as agent_name
+            FROM dim_user du
+            WHERE EXISTS (
+                SELECT 1 FROM fact_conversations fc WHERE fc.user_id = du.user_id
+            )
+            ORDER BY du.full_name
         """
-
         results = conn.execute(query).fetchall()
-
         return jsonify([dict_from_row(row) for row in results])
     finally:
         conn.close()
 
 
-@app.route("/api/operations/demand-signal-trend")
-@login_required
-def get_demand_signal_trend():
-    conn = get_db_connection()
-    date_filter = request.args.get("date", "30")
-
-    try:
-        start_date, end_date = parse_date_filter(date_filter)
-
-        if start_date and end_date:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    COUNT(CASE WHEN fcs.intent IN ('purchase', 'request_info', 'seek_advice') THEN 1 END) as demand_signal
-                FROM fact_conversations fc
-                JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-                WHERE fc.created_at >= ? AND fc.created_at <= ?
-                GROUP BY DATE(fc.created_at)
-                ORDER BY date
-            """
-            results = conn.execute(query, (start_date, end_date)).fetchall()
-        else:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    COUNT(CASE WHEN fcs.intent IN ('purchase', 'request_info', 'seek_advice') THEN 1 END) as demand_signal
-                FROM fact_conversations fc
-                JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-                GROUP BY DATE(fc.created_at)
-                ORDER BY date
-            """
-            results = conn.execute(query).fetchall()
-
-        return jsonify(
-            {
-                "labels": [row["date"] for row in results],
-                "data": [row["demand_signal"] for row in results],
-            }
-        )
-    finally:
-        conn.close()
+# ==================== MODULE BUNDLES ====================
 
 
-@app.route("/api/operations/demand-change-alert")
+@app.route("/api/<module>/bundle")
 @login_required
-def get_demand_change_alert():
-    conn = get_db_connection()
+@cached(ttl=120)
+def get_module_bundle(module):
+    """Every widget payload of a module, computed in one pass"""
+    if module not in WIDGETS:
+        response = jsonify({"error": f"Unknown module: {module}"})
+        response.status_code = 404
+        return response
+    payloads, failed = run_bundle(module, request.args)
+    response = jsonify(payloads)
+    if failed:
+        # Not cached, so the next request recomputes the failed widgets
+        response.status_code = 500
+    return response
 
-    try:
-        query = """
-            SELECT
-                dc.crop_name,
-                COUNT(*) as current_demand,
-                'stable' as trend,
-                0 as change_pct
-            FROM fact_conversation_entities fce
-            JOIN dim_crops dc ON fce.entity_code = dc.crop_code
-            WHERE fce.entity_type = 'crop'
-            GROUP BY dc.crop_name
-            ORDER BY current_demand DESC
-            LIMIT 10
-        """
 
-        results = conn.execute(query).fetchall()
-        return jsonify([dict_from_row(row) for row in results])
-    finally:
-        conn.close()
+# ==================== HOME MODULE APIs ====================
 
 
-@app.route("/api/operations/crop-pest-heatmap")
+@app.route("/api/home/kpis")
 @login_required
-def get_crop_pest_heatmap():
-    conn = get_db_connection()
+@cached(ttl=120)
+@widget("home", "kpis")
+def get_home_kpis(scope):
+    days = daily_activity(scope)
 
-    try:
-        query = """
-            SELECT
-                crop_name,
-                pest_name,
-                co_mentions
-            FROM mart_crop_pest_matrix
-            ORDER BY co_mentions DESC
-            LIMIT 100
-        """
-
-        results = conn.execute(query).fetchall()
+    rated = sum(day["sentiment_n"] for day in days)
+    health_score = sum(day["health_sum"] for day in days) / rated if rated else None
 
-        return jsonify([dict_from_row(row) for row in results])
-    finally:
-        conn.close()
+    return {
+        "alert_count": sum(day["alerts"] for day in days),
+        "market_health": round(health_score or 50, 1),
+        "activity_count": sum(day["activity"] for day in days),
+    }
 
 
-@app.route("/api/operations/problem-trend")
+@app.route("/api/home/volume-sentiment")
 @login_required
-def get_problem_trend():
-    conn = get_db_connection()
-    date_filter = request.args.get("date", "30")
-
-    try:
-        start_date, end_date = parse_date_filter(date_filter)
-
-        if start_date and end_date:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    fcs.primary_topic as topic,
-                    COUNT(*) as count
-                FROM fact_conversations fc
-                JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-                WHERE fcs.primary_topic IN ('pest', 'disease', 'weed', 'crop_damage')
-                AND fc.created_at >= ? AND fc.created_at <= ?
-                GROUP BY DATE(fc.created_at), fcs.primary_topic
-                ORDER BY date
-            """
-            results = conn.execute(query, (start_date, end_date)).fetchall()
-        else:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    fcs.primary_topic as topic,
-                    COUNT(*) as count
-                FROM fact_conversations fc
-                JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-                WHERE fcs.primary_topic IN ('pest', 'disease', 'weed', 'crop_damage')
-                GROUP BY DATE(fc.created_at), fcs.primary_topic
-                ORDER BY date
-            """
-            results = conn.execute(query).fetchall()
-
-        dates = sorted(list(set([row["date"] for row in results])))
-        topics = ["pest", "disease", "weed", "crop_damage"]
-
-        datasets = {}
-        for topic in topics:
-            datasets[topic] = [0] * len(dates)
-
-        for row in results:
-            if row["topic"] in topics and row["date"] in dates:
-                date_idx = dates.index(row["date"])
-                datasets[row["topic"]][date_idx] = row["count"]
-
-        return jsonify(
-            {
-                "labels": dates,
-                "datasets": [
-                    {"label": topic.capitalize(), "data": data}
-                    for topic, data in datasets.items()
-                ],
-            }
+@cached(ttl=300)
+@widget("home", "volume-sentiment")
+def get_volume_sentiment(scope):
+    days = [day for day in daily_activity(scope) if day["volume"]]
+
+    sentiment = []
+    for day in days:
+        score = (
+            day["sentiment_sum"] / day["sentiment_n"] if day["sentiment_n"] else None
         )
-    finally:
-        conn.close()
+        sentiment.append(round(score * 100, 2) if score else 0)
 
+    return {
+        "labels": [day["date"] for day in days],
+        "volume": [day["volume"] for day in days],
+        "sentiment": sentiment,
+    }
 
-@app.route("/api/operations/problem-sentiment")
-def get_problem_sentiment():
-    conn = get_db_connection()
 
-    try:
-        query = """
-            SELECT
-                fcs.primary_topic as topic,
-                fcs.overall_sentiment as sentiment,
-                COUNT(*) as count
-            FROM fact_conversation_semantics fcs
-            WHERE fcs.primary_topic IN ('pest', 'disease', 'weed')
-            GROUP BY fcs.primary_topic, fcs.overall_sentiment
-            ORDER BY count DESC
-        """
+@app.route("/api/home/conversation-distribution")
+@login_required
+@cached(ttl=600)
+@widget("home", "conversation-distribution")
+def get_conversation_distribution(scope):
+    results = topic_counts(scope)[:5]
 
-        results = conn.execute(query).fetchall()
+    return {
+        "labels": [row["primary_topic"] for row in results],
+        "data": [row["count"] for row in results],
+    }
 
-        topics = sorted(list(set([row["topic"] for row in results])))
 
-        positive = [0] * len(topics)
-        neutral = [0] * len(topics)
-        negative = [0] * len(topics)
+@app.route("/api/home/market-share")
+@login_required
+@cached(ttl=600)
+@widget("home", "market-share")
+def get_market_share(scope):
+    results = company_mentions(scope)
 
-        for row in results:
-            if row["topic"] in topics:
-                idx = topics.index(row["topic"])
-                if row["sentiment"] == "positive":
-                    positive[idx] = row["count"]
-                elif row["sentiment"] == "neutral":
-                    neutral[idx] = row["count"]
-                elif row["sentiment"] == "negative":
-                    negative[idx] = row["count"]
+    return {
+        "labels": [row["company_name"] for row in results],
+        "data": [row["mentions"] for row in results],
+    }
 
-        return jsonify(
-            {
-                "labels": topics,
-                "datasets": [
-                    {"label": "Positive", "data": positive},
-                    {"label": "Neutral", "data": neutral},
-                    {"label": "Negative", "data": negative},
-                ],
-            }
-        )
-    finally:
-        conn.close()
 
+@app.route("/api/home/competitive-position")
+@login_required
+@cached(ttl=600)
+@widget("home", "competitive-position")
+def get_competitive_position(scope):
+    total = brand_conversation_total(scope)
+
+    return [
+        {
+            "brand": row["company_name"],
+            "mentions": row["mentions"],
+            "share": round(row["mentions"] * 100.0 / total, 1) if total else None,
+            "score": 0,
+        }
+        for row in company_mentions(scope)[:3]
+    ]
 
-@app.route("/api/operations/crop-keywords")
-def get_crop_keywords():
-    conn = get_db_connection()
 
-    try:
-        # Get all crops with their mention counts
-        query = """
-            SELECT
-                dc.crop_name as word,
-                COUNT(DISTINCT fce.conversation_id) as weight
-            FROM fact_conversation_entities fce
-            JOIN dim_crops dc ON fce.entity_code = dc.crop_code
-            WHERE fce.entity_type = 'crop'
-            AND dc.crop_name NOT IN ('_OTHERS (PLEASE SPECIFY)', 'No Crop')
-            AND dc.crop_name IS NOT NULL
-            GROUP BY dc.crop_name
-            ORDER BY weight DESC
-            LIMIT 50
-        """
+@app.route("/api/home/conversation-drivers")
+@login_required
+@cached(ttl=600)
+@widget("home", "conversation-drivers")
+def get_conversation_drivers(scope):
+    results = intent_counts(scope)[:10]
 
-        results = conn.execute(query).fetchall()
+    return {
+        "labels": [row["intent"] for row in results],
+        "data": [row["count"] for row in results],
+    }
 
-        if len(results) == 0:
-            # Fallback: get from dim_crops directly
-            query2 = """
-                SELECT DISTINCT crop_name as word, 1 as weight
-                FROM dim_crops
-                WHERE crop_name NOT IN ('_OTHERS (PLEASE SPECIFY)', 'No Crop')
-                AND crop_name IS NOT NULL
-                AND crop_type != '(blank)'
-                LIMIT 50
-            """
-            results = conn.execute(query2).fetchall()
 
-        return jsonify(
-            [
-                {"text": row["word"], "size": row["weight"]}
-                for row in results
-                if row["word"]
-            ]
-        )
-    finally:
-        conn.close()
+# ==================== MARKETING MODULE APIs ====================
 
 
-@app.route("/api/operations/solution-flow")
-def get_solution_flow():
-    conn = get_db_connection()
+@app.route("/api/marketing/brand-health-trend")
+@login_required
+@cached(ttl=300)
+@widget("marketing", "brand-health-trend")
+def get_brand_health_trend(scope):
+    conn = scope.conn
+    source, params = scope.mart("mart_daily_company_kpis")
+    day_clause, day_params = scope.day_clause()
+
+    query = f"""
+        SELECT
+            kpi_date as date,
+            SUM(total_mentions) as volume,
+            50 as health
+        FROM {source} m
+        WHERE company_code = ?
+        {day_clause}
+        GROUP BY kpi_date
+        ORDER BY date
+    """
+    results = conn.execute(
+        query, [*params, COROMANDEL_COMPANY_CODE, *day_params]
+    ).fetchall()
+
+    return {
+        "labels": [row["date"] for row in results],
+        "volume": [row["volume"] for row in results],
+        "health": [
+            round(row["health"], 2) if row["health"] is not None else 50
+            for row in results
+        ],
+    }
 
-    try:
-        query = """
-            SELECT
-                crop_name,
-                pest_name,
-                brand_name,
-                flow_count
-            FROM mart_crop_pest_brand_flow
-            ORDER BY flow_count DESC
-            LIMIT 50
-        """
 
-        results = conn.execute(query).fetchall()
+@app.route("/api/marketing/conv-volume-by-topic")
+@login_required
+@cached(ttl=300)
+@widget("marketing", "conv-volume-by-topic")
+def get_conv_volume_by_topic(scope):
+    conn = scope.conn
+    source, params = scope.mart("mart_daily_topic_kpis")
+    day_clause, day_params = scope.day_clause()
+
+    query = f"""
+        SELECT
+            kpi_date as date,
+            primary_topic,
+            SUM(conversations) as count
+        FROM {source} m
+        WHERE 1 = 1
+        {day_clause}
+        GROUP BY kpi_date, primary_topic
+        ORDER BY date, count DESC
+    """
+    results = conn.execute(query, [*params, *day_params]).fetchall()
+
+    # Top 5 topics by volume, the rest summed into "Other"
+    return pivot(
+        results,
+        "date",
+        "primary_topic",
+        "count",
+        top=5,
+        other=OTHER,
+        fill_dates=True,
+    )
 
-        return jsonify([dict_from_row(row) for row in results])
-    finally:
-        conn.close()
 
+@app.route("/api/marketing/brand-keywords")
+@login_required
+@cached(ttl=600)
+@widget("marketing", "brand-keywords")
+def get_brand_keywords(scope):
+    conn = scope.conn
+
+    dims = dimensions.get()
+
+    query = f"""
+        SELECT
+            fce.entity_code,
+            COUNT(*) as weight
+        FROM fact_conversation_entities fce
+        WHERE fce.entity_type = 'brand'
+        AND fce.entity_code IN (SELECT value FROM json_each(?))
+        {scope.filter_clause("fce", probe=True)}
+        GROUP BY fce.entity_code
+    """
+    brand_codes = dims.brand_codes(COROMANDEL_COMPANY_CODE)
+    results = dimensions.label_counts(
+        conn.execute(query, (json.dumps(brand_codes),)).fetchall(),
+        dims.brand_names(),
+        "weight",
+    )
+    results.sort(key=lambda row: (-row["weight"], row["name"]))
+
+    return [{"text": row["name"], "size": row["weight"]} for row in results[:50]]
 
-@app.route("/api/operations/solution-effectiveness")
-def get_solution_effectiveness():
-    conn = get_db_connection()
 
-    try:
-        query = """
-            SELECT
-                db.brand_name as solution,
-                COUNT(DISTINCT fce.conversation_id) as effectiveness
-            FROM fact_conversation_entities fce
-            JOIN dim_brands db ON fce.entity_code = db.brand_code
-            WHERE fce.entity_type = 'brand'
-            GROUP BY db.brand_name
-            ORDER BY effectiveness DESC
-            LIMIT 10
-        """
+@app.route("/api/marketing/market-share-trend")
+@login_required
+@cached(ttl=300)
+@widget("marketing", "market-share-trend")
+def get_market_share_trend(scope):
+    conn = scope.conn
+    source, params = scope.mart("mart_daily_company_kpis")
+    day_clause, day_params = scope.day_clause()
+
+    query = f"""
+        SELECT
+            kpi_date as date,
+            company_name,
+            SUM(unique_conversations) as mentions
+        FROM {source} m
+        WHERE company_code IN (?, ?, ?, ?)
+        {day_clause}
+        GROUP BY kpi_date, company_name
+        ORDER BY date
+    """
+    results = conn.execute(
+        query, [*params, *tracked_company_codes(), *day_params]
+    ).fetchall()
+
+    return pivot(results, "date", "company_name", "mentions", fill_dates=True)
 
-        results = conn.execute(query).fetchall()
 
-        return jsonify(
-            {
-                "labels": [row["solution"] for row in results],
-                "data": [row["effectiveness"] for row in results],
-            }
-        )
-    finally:
-        conn.close()
+@app.route("/api/marketing/competitive-landscape")
+@login_required
+@cached(ttl=600)
+@widget("marketing", "competitive-landscape")
+def get_competitive_landscape(scope):
+    return [
+        {
+            "company_name": row["company_name"],
+            "x": row["mentions"],
+            "y": 0,
+            "r": row["mentions"],
+        }
+        for row in company_mentions(scope)
+    ]
 
 
-@app.route("/api/operations/solution-sentiment")
-def get_solution_sentiment():
-    conn = get_db_connection()
-    date_filter = request.args.get("date", "30")
+@app.route("/api/marketing/sentiment-by-competitor")
+@login_required
+@cached(ttl=300)
+@widget("marketing", "sentiment-by-competitor")
+def get_sentiment_by_competitor(scope):
+    conn = scope.conn
+    source, params = scope.mart("mart_daily_company_kpis")
+    day_clause, day_params = scope.day_clause()
+
+    query = f"""
+        SELECT
+            kpi_date as date,
+            company_name,
+            50 as sentiment
+        FROM {source} m
+        WHERE company_code IN (?, ?, ?, ?)
+        {day_clause}
+        GROUP BY kpi_date, company_name
+        ORDER BY date
+    """
+    results = conn.execute(
+        query, [*params, *tracked_company_codes(), *day_params]
+    ).fetchall()
+
+    # Days a company has no row stay null, so the line shows a gap
+    return pivot(
+        results,
+        "date",
+        "company_name",
+        lambda row: round(row["sentiment"], 2) if row["sentiment"] is not None else 50,
+        fill=None,
+        fill_dates=True,
+    )
 
-    try:
-        start_date, end_date = parse_date_filter(date_filter)
-
-        if start_date and end_date:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    50 as sentiment
-                FROM fact_conversations fc
-                JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
-                WHERE fce.entity_type = 'brand'
-                AND fc.created_at >= ? AND fc.created_at <= ?
-                GROUP BY DATE(fc.created_at)
-                HAVING COUNT(*) > 0
-                ORDER BY date
-            """
-            results = conn.execute(query, (start_date, end_date)).fetchall()
-        else:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    50 as sentiment
-                FROM fact_conversations fc
-                JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
-                WHERE fce.entity_type = 'brand'
-                GROUP BY DATE(fc.created_at)
-                HAVING COUNT(*) > 0
-                ORDER BY date
-            """
-            results = conn.execute(query).fetchall()
 
-        return jsonify(
-            {
-                "labels": [row["date"] for row in results],
-                "data": [
-                    round(row["sentiment"], 2) if row["sentiment"] is not None else None
-                    for row in results
-                ],
-            }
-        )
-    finally:
-        conn.close()
+@app.route("/api/marketing/brand-crop-association")
+@login_required
+@cached(ttl=600)
+@widget("marketing", "brand-crop-association")
+def get_brand_crop_association(scope):
+    conn = scope.conn
+    source, params = scope.mart("mart_brand_crop_matrix")
+
+    dims = dimensions.get()
+
+    # Get ALL Rallis brands with crop associations
+    query = f"""
+        SELECT
+            brand_code,
+            crop_name as label,
+            co_mentions as value
+        FROM {source} m
+        WHERE brand_code IN (SELECT value FROM json_each(?))
+        AND co_mentions > 0
+    """
+    brand_codes = dims.brand_codes(COROMANDEL_COMPANY_CODE)
+    results = conn.execute(query, [*params, json.dumps(brand_codes)]).fetchall()
+
+    associations = [
+        {
+            "parent": dims.brands[row["brand_code"]][0],
+            "label": row["label"],
+            "value": row["value"],
+        }
+        for row in results
+    ]
+    associations.sort(key=lambda row: (row["parent"], -row["value"]))
+    return associations
+
 
+# ==================== OPERATIONS MODULE APIs ====================
 
-@app.route("/api/operations/sentiment-by-crop")
-def get_sentiment_by_crop():
-    conn = get_db_connection()
 
+@app.route("/api/operations/urgent-issues")
+@login_required
+@cached(ttl=60)
+@widget("operations", "urgent-issues")
+def get_urgent_issues(scope):
+    conn = scope.conn
+
+    query = f"""
+        SELECT
+            fc.conversation_id,
+            fc.created_at,
+            fc.user_text,
+            fcs.urgency,
+            fcs.primary_topic,
+            fcs.overall_sentiment
+        FROM fact_conversations fc
+        JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+        WHERE fcs.urgency IN ('high', 'critical')
+        {scope.filter_clause("fc")}
+        ORDER BY fc.created_at DESC
+        LIMIT 50
+    """
+
+    results = conn.execute(query).fetchall()
+
+    return [dict_from_row(row) for row in results]
+
+
+@app.route("/api/operations/alert-feed")
+@login_required
+@cached(ttl=60)
+def get_alert_feed():
+    """Alerts by priority and recency, paged with `cursor`, polled with `since`"""
+    conn = get_db_connection()
     try:
-        query = """
-            SELECT
-                dc.crop_name,
-                COUNT(*) as count
-            FROM fact_conversation_entities fce
-            JOIN dim_crops dc ON fce.entity_code = dc.crop_code
-            WHERE fce.entity_type = 'crop'
-            AND dc.crop_name NOT IN ('_OTHERS (PLEASE SPECIFY)', 'No Crop')
-            GROUP BY dc.crop_name
-            ORDER BY count DESC
-        """
+        return jsonify(alerts.alert_feed(conn, request.args))
+    except alerts.CursorError as e:
+        response = jsonify({"error": str(e)})
+        response.status_code = 400
+        return response
+    finally:
+        conn.close()
 
-        results = conn.execute(query).fetchall()
 
-        # Get top 10 crops by total mentions
-        crop_totals = {}
-        for row in results:
-            if row["crop_name"] not in crop_totals:
-                crop_totals[row["crop_name"]] = 0
-            crop_totals[row["crop_name"]] += row["count"]
+@app.route("/api/operations/demand-signal-trend")
+@login_required
+@cached(ttl=300)
+@widget("operations", "demand-signal-trend")
+def get_demand_signal_trend(scope):
+    conn = scope.conn
+    source, params = scope.mart("mart_daily_topic_kpis")
+    day_clause, day_params = scope.day_clause()
+
+    query = f"""
+        SELECT
+            kpi_date as date,
+            SUM(CASE WHEN intent IN ('purchase', 'request_info', 'seek_advice') THEN conversations ELSE 0 END) as demand_signal
+        FROM {source} m
+        WHERE 1 = 1
+        {day_clause}
+        GROUP BY kpi_date
+        ORDER BY date
+    """
+    results = conn.execute(query, [*params, *day_params]).fetchall()
+
+    return {
+        "labels": [row["date"] for row in results],
+        "data": [row["demand_signal"] for row in results],
+    }
 
-        top_crops = sorted(crop_totals.items(), key=lambda x: x[1], reverse=True)[:10]
-        crops = [c[0] for c in top_crops]
 
-        positive = [0] * len(crops)
-        neutral = [0] * len(crops)
-        negative = [0] * len(crops)
+@app.route("/api/operations/demand-change-alert")
+@login_required
+@cached(ttl=600)
+@widget("operations", "demand-change-alert")
+def get_demand_change_alert(scope):
+    return [
+        {
+            "crop_name": row["crop_name"],
+            "current_demand": row["mentions"],
+            "trend": "stable",
+            "change_pct": 0,
+        }
+        for row in crop_mentions(scope)[:10]
+    ]
 
-        return jsonify(
-            {
-                "labels": crops,
-                "datasets": [
-                    {"label": "Positive", "data": positive},
-                    {"label": "Neutral", "data": neutral},
-                    {"label": "Negative", "data": negative},
-                ],
-            }
-        )
-    finally:
-        conn.close()
 
+@app.route("/api/operations/crop-pest-heatmap")
+@login_required
+@cached(ttl=600)
+@widget("operations", "crop-pest-heatmap")
+def get_crop_pest_heatmap(scope):
+    conn = scope.conn
+    source, params = scope.mart("mart_crop_pest_matrix")
 
-# ==================== ENGAGEMENT MODULE APIs ====================
+    query = f"""
+        SELECT
+            crop_name,
+            pest_name,
+            co_mentions
+        FROM {source} m
+        ORDER BY co_mentions DESC
+        LIMIT 100
+    """
 
+    results = conn.execute(query, params).fetchall()
 
-@app.route("/api/engagement/conv-by-region")
-def get_conv_by_region():
-    conn = get_db_connection()
+    return [dict_from_row(row) for row in results]
 
-    try:
-        query = """
-            SELECT
-                du.district as region,
-                COUNT(*) as count
-            FROM fact_conversations fc
-            JOIN dim_user du ON fc.user_id = du.user_id
-            GROUP BY du.district
-            ORDER BY count DESC
-            LIMIT 20
-        """
 
-        results = conn.execute(query).fetchall()
+@app.route("/api/operations/problem-trend")
+@login_required
+@cached(ttl=300)
+@widget("operations", "problem-trend")
+def get_problem_trend(scope):
+    conn = scope.conn
+    source, params = scope.mart("mart_daily_topic_kpis")
+    day_clause, day_params = scope.day_clause()
+
+    query = f"""
+        SELECT
+            kpi_date as date,
+            primary_topic as topic,
+            SUM(conversations) as count
+        FROM {source} m
+        WHERE primary_topic IN ('pest', 'disease', 'weed', 'crop_damage')
+        {day_clause}
+        GROUP BY kpi_date, primary_topic
+        ORDER BY date
+    """
+    results = conn.execute(query, [*params, *day_params]).fetchall()
+
+    return pivot(
+        results,
+        "date",
+        "topic",
+        "count",
+        keys=["pest", "disease", "weed", "crop_damage"],
+        fill_dates=True,
+        name=str.capitalize,
+    )
 
-        return jsonify(
-            {
-                "labels": [row["region"] for row in results],
-                "data": [row["count"] for row in results],
-            }
-        )
-    finally:
-        conn.close()
 
+@app.route("/api/operations/problem-sentiment")
+@cached(ttl=600)
+@widget("operations", "problem-sentiment")
+def get_problem_sentiment(scope):
+    conn = scope.conn
+
+    query = f"""
+        SELECT
+            fcs.primary_topic as topic,
+            fcs.overall_sentiment as sentiment,
+            COUNT(*) as count
+        FROM fact_conversation_semantics fcs
+        WHERE fcs.primary_topic IN ('pest', 'disease', 'weed')
+        {scope.filter_clause("fcs")}
+        GROUP BY fcs.primary_topic, fcs.overall_sentiment
+        ORDER BY count DESC
+    """
+
+    results = conn.execute(query).fetchall()
+
+    topics = sorted(list(set([row["topic"] for row in results])))
+
+    positive = [0] * len(topics)
+    neutral = [0] * len(topics)
+    negative = [0] * len(topics)
+
+    for row in results:
+        if row["topic"] in topics:
+            idx = topics.index(row["topic"])
+            if row["sentiment"] == "positive":
+                positive[idx] = row["count"]
+            elif row["sentiment"] == "neutral":
+                neutral[idx] = row["count"]
+            elif row["sentiment"] == "negative":
+                negative[idx] = row["count"]
+
+    return {
+        "labels": topics,
+        "datasets": [
+            {"label": "Positive", "data": positive},
+            {"label": "Neutral", "data": neutral},
+            {"label": "Negative", "data": negative},
+        ],
+    }
 
-@app.route("/api/engagement/team-urgency")
-def get_team_urgency():
-    conn = get_db_connection()
 
-    try:
+@app.route("/api/operations/crop-keywords")
+@cached(ttl=600)
+@widget("operations", "crop-keywords")
+def get_crop_keywords(scope):
+    # Get all crops with their mention counts
+    results = sorted(
+        (
+            row
+            for row in crop_mentions(scope)
+            if row["crop_name"] and row["crop_name"] not in EXCLUDED_CROP_NAMES
+        ),
+        key=lambda row: row["conversations"],
+        reverse=True,
+    )[:50]
+    words = [
+        {"text": row["crop_name"], "size": row["conversations"]} for row in results
+    ]
+
+    if len(words) == 0:
+        # Fallback: get from dim_crops directly
         query = """
-            SELECT
-                urgency,
-                COUNT(*) as count
-            FROM fact_conversation_semantics
-            GROUP BY urgency
+            SELECT DISTINCT crop_name as word, 1 as weight
+            FROM dim_crops
+            WHERE crop_name NOT IN ('_OTHERS (PLEASE SPECIFY)', 'No Crop')
+            AND crop_name IS NOT NULL
+            AND crop_type != '(blank)'
+            LIMIT 50
         """
+        results = scope.conn.execute(query).fetchall()
+        words = [
+            {"text": row["word"], "size": row["weight"]}
+            for row in results
+            if row["word"]
+        ]
 
-        results = conn.execute(query).fetchall()
+    return words
 
-        return jsonify(
-            {
-                "labels": [row["urgency"] for row in results],
-                "data": [row["count"] for row in results],
-            }
-        )
-    finally:
-        conn.close()
 
+@app.route("/api/operations/solution-flow")
+@cached(ttl=600)
+@widget("operations", "solution-flow")
+def get_solution_flow(scope):
+    conn = scope.conn
+    source, params = scope.mart("mart_crop_pest_brand_flow")
 
-@app.route("/api/engagement/team-intent")
-def get_team_intent():
-    conn = get_db_connection()
+    query = f"""
+        SELECT
+            crop_name,
+            pest_name,
+            brand_name,
+            flow_count
+        FROM {source} m
+        ORDER BY flow_count DESC
+        LIMIT 50
+    """
 
-    try:
-        query = """
-            SELECT
-                intent,
-                COUNT(*) as count
-            FROM fact_conversation_semantics
-            GROUP BY intent
-            ORDER BY count DESC
-            LIMIT 5
-        """
+    results = conn.execute(query, params).fetchall()
 
-        results = conn.execute(query).fetchall()
+    return [dict_from_row(row) for row in results]
 
-        return jsonify(
-            {
-                "labels": [row["intent"] for row in results],
-                "data": [row["count"] for row in results],
-            }
-        )
-    finally:
-        conn.close()
 
+@app.route("/api/operations/solution-effectiveness")
+@cached(ttl=600)
+@widget("operations", "solution-effectiveness")
+def get_solution_effectiveness(scope):
+    conn = scope.conn
+
+    # Conversations per brand name; one naming two codes of a brand counts once
+    query = f"""
+        SELECT
+            n.name,
+            COUNT(DISTINCT fce.conversation_id) as effectiveness
+        FROM fact_conversation_entities fce
+        JOIN {dimensions.NAMES} n ON n.code = fce.entity_code
+        WHERE fce.entity_type = 'brand'
+        {scope.filter_clause("fce", probe=True)}
+        GROUP BY n.name
+        ORDER BY effectiveness DESC, n.name
+        LIMIT 10
+    """
+    names = dimensions.name_pairs(dimensions.get().brand_names())
+    results = conn.execute(query, (names,)).fetchall()
+
+    return {
+        "labels": [row["name"] for row in results],
+        "data": [row["effectiveness"] for row in results],
+    }
 
-@app.route("/api/engagement/quality-by-region")
-def get_quality_by_region():
-    conn = get_db_connection()
 
-    try:
-        query = """
-            SELECT
-                du.district as region,
-                fcs.overall_sentiment as sentiment,
-                COUNT(*) as count
-            FROM fact_conversations fc
-            JOIN dim_user du ON fc.user_id = du.user_id
-            JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-            GROUP BY du.district, fcs.overall_sentiment
-            ORDER BY count DESC
-            LIMIT 60
-        """
+@app.route("/api/operations/solution-sentiment")
+@cached(ttl=300)
+@widget("operations", "solution-sentiment")
+def get_solution_sentiment(scope):
+    conn = scope.conn
+    source, params = scope.mart("mart_brand_mentions")
+    day_clause, day_params = scope.day_clause("period_start")
+
+    query = f"""
+        SELECT
+            period_start as date,
+            50 as sentiment
+        FROM {source} m
+        WHERE period_type = 'daily'
+        {day_clause}
+        GROUP BY period_start
+        ORDER BY date
+    """
+    results = conn.execute(query, [*params, *day_params]).fetchall()
+
+    return {
+        "labels": [row["date"] for row in results],
+        "data": [
+            round(row["sentiment"], 2) if row["sentiment"] is not None else None
+            for row in results
+        ],
+    }
 
-        results = conn.execute(query).fetchall()
 
-        regions = sorted(list(set([row["region"] for row in results])))[:10]
+@app.route("/api/operations/sentiment-by-crop")
+@cached(ttl=600)
+@widget("operations", "sentiment-by-crop")
+def get_sentiment_by_crop(scope):
+    # Get top 10 crops by total mentions
+    crops = [
+        row["crop_name"]
+        for row in crop_mentions(scope)
+        if row["crop_name"] is not None and row["crop_name"] not in EXCLUDED_CROP_NAMES
+    ][:10]
+
+    positive = [0] * len(crops)
+    neutral = [0] * len(crops)
+    negative = [0] * len(crops)
+
+    return {
+        "labels": crops,
+        "datasets": [
+            {"label": "Positive", "data": positive},
+            {"label": "Neutral", "data": neutral},
+            {"label": "Negative", "data": negative},
+        ],
+    }
 
-        positive = [0] * len(regions)
-        neutral = [0] * len(regions)
-        negative = [0] * len(regions)
 
-        for row in results:
-            if row["region"] in regions:
-                idx = regions.index(row["region"])
-                if row["sentiment"] == "positive":
-                    positive[idx] = row["count"]
-                elif row["sentiment"] == "neutral":
-                    neutral[idx] = row["count"]
-                elif row["sentiment"] == "negative":
-                    negative[idx] = row["count"]
+# ==================== ENGAGEMENT MODULE APIs ====================
 
-        return jsonify(
-            {
-                "labels": regions,
-                "datasets": [
-                    {"label": "Positive", "data": positive},
-                    {"label": "Neutral", "data": neutral},
-                    {"label": "Negative", "data": negative},
-                ],
-            }
-        )
-    finally:
-        conn.close()
 
+@app.route("/api/engagement/conv-by-region")
+@cached(ttl=600)
+@widget("engagement", "conv-by-region")
+def get_conv_by_region(scope):
+    conn = scope.conn
+
+    query = f"""
+        SELECT
+            du.district as region,
+            COUNT(*) as count
+        FROM fact_conversations fc
+        JOIN dim_user du ON fc.user_id = du.user_id
+        WHERE 1 = 1
+        {scope.filter_clause("fc")}
+        GROUP BY du.district
+        ORDER BY count DESC
+        LIMIT 20
+    """
+
+    results = conn.execute(query).fetchall()
+
+    return {
+        "labels": [row["region"] for row in results],
+        "data": [row["count"] for row in results],
+    }
 
-@app.route("/api/engagement/agent-scorecard")
-def get_agent_scorecard():
-    conn = get_db_connection()
 
-    try:
-        # Simulated agent performance data
-        query = """
-            SELECT
-                du.full_name as agent_name,
-                COUNT(fc.conversation_id) as total_convs,
-                AVG(CASE
-                    WHEN fcs.overall_sentiment = 'positive' THEN 100
-                    WHEN fcs.overall_sentiment = 'neutral' THEN 50
-                    WHEN fcs.overall_sentiment = 'negative' THEN 0
-                END) as avg_sentiment,
-                COUNT(CASE WHEN fcs.urgency IN ('high', 'critical') THEN 1 END) as urgent_handled
-            FROM fact_conversations fc
-            JOIN dim_user du ON fc.user_id = du.user_id
-            JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-            GROUP BY du.full_name
-            ORDER BY total_convs DESC
-            LIMIT 20
-        """
+@app.route("/api/engagement/team-urgency")
+@cached(ttl=600)
+@widget("engagement", "team-urgency")
+def get_team_urgency(scope):
+    conn = scope.conn
 
-        results = conn.execute(query).fetchall()
-        return jsonify([dict_from_row(row) for row in results])
-    finally:
-        conn.close()
+    query = f"""
+        SELECT
+            fcs.urgency,
+            COUNT(*) as count
+        FROM fact_conversation_semantics fcs
+        WHERE 1 = 1
+        {scope.filter_clause("fcs")}
+        GROUP BY fcs.urgency
+    """
 
+    results = conn.execute(query).fetchall()
 
-@app.route("/api/engagement/agent-leaderboard")
-def get_agent_leaderboard():
-    conn = get_db_connection()
+    return {
+        "labels": [row["urgency"] for row in results],
+        "data": [row["count"] for row in results],
+    }
 
-    try:
-        query = """
-            SELECT
-                du.full_name as agent_name,
-                COUNT(fc.conversation_id) as conversations,
-                AVG(CASE
-                    WHEN fcs.overall_sentiment = 'positive' THEN 3
-                    WHEN fcs.overall_sentiment = 'neutral' THEN 2
-                    WHEN fcs.overall_sentiment = 'negative' THEN 1
-                END) as performance_score
-            FROM fact_conversations fc
-            JOIN dim_user du ON fc.user_id = du.user_id
-            JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-            GROUP BY du.full_name
-            ORDER BY performance_score DESC, conversations DESC
-            LIMIT 10
-        """
 
-        results = conn.execute(query).fetchall()
-        return jsonify([dict_from_row(row) for row in results])
-    finally:
-        conn.close()
+@app.route("/api/engagement/team-intent")
+@cached(ttl=600)
+@widget("engagement", "team-intent")
+def get_team_intent(scope):
+    results = intent_counts(scope)[:5]
 
+    return {
+        "labels": [row["intent"] for row in results],
+        "data": [row["count"] for row in results],
+    }
 
-@app.route("/api/engagement/agent-perf-trend")
-def get_agent_perf_trend():
-    conn = get_db_connection()
-    date_filter = request.args.get("date", "30")
 
-    try:
-        start_date, end_date = parse_date_filter(date_filter)
-
-        if start_date and end_date:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    du.full_name as agent,
-                    COUNT(*) as conversations
-                FROM fact_conversations fc
-                JOIN dim_user du ON fc.user_id = du.user_id
-                WHERE fc.created_at >= ? AND fc.created_at <= ?
-                GROUP BY DATE(fc.created_at), du.full_name
-                ORDER BY date
-            """
-            results = conn.execute(query, (start_date, end_date)).fetchall()
-        else:
-            query = """
-                SELECT
-                    DATE(fc.created_at) as date,
-                    du.full_name as agent,
-                    COUNT(*) as conversations
-                FROM fact_conversations fc
-                JOIN dim_user du ON fc.user_id = du.user_id
-                GROUP BY DATE(fc.created_at), du.full_name
-                ORDER BY date
-            """
-            results = conn.execute(query).fetchall()
-
-        dates = sorted(list(set([row["date"] for row in results])))
-        agents = list(set([row["agent"] for row in results]))[:5]  # Top 5 agents
-
-        datasets = {}
-        for agent in agents:
-            datasets[agent] = [0] * len(dates)
-
-        for row in results:
-            if row["agent"] in agents and row["date"] in dates:
-                date_idx = dates.index(row["date"])
-                datasets[row["agent"]][date_idx] = row["conversations"]
+@app.route("/api/engagement/quality-by-region")
+@cached(ttl=600)
+@widget("engagement", "quality-by-region")
+def get_quality_by_region(scope):
+    conn = scope.conn
+
+    query = f"""
+        SELECT
+            du.district as region,
+            fcs.overall_sentiment as sentiment,
+            COUNT(*) as count
+        FROM fact_conversations fc
+        JOIN dim_user du ON fc.user_id = du.user_id
+        JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+        WHERE 1 = 1
+        {scope.filter_clause("fc")}
+        GROUP BY du.district, fcs.overall_sentiment
+        ORDER BY count DESC
+        LIMIT 60
+    """
+
+    results = conn.execute(query).fetchall()
+
+    regions = sorted(list(set([row["region"] for row in results])))[:10]
+
+    positive = [0] * len(regions)
+    neutral = [0] * len(regions)
+    negative = [0] * len(regions)
+
+    for row in results:
+        if row["region"] in regions:
+            idx = regions.index(row["region"])
+            if row["sentiment"] == "positive":
+                positive[idx] = row["count"]
+            elif row["sentiment"] == "neutral":
+                neutral[idx] = row["count"]
+            elif row["sentiment"] == "negative":
+                negative[idx] = row["count"]
+
+    return {
+        "labels": regions,
+        "datasets": [
+            {"label": "Positive", "data": positive},
+            {"label": "Neutral", "data": neutral},
+            {"label": "Negative", "data": negative},
+        ],
+    }
 
-        return jsonify(
-            {
-                "labels": dates,
-                "datasets": [
-                    {"label": agent, "data": data} for agent, data in datasets.items()
-                ],
-            }
-        )
-    finally:
-        conn.close()
 
+@app.route("/api/engagement/agent-scorecard")
+@cached(ttl=600)
+@widget("engagement", "agent-scorecard")
+def get_agent_scorecard(scope):
+    # Simulated agent performance data
+    results = sorted(
+        agent_summary(scope), key=lambda row: row["conversations"], reverse=True
+    )[:20]
+
+    return [
+        {
+            "agent_name": row["agent_name"],
+            "total_convs": row["conversations"],
+            "avg_sentiment": row["avg_sentiment"],
+            "urgent_handled": row["urgent_handled"],
+        }
+        for row in results
+    ]
 
-@app.route("/api/engagement/field-leaders")
-def get_field_leaders():
-    conn = get_db_connection()
 
-    try:
-        query = """
-            SELECT
-                du.full_name as name,
-                COUNT(fc.conversation_id) as x,
-                AVG(CASE
-                    WHEN fcs.overall_sentiment = 'positive' THEN 100
-                    WHEN fcs.overall_sentiment = 'neutral' THEN 50
-                    WHEN fcs.overall_sentiment = 'negative' THEN 0
-                END) as y,
-                COUNT(fc.conversation_id) as r
-            FROM fact_conversations fc
-            JOIN dim_user du ON fc.user_id = du.user_id
-            JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-            GROUP BY du.full_name
-            ORDER BY x DESC
-            LIMIT 20
-        """
+@app.route("/api/engagement/agent-leaderboard")
+@cached(ttl=600)
+@widget("engagement", "agent-leaderboard")
+def get_agent_leaderboard(scope):
+    results = sorted(
+        agent_summary(scope),
+        key=lambda row: (
+            row["performance_score"] is not None,
+            row["performance_score"] or 0,
+            row["conversations"],
+        ),
+        reverse=True,
+    )[:10]
+
+    return [
+        {
+            "agent_name": row["agent_name"],
+            "conversations": row["conversations"],
+            "performance_score": row["performance_score"],
+        }
+        for row in results
+    ]
 
-        results = conn.execute(query).fetchall()
-        return jsonify([dict_from_row(row) for row in results])
-    finally:
-        conn.close()
 
+@app.route("/api/engagement/agent-perf-trend")
+@cached(ttl=300)
+@widget("engagement", "agent-perf-trend")
+def get_agent_perf_trend(scope):
+    conn = scope.conn
+    source, params = scope.mart("mart_daily_agent_kpis")
+    day_clause, day_params = scope.day_clause("m.kpi_date")
+
+    query = f"""
+        SELECT
+            m.kpi_date as date,
+            du.full_name as agent,
+            SUM(m.total_conversations) as conversations
+        FROM {source} m
+        JOIN dim_user du ON m.user_id = du.user_id
+        WHERE 1 = 1
+        {day_clause}
+        GROUP BY m.kpi_date, du.full_name
+        ORDER BY date
+    """
+    results = conn.execute(query, [*params, *day_params]).fetchall()
+
+    # Top 5 agents by conversations over the period
+    return pivot(results, "date", "agent", "conversations", top=5, fill_dates=True)
 
-@app.route("/api/engagement/sentiment-by-entity")
-def get_sentiment_by_entity():
-    conn = get_db_connection()
 
-    try:
-        query = """
-            SELECT
-                fce.entity_type,
-                COUNT(*) as count
-            FROM fact_conversation_entities fce
-            WHERE fce.entity_type IN ('brand', 'crop', 'pest')
-            GROUP BY fce.entity_type
-            ORDER BY count DESC
-        """
+@app.route("/api/engagement/field-leaders")
+@cached(ttl=600)
+@widget("engagement", "field-leaders")
+def get_field_leaders(scope):
+    results = sorted(
+        agent_summary(scope), key=lambda row: row["conversations"], reverse=True
+    )[:20]
+
+    return [
+        {
+            "name": row["agent_name"],
+            "x": row["conversations"],
+            "y": row["avg_sentiment"],
+            "r": row["conversations"],
+        }
+        for row in results
+    ]
 
-        results = conn.execute(query).fetchall()
 
-        entities = sorted(list(set([row["entity_type"] for row in results])))
+@app.route("/api/engagement/sentiment-by-entity")
+@cached(ttl=600)
+@widget("engagement", "sentiment-by-entity")
+def get_sentiment_by_entity(scope):
+    conn = scope.conn
+
+    query = f"""
+        SELECT
+            fce.entity_type,
+            COUNT(*) as count
+        FROM fact_conversation_entities fce
+        WHERE fce.entity_type IN ('brand', 'crop', 'pest')
+        {scope.filter_clause("fce")}
+        GROUP BY fce.entity_type
+        ORDER BY count DESC
+    """
+
+    results = conn.execute(query).fetchall()
+
+    entities = sorted(list(set([row["entity_type"] for row in results])))
+
+    positive = [0] * len(entities)
+    neutral = [0] * len(entities)
+    negative = [0] * len(entities)
+
+    return {
+        "labels": [e.capitalize() for e in entities],
+        "datasets": [
+            {"label": "Positive", "data": positive},
+            {"label": "Neutral", "data": neutral},
+            {"label": "Negative", "data": negative},
+        ],
+    }
 
-        positive = [0] * len(entities)
-        neutral = [0] * len(entities)
-        negative = [0] * len(entities)
 
-        return jsonify(
-            {
-                "labels": [e.capitalize() for e in entities],
-                "datasets": [
-                    {"label": "Positive", "data": positive},
-                    {"label": "Neutral", "data": neutral},
-                    {"label": "Negative", "data": negative},
-                ],
-            }
-        )
-    finally:
-        conn.close()
+@app.route("/api/engagement/topic-distribution")
+@cached(ttl=600)
+@widget("engagement", "topic-distribution")
+def get_topic_distribution(scope):
+    return [
+        {"label": row["primary_topic"], "value": row["count"]}
+        for row in topic_counts(scope)
+    ]
 
 
-@app.route("/api/engagement/topic-distribution")
-def get_topic_distribution():
+@app.route("/api/engagement/training-needs")
+@cached(ttl=600)
+@widget("engagement", "training-needs")
+def get_training_needs(scope):
+    conn = scope.conn
+
+    query = f"""
+        SELECT
+            du.full_name as agent_name,
+            fcs.primary_topic as weak_area,
+            COUNT(CASE WHEN fcs.overall_sentiment = 'negative' THEN 1 END) as negative_count,
+            'Needs training in ' || fcs.primary_topic as recommendation
+        FROM fact_conversations fc
+        JOIN dim_user du ON fc.user_id = du.user_id
+        JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+        WHERE fcs.overall_sentiment = 'negative'
+        {scope.filter_clause("fc")}
+        GROUP BY du.full_name, fcs.primary_topic
+        HAVING COUNT(CASE WHEN fcs.overall_sentiment = 'negative' THEN 1 END) > 2
+        ORDER BY negative_count DESC
+        LIMIT 20
+    """
+
+    results = conn.execute(query).fetchall()
+    return [dict_from_row(row) for row in results]
+
+
+# ==================== SEARCH API ====================
+
+
+@app.route("/api/search")
+@login_required
+@cached(ttl=60)
+def search_transcripts():
+    """Transcripts and entity snippets matching `q`, ranked by BM25"""
     conn = get_db_connection()
-
     try:
-        query = """
-            SELECT
-                primary_topic as label,
-                COUNT(*) as value
-            FROM fact_conversation_semantics
-            GROUP BY primary_topic
-            ORDER BY value DESC
-        """
-
-        results = conn.execute(query).fetchall()
-        return jsonify([dict_from_row(row) for row in results])
+        return jsonify(search.search(conn, request.args))
+    except search.QueryError as e:
+        response = jsonify({"error": str(e)})
+        response.status_code = 400
+        return response
     finally:
         conn.close()
 
 
-@app.route("/api/engagement/training-needs")
-def get_training_needs():
-    conn = get_db_connection()
+# ==================== MAP API ====================
 
-    try:
-        query = """
-            SELECT
-                du.full_name as agent_name,
-                fcs.primary_topic as weak_area,
-                COUNT(CASE WHEN fcs.overall_sentiment = 'negative' THEN 1 END) as negative_count,
-                'Needs training in ' || fcs.primary_topic as recommendation
-            FROM fact_conversations fc
-            JOIN dim_user du ON fc.user_id = du.user_id
-            JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
-            WHERE fcs.overall_sentiment = 'negative'
-            GROUP BY du.full_name, fcs.primary_topic
-            HAVING COUNT(CASE WHEN fcs.overall_sentiment = 'negative' THEN 1 END) > 2
-            ORDER BY negative_count DESC
-            LIMIT 20
-        """
 
-        results = conn.execute(query).fetchall()
-        return jsonify([dict_from_row(row) for row in results])
+@app.route("/api/geo/tiles")
+@login_required
+@cached(ttl=60)
+def get_geo_tiles():
+    """Conversations and sentiment per map tile in `bbox` at `zoom`"""
+    conn = get_db_connection()
+    try:
+        return jsonify(geo.tiles(conn, request.args))
+    except geo.QueryError as e:
+        response = jsonify({"error": str(e)})
+        response.status_code = 400
+        return response
     finally:
         conn.close()
 
@@ -1575,11 +1400,17 @@ def get_training_needs():
 
 
 @app.route("/api/admin/users")
+@admin_required
 def get_users():
     conn = get_db_connection()
 
     try:
-        query = "SELECT * FROM dim_dashboard_users"
+        query = """
+            SELECT
+                user_id, username, name, title, department, role_type, email,
+                status, created_at
+            FROM dim_dashboard_users
+        """
         results = conn.execute(query).fetchall()
 
         return jsonify([dict_from_row(row) for row in results])
@@ -1698,6 +1529,73 @@ def get_db_stats():
         conn.close()
 
 
+@app.route("/api/export/<dataset>")
+@login_required
+def export_dataset(dataset):
+    """Stream a full dataset as CSV, NDJSON or Parquet (see exports.py)"""
+    return exports.export_response(dataset, request.args)
+
+
+@app.route("/api/stream")
+@login_required
+def stream_updates():
+    """Server-sent KPI and alert updates (see live.py)"""
+    return live.stream_response(request.args)
+
+
+@app.route("/api/admin/db-pool")
+@admin_required
+def get_db_pool_stats():
+    """Connection pool usage and wait metrics for this worker process"""
+    return jsonify(db.pool_stats())
+
+
+@app.route("/api/admin/cache")
+@admin_required
+def get_cache_stats():
+    """Response cache hit/miss counters for this worker process"""
+    return jsonify(response_cache.stats())
+
+
+@app.route("/api/admin/auth")
+@admin_required
+def get_auth_stats():
+    """Login throttling and password verification metrics for this worker process"""
+    return jsonify(auth.stats())
+
+
+@app.route("/api/admin/live")
+@admin_required
+def get_live_stats():
+    """Open live streams and broadcast counters for this worker process"""
+    return jsonify(live.broadcaster.stats())
+
+
+@app.route("/api/admin/perf")
+@admin_required
+def get_perf_stats():
+    """Endpoint and SQL timings, full-scan plans and slow queries for this worker process"""
+    return jsonify(profiling.profiler.report())
+
+
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+
+@app.route("/metrics")
+def get_metrics():
+    """Prometheus metrics for this worker process
+
+    Scrapers authenticate with `Authorization: Bearer $METRICS_TOKEN`; admins
+    can also open it from a logged-in session.
+    """
+    authorized = METRICS_TOKEN and hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    )
+    if not authorized and session.get("user_role") != "admin":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(profiling.profiler.metrics(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/api/debug/companies")
 def debug_companies():
     """Debug endpoint to check company data"""
@@ -1727,7 +1625,7 @@ def debug_companies():
             {
                 "all_companies": [dict_from_row(c) for c in companies],
                 "companies_with_data": [dict_from_row(c) for c in companies_with_data],
-                "configured_competitors": COMPETITORS,
+                "configured_competitors": dimensions.get().competitors,
                 "rallis_code": COROMANDEL_COMPANY_CODE,
             }
         )
@@ -1742,7 +1640,10 @@ def login():
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
-        success, role = auth.check_password(username, password)
+        try:
+            success, role = auth.check_password(username, password, request.remote_addr)
+        except auth.LoginRejected as e:
+            return render_template("login.html", error=str(e)), e.status
         if success:
             session["logged_in"] = True
             session["username"] = username
@@ -1763,7 +1664,11 @@ def register():
         # Only allow admin/customer_admin roles
         if role not in ["admin", "customer_admin"]:
             role = "customer_admin"
-        if auth.add_user(username, password, role):
+        try:
+            added = auth.add_user(username, password, role)
+        except auth.LoginRejected as e:
+            return render_template("register.html", error=str(e)), e.status
+        if added:
             return redirect(url_for("login"))
         else:
             return render_template("register.html", error="User already exists")
@@ -1796,4 +1701,9 @@ if __name__ == "__main__":
         auth.add_user("admin", "adminpass", role="admin")
     if "customer" not in existing_users:
         auth.add_user("customer", "customer123", role="customer_admin")
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    # Development server only; production runs under gunicorn (gunicorn.conf.py)
+    app.run(
+        debug=os.environ.get("FLASK_DEBUG", "0") == "1",
+        host=os.environ.get("FLASK_RUN_HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "5000")),
+    )
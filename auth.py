@@ -1,8 +1,22 @@
 import json
 import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
 from flask import session, redirect, url_for, Blueprint, request, render_template
 from flask_bcrypt import Bcrypt
 
+import db
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, single dev server only
+    fcntl = None
+
 # Bcrypt will be initialized by the Flask app
 bcrypt = Bcrypt()
 
@@ -10,18 +24,392 @@ USERS_FILE = "users.json"
 if os.environ.get("WEBSITE_INSTANCE_ID"):  # Running on Azure
     USERS_FILE = "/home/site/data/users.json"
 
+# "json" (USERS_FILE) or "sqlite" (dim_dashboard_users in the dashboard database)
+AUTH_STORE = os.environ.get("AUTH_STORE", "json").lower()
+
+# bcrypt work factor for new hashes; logins rehash passwords stored at another cost
+BCRYPT_ROUNDS = int(os.environ.get("AUTH_BCRYPT_ROUNDS", "12"))
+
+# Password checks run on a small thread pool (bcrypt releases the GIL), so
+# a burst of logins uses at most VERIFY_WORKERS cores and the API threads
+# keep running. Logins beyond VERIFY_QUEUE_LIMIT waiting checks are refused.
+VERIFY_WORKERS = int(os.environ.get("AUTH_VERIFY_WORKERS", "2"))
+VERIFY_QUEUE_LIMIT = int(os.environ.get("AUTH_VERIFY_QUEUE_LIMIT", "16"))
+VERIFY_TIMEOUT = float(os.environ.get("AUTH_VERIFY_TIMEOUT", "10"))
+
+# Per worker process: failed logins per username from one client IP, and
+# per client IP, allowed within RATE_WINDOW seconds. Failures elsewhere never
+# lock a user out, and successful logins are not counted, so a team signing
+# in from behind one NAT or proxy is never throttled.
+USER_FAILURE_LIMIT = int(os.environ.get("AUTH_USER_FAILURE_LIMIT", "5"))
+IP_FAILURE_LIMIT = int(os.environ.get("AUTH_IP_FAILURE_LIMIT", "30"))
+RATE_WINDOW = float(os.environ.get("AUTH_RATE_WINDOW", "300"))
+
+
+def normalize(user_data):
+    """User record as {"password": hash, "role": role}
+
+    Old-format entries are bare hash strings; those users are admins.
+    """
+    if isinstance(user_data, str):
+        return {"password": user_data, "role": "admin"}
+    return {
+        "password": user_data["password"],
+        "role": user_data.get("role", "customer_admin"),
+    }
+
+
+class JsonUserStore:
+    """Users in a JSON file, parsed once and re-read only when the file changes
+
+    Writes take an exclusive lock on a companion .lock file, re-read the
+    file under it and replace it atomically, so concurrent workers neither
+    lose each other's updates nor leave a half-written file behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._users = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _read(self):
+        signature = self._stat()
+        if signature is None:
+            return {}, None
+        with open(self.path, "r") as f:
+            users = json.load(f)
+        return {name: normalize(data) for name, data in users.items()}, signature
+
+    def users(self):
+        """Current {username: record} map; do not modify it"""
+        if self._stat() != self._signature:
+            with self._lock:
+                if self._stat() != self._signature:
+                    self._users, self._signature = self._read()
+        return self._users
+
+    def get(self, username):
+        return self.users().get(username)
+
+    def update(self, change):
+        """Apply change(users) to the latest file contents and save them atomically"""
+        with self._lock, open(f"{self.path}.lock", "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            users, _ = self._read()
+            result = change(users)
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".users-", suffix=".json")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(users, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            self._users, self._signature = users, self._stat()
+            return result
+
+    def add(self, username, record):
+        def change(users):
+            if username in users:
+                return False
+            users[username] = record
+            return True
+
+        return self.update(change)
+
+    def set_password(self, username, password_hash):
+        def change(users):
+            if username in users:
+                users[username]["password"] = password_hash
+
+        self.update(change)
+
+    def replace(self, users):
+        def change(current):
+            current.clear()
+            current.update({name: normalize(data) for name, data in users.items()})
+
+        self.update(change)
+
+
+class SqliteUserStore:
+    """Users in dim_dashboard_users, keyed by the username column added in schema.py
+
+    Password hashes are kept in dashboard_credentials, which only this store reads.
+    """
+
+    def get(self, username):
+        conn = db.get_read_connection()
+        try:
+            row = conn.execute(
+                """
+                SELECT c.password_hash, u.role_type
+                FROM dim_dashboard_users u
+                JOIN dashboard_credentials c ON c.username = u.username
+                WHERE u.username = ? AND COALESCE(u.status, 'active') = 'active'
+                """,
+                (username,),
+            ).fetchone()
+        finally:
+            conn.close()
+        return {"password": row[0], "role": row[1]} if row else None
+
+    def users(self):
+        conn = db.get_read_connection()
+        try:
+            rows = conn.execute(
+                """
+                SELECT u.username, c.password_hash, u.role_type
+                FROM dim_dashboard_users u
+                JOIN dashboard_credentials c ON c.username = u.username
+                WHERE COALESCE(u.status, 'active') = 'active'
+                """
+            ).fetchall()
+        finally:
+            conn.close()
+        return {row[0]: {"password": row[1], "role": row[2]} for row in rows}
+
+    def add(self, username, record):
+        with db.writer() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO dim_dashboard_users (username, name, role_type, status)
+                VALUES (?, ?, ?, 'active')
+                ON CONFLICT(username) DO NOTHING
+                """,
+                (username, username, record["role"]),
+            )
+            if cursor.rowcount != 1:
+                return False
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO dashboard_credentials (username, password_hash)
+                VALUES (?, ?)
+                """,
+                (username, record["password"]),
+            )
+            return True
+
+    def set_password(self, username, password_hash):
+        with db.writer() as conn:
+            conn.execute(
+                "UPDATE dashboard_credentials SET password_hash = ? WHERE username = ?",
+                (password_hash, username),
+            )
+
+    def replace(self, users):
+        with db.writer() as conn:
+            conn.execute(
+                """
+                UPDATE dim_dashboard_users SET status = 'inactive'
+                WHERE username IS NOT NULL
+                AND username NOT IN (SELECT value FROM json_each(?))
+                """,
+                (json.dumps(list(users)),),
+            )
+            records = {name: normalize(data) for name, data in users.items()}
+            conn.executemany(
+                """
+                INSERT INTO dim_dashboard_users (username, name, role_type, status)
+                VALUES (?, ?, ?, 'active')
+                ON CONFLICT(username) DO UPDATE SET
+                    role_type = excluded.role_type,
+                    status = 'active'
+                """,
+                [(name, name, record["role"]) for name, record in records.items()],
+            )
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO dashboard_credentials (username, password_hash)
+                VALUES (?, ?)
+                """,
+                [(name, record["password"]) for name, record in records.items()],
+            )
+
+
+store = SqliteUserStore() if AUTH_STORE == "sqlite" else JsonUserStore(USERS_FILE)
+
+
+class LoginRejected(Exception):
+    """Login refused before the password was checked"""
+
+    status = 429
+
+
+class TooManyAttempts(LoginRejected):
+    status = 429
+
+
+class VerifierBusy(LoginRejected):
+    status = 503
+
+
+class RateLimiter:
+    """Sliding-window event counts per key
+
+    At most max_keys keys are kept; the least recently hit are dropped first.
+    """
+
+    def __init__(self, limit, window=RATE_WINDOW, max_keys=10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        events = self._events.get(key)
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        return events
+
+    def exceeded(self, key):
+        with self._lock:
+            events = self._recent(key, time.monotonic())
+            return bool(events) and len(events) >= self.limit
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if key in self._events:
+                self._events.move_to_end(key)
+            else:
+                while len(self._events) >= self.max_keys:
+                    self._events.popitem(last=False)
+                self._events[key] = deque()
+            self._events[key].append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+
+user_failures = RateLimiter(USER_FAILURE_LIMIT)
+ip_failures = RateLimiter(IP_FAILURE_LIMIT)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(VERIFY_QUEUE_LIMIT)
+_stats_lock = threading.Lock()
+_stats = {
+    "verified": 0,
+    "succeeded": 0,
+    "failed": 0,
+    "throttled": 0,
+    "busy": 0,
+    "rehashed": 0,
+    "in_flight": 0,
+    "verify_ms_total": 0.0,
+    "verify_ms_max": 0.0,
+}
+
+
+def count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+def get_executor():
+    """This process's verification pool; threads do not survive a fork"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(VERIFY_WORKERS, thread_name_prefix="bcrypt")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def run_hashing(fn, *args):
+    """Run fn on the verification pool and wait for its result
+
+    Raises VerifierBusy when VERIFY_QUEUE_LIMIT checks are already waiting.
+    """
+    if not _pending.acquire(blocking=False):
+        count("busy")
+        raise VerifierBusy("Too many logins in progress, please retry")
+    count("in_flight")
+
+    def task():
+        try:
+            return fn(*args)
+        finally:
+            count("in_flight", -1)
+            _pending.release()
+
+    future = get_executor().submit(task)
+    try:
+        return future.result(timeout=VERIFY_TIMEOUT)
+    except FutureTimeout:
+        count("busy")
+        raise VerifierBusy("Login timed out, please retry")
+
+
+def hash_rounds(password_hash):
+    """Work factor of a bcrypt hash ($2b$12$...), or None if it is not one"""
+    try:
+        return int(password_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def rehash(username, password):
+    """Store the password again at the configured work factor"""
+    try:
+        hashed = bcrypt.generate_password_hash(password, BCRYPT_ROUNDS).decode("utf-8")
+        store.set_password(username, hashed)
+        count("rehashed")
+    except Exception as e:
+        print(f"Error rehashing password for {username}: {e}")
+
+
+def verify(password_hash, password):
+    started = time.perf_counter()
+    try:
+        return bcrypt.check_password_hash(password_hash, password)
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with _stats_lock:
+            _stats["verified"] += 1
+            _stats["verify_ms_total"] += elapsed_ms
+            _stats["verify_ms_max"] = max(_stats["verify_ms_max"], elapsed_ms)
+
+
+def stats():
+    """Login counters and verification timings for this worker process"""
+    with _stats_lock:
+        result = dict(_stats)
+    result["verify_ms_avg"] = (
+        round(result["verify_ms_total"] / result["verified"], 3)
+        if result["verified"]
+        else 0
+    )
+    result["verify_ms_total"] = round(result["verify_ms_total"], 3)
+    result["verify_ms_max"] = round(result["verify_ms_max"], 3)
+    result["workers"] = VERIFY_WORKERS
+    result["queue_limit"] = VERIFY_QUEUE_LIMIT
+    result["bcrypt_rounds"] = BCRYPT_ROUNDS
+    return result
+
 
 def load_users():
-    if not os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "w") as f:
-            json.dump({}, f)
-    with open(USERS_FILE, "r") as f:
-        return json.load(f)
+    return dict(store.users())
 
 
 def save_users(users):
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f, indent=4)
+    store.replace(users)
 
 
 def add_user(username, password, role="customer_admin"):
@@ -29,56 +417,73 @@ def add_user(username, password, role="customer_admin"):
     Add a new user with a specified role
     role can be: 'admin' or 'customer_admin'
     """
-    users = load_users()
-    if username in users:
+    if store.get(username) is not None:
         return False  # User already exists
-    hashed_password = bcrypt.generate_password_hash(password).decode("utf-8")
-    users[username] = {
-        "password": hashed_password,
-        "role": role
-    }
-    save_users(users)
-    return True
+    hashed_password = run_hashing(
+        bcrypt.generate_password_hash, password, BCRYPT_ROUNDS
+    )
+    return store.add(
+        username, {"password": hashed_password.decode("utf-8"), "role": role}
+    )
 
 
-def check_password(username, password):
+def check_password(username, password, remote_addr=None):
     """
     Check password and return (success, role) tuple
-    Handles both old format (string) and new format (dict with password and role)
+    Old-format users (bare hash strings) are read as admins
+    Raises LoginRejected when the username or client is throttled or the
+    verification pool is saturated
     """
-    users = load_users()
-    if username not in users:
-        return False, None
-    
-    user_data = users[username]
-    
-    # Handle old format (backward compatibility)
-    if isinstance(user_data, str):
-        # Old format: just the hashed password string
-        if bcrypt.check_password_hash(user_data, password):
-            # Assume old users are admins, but migrate to new format
-            users[username] = {"password": user_data, "role": "admin"}
-            save_users(users)
-            return True, "admin"
+    if remote_addr is not None and ip_failures.exceeded(remote_addr):
+        count("throttled")
+        raise TooManyAttempts("Too many failed logins, please try again later")
+    if user_failures.exceeded((username, remote_addr)):
+        count("throttled")
+        raise TooManyAttempts("Too many failed logins, please try again later")
+
+    user_data = store.get(username)
+    if user_data is None or not run_hashing(verify, user_data["password"], password):
+        user_failures.hit((username, remote_addr))
+        if remote_addr is not None:
+            ip_failures.hit(remote_addr)
+        count("failed")
         return False, None
-    
-    # New format: dict with password and role
-    if bcrypt.check_password_hash(user_data["password"], password):
-        return True, user_data.get("role", "customer_admin")
-    return False, None
+
+    user_failures.reset((username, remote_addr))
+    count("succeeded")
+    # Off the request path, and only with room in the pool; a skipped rehash
+    # is retried on the next login
+    if hash_rounds(user_data["password"]) != BCRYPT_ROUNDS and _pending.acquire(
+        blocking=False
+    ):
+
+        def task():
+            try:
+                rehash(username, password)
+            finally:
+                _pending.release()
+
+        get_executor().submit(task)
+    return True, user_data["role"]
 
 
 def get_user_role(username):
     """Get the role of a user"""
-    users = load_users()
-    if username not in users:
-        return None
-    
-    user_data = users[username]
-    if isinstance(user_data, str):
-        return "admin"  # Default for old format
-    return user_data.get("role", "customer_admin")
+    user_data = store.get(username)
+    return user_data["role"] if user_data else None
 
 
 def init_auth(app):
     bcrypt.init_app(app)
+
+
+if __name__ == "__main__":
+    # python auth.py import-json: copy USERS_FILE into dim_dashboard_users
+    if sys.argv[1:] != ["import-json"]:
+        sys.exit("Usage: python auth.py import-json")
+    import schema
+
+    schema.apply_migrations()
+    users = JsonUserStore(USERS_FILE).users()
+    SqliteUserStore().replace(users)
+    print(f"Imported {len(users)} user(s) from {USERS_FILE} into {db.DB_PATH}")
@@ -0,0 +1,590 @@
+"""
+Synthetic fieldforce database for benchmarks.
+
+    python bench/generate.py bench/data/100k.db --conversations 100000
+
+The output starts as a copy of the source database (fieldforce.db by
+default): its schema, triggers and dimension tables (dim_companies,
+dim_brands, dim_crops, dim_pests) are kept and its facts, marts and
+staging rows are dropped. Agents, farmers, conversations, entities and
+semantics are then generated with realistic skew and loaded the way the
+ETL loads them, in batches inside etl.bulk_load() so every trigger and
+derived table is maintained:
+
+- districts of very different size, with agents and farmers in proportion
+  and a few agents doing most of the visits
+- Kharif/Rabi seasonality, quiet Sundays, working-hours peaks and growth
+  over the period
+- Zipf-distributed brand popularity led by the tracked companies,
+  crop popularity, and pests that go with particular crops
+
+Finally the ETL-built marts the dashboard reads (company and brand
+aggregates) are computed from the generated facts, and the dashboard's own
+rollups, the crop-pest matrix among them, are brought up to date. The same
+seed always produces the same data.
+"""
+
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BATCH_SIZE = 20000
+
+# (district, state, latitude, longitude, relative size)
+DISTRICTS = [
+    ("Guntur", "Andhra Pradesh", 16.31, 80.44, 10),
+    ("Krishna", "Andhra Pradesh", 16.61, 80.83, 8),
+    ("Kurnool", "Andhra Pradesh", 15.83, 78.04, 7),
+    ("East Godavari", "Andhra Pradesh", 17.00, 81.80, 6),
+    ("Warangal", "Telangana", 17.97, 79.59, 6),
+    ("Nalgonda", "Telangana", 17.05, 79.27, 5),
+    ("Khammam", "Telangana", 17.25, 80.15, 4),
+    ("Nashik", "Maharashtra", 19.99, 73.79, 6),
+    ("Ahmednagar", "Maharashtra", 19.09, 74.74, 5),
+    ("Yavatmal", "Maharashtra", 20.39, 78.12, 4),
+    ("Belagavi", "Karnataka", 15.85, 74.50, 4),
+    ("Raichur", "Karnataka", 16.21, 77.36, 3),
+    ("Davanagere", "Karnataka", 14.46, 75.92, 3),
+    ("Thanjavur", "Tamil Nadu", 10.79, 79.14, 3),
+    ("Dharmapuri", "Tamil Nadu", 12.13, 78.16, 2),
+    ("Hooghly", "West Bengal", 22.90, 88.39, 3),
+    ("Bardhaman", "West Bengal", 23.23, 87.86, 3),
+    ("Indore", "Madhya Pradesh", 22.72, 75.86, 2),
+    ("Ludhiana", "Punjab", 30.90, 75.85, 2),
+    ("Rajkot", "Gujarat", 22.30, 70.80, 1),
+]
+
+# Tracked companies lead brand mentions: Coromandel plus the competitors in
+# dimensions.COMPETITORS (resolved by name against dim_companies)
+HOME_COMPANY_CODE = 7007
+
+ENTITY_TYPES = (("brand", 45), ("crop", 30), ("pest", 25))
+ENTITIES_PER_CONVERSATION = ((1, 25), (2, 25), (3, 20), (4, 15), (5, 10), (6, 5))
+TOPICS = (
+    ("pest", 24),
+    ("disease", 18),
+    ("weed", 12),
+    ("crop_damage", 8),
+    ("price", 10),
+    ("supply", 8),
+    ("weather", 8),
+    ("dosage", 7),
+    ("product_info", 5),
+)
+INTENTS = (
+    ("seek_advice", 35),
+    ("request_info", 25),
+    ("purchase", 20),
+    ("complaint", 10),
+    ("feedback", 10),
+)
+URGENCIES = (("low", 50), ("medium", 30), ("high", 15), ("critical", 5))
+SENTIMENTS = (("positive", 35), ("neutral", 45), ("negative", 20))
+SENTIMENT_SCORES = {
+    "positive": (0.2, 1.0),
+    "neutral": (-0.2, 0.2),
+    "negative": (-1.0, -0.2),
+}
+FARMER_SENTIMENTS = {
+    "positive": ("satisfied",),
+    "neutral": ("neutral", "concerned"),
+    "negative": ("concerned", "frustrated"),
+}
+SOLUTION_TYPES = ("product_recommendation", "dosage_advice", "agronomic_practice")
+EFFECTIVENESS = ("effective", "partially_effective", "not_effective", "unknown")
+# Month -> seasonal weight: Kharif sowing and spraying (Jun-Sep) is the peak,
+# Rabi (Nov-Feb) a second, smaller one
+MONTH_WEIGHTS = {
+    1: 6,
+    2: 6,
+    3: 4,
+    4: 3,
+    5: 4,
+    6: 9,
+    7: 12,
+    8: 12,
+    9: 10,
+    10: 7,
+    11: 7,
+    12: 6,
+}
+WEEKDAY_WEIGHTS = (10, 10, 10, 10, 10, 9, 3)  # Monday..Sunday
+HOUR_WEIGHTS = (
+    0,
+    0,
+    0,
+    0,
+    0,
+    1,
+    3,
+    6,
+    9,
+    10,
+    10,
+    9,
+    6,
+    5,
+    7,
+    9,
+    9,
+    7,
+    4,
+    2,
+    1,
+    0,
+    0,
+    0,
+)
+
+
+def parse_count(text):
+    """'10k' -> 10000, '1m' -> 1000000"""
+    text = text.strip().lower().replace("_", "")
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+
+def zipf_weights(count, exponent=1.1):
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+class Chooser:
+    """Weighted random choice over a fixed population, O(log n) per draw"""
+
+    def __init__(self, rng, population, weights):
+        self.rng = rng
+        self.population = list(population)
+        self.cumulative = list(itertools.accumulate(weights))
+        self.total = self.cumulative[-1]
+
+    def __call__(self):
+        i = bisect.bisect(self.cumulative, self.rng.random() * self.total)
+        return self.population[min(i, len(self.population) - 1)]
+
+
+def pairs(options):
+    return [o for o, _ in options], [w for _, w in options]
+
+
+def copy_schema(source, out):
+    """Copy source to out, keeping dimensions and dropping facts and marts"""
+    for path in (out, out + "-wal", out + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(out)
+    src.backup(dst)
+    src.close()
+    tables = [
+        row[0]
+        for row in dst.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+            " AND name NOT LIKE 'sqlite_%'"
+        )
+    ]
+    for table in tables:
+        if table.startswith(("fact_", "mart_", "staging_")) or table in (
+            "dim_user",
+            "dim_farmers",
+            "etl_processing_log",
+        ):
+            dst.execute(f"DELETE FROM {table}")
+    dst.commit()
+    dst.execute("VACUUM")
+    dst.close()
+
+
+class Generator:
+    def __init__(self, conn, conversations, days, seed):
+        self.conn = conn
+        self.rng = random.Random(seed)
+        self.conversations = conversations
+        self.end = datetime.now().replace(minute=0, second=0, microsecond=0)
+        self.start = self.end - timedelta(days=days)
+
+        rng = self.rng
+        companies = dict(
+            conn.execute("SELECT company_code, company_name FROM dim_companies")
+        )
+        import dimensions
+
+        tracked = [
+            HOME_COMPANY_CODE,
+            *dimensions.resolve_competitors(companies).values(),
+        ]
+        brands = conn.execute(
+            "SELECT brand_code, brand_name, company_code FROM dim_brands ORDER BY brand_code"
+        ).fetchall()
+        by_company = {}
+        for code, name, company in brands:
+            by_company.setdefault(company, []).append((code, name))
+        others = [c for c in by_company if c not in tracked]
+        rng.shuffle(others)
+        company_order = [c for c in tracked if c in by_company] + others
+        brand_population, brand_weights = [], []
+        for company, weight in zip(
+            company_order, zipf_weights(len(company_order), 0.9)
+        ):
+            products = by_company[company]
+            rng.shuffle(products)
+            for product, share in zip(products, zipf_weights(len(products))):
+                brand_population.append(product)
+                brand_weights.append(weight * share)
+        self.brand = Chooser(rng, brand_population, brand_weights)
+
+        crops = conn.execute(
+            "SELECT crop_code, crop_name FROM dim_crops WHERE crop_type NOT IN ('(blank)', 'No Crop')"
+            " AND crop_type IS NOT NULL"
+        ).fetchall()
+        rng.shuffle(crops)
+        self.crop = Chooser(rng, crops, zipf_weights(len(crops)))
+        pests = conn.execute("SELECT pest_code, pest_name FROM dim_pests").fetchall()
+        # Each crop has its own handful of pests, most of them rare
+        self.crop_pests = {
+            code: Chooser(rng, rng.sample(pests, min(12, len(pests))), zipf_weights(12))
+            for code, _ in crops
+        }
+
+        self.entity_type = Chooser(rng, *pairs(ENTITY_TYPES))
+        self.entity_count = Chooser(rng, *pairs(ENTITIES_PER_CONVERSATION))
+        self.topic = Chooser(rng, *pairs(TOPICS))
+        self.intent = Chooser(rng, *pairs(INTENTS))
+        self.urgency = Chooser(rng, *pairs(URGENCIES))
+        self.sentiment = Chooser(rng, *pairs(SENTIMENTS))
+
+        # Days weighted by season, weekday and steady growth over the period
+        days_list = [self.start + timedelta(days=d) for d in range(days)]
+        self.day = Chooser(
+            rng,
+            days_list,
+            [
+                MONTH_WEIGHTS[d.month] * WEEKDAY_WEIGHTS[d.weekday()] * (1 + i / days)
+                for i, d in enumerate(days_list)
+            ],
+        )
+        self.hour = Chooser(rng, range(24), HOUR_WEIGHTS)
+
+    def people(self):
+        """Insert agents and farmers; return a chooser of (agent, district, farmers)"""
+        rng = self.rng
+        agent_count = max(len(DISTRICTS), min(5000, self.conversations // 400))
+        farmer_count = max(10, self.conversations // 4)
+        size = sum(d[4] for d in DISTRICTS)
+        agents, farmers_by_district, agent_rows, farmer_rows = [], {}, [], []
+        for index, (district, state, lat, lon, weight) in enumerate(DISTRICTS):
+            farmers = []
+            for n in range(max(1, farmer_count * weight // size)):
+                farmer_id = f"F{index:02d}{n:07d}"
+                farmers.append(farmer_id)
+                farmer_rows.append(
+                    (
+                        farmer_id,
+                        f"Farmer {index}-{n}",
+                        round(rng.lognormvariate(1, 0.7), 1),
+                        rng.randint(1, 40),
+                        self.crop()[0],
+                        district,
+                        state,
+                        f"{district} village {rng.randint(1, 60)}",
+                    )
+                )
+            farmers_by_district[district] = farmers
+            for n in range(max(1, agent_count * weight // size)):
+                user_id = f"A{index:02d}{n:04d}"
+                agents.append((user_id, district, state, lat, lon))
+                agent_rows.append(
+                    (
+                        user_id,
+                        f"Agent {district} {n}",
+                        rng.choice(("M", "F")),
+                        rng.randint(22, 55),
+                        district,
+                        state,
+                        "Active",
+                    )
+                )
+        self.conn.executemany(
+            "INSERT INTO dim_user (user_id, full_name, gender, age, district, state, status)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            agent_rows,
+        )
+        self.conn.executemany(
+            "INSERT INTO dim_farmers (farmer_id, farmer_name, land_size_acres,"
+            " experience_years, primary_crop_code, district, state, village,"
+            " total_interactions, is_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, 1)",
+            farmer_rows,
+        )
+        # A few agents do most of the visits
+        return Chooser(
+            rng,
+            [(a, farmers_by_district[a[1]]) for a in agents],
+            [rng.paretovariate(1.5) for _ in agents],
+        )
+
+    def batch(self, first, count, agent):
+        rng = self.rng
+        conversations, entities, semantics = [], [], []
+        for k in range(first, first + count):
+            conversation_id = f"C{k:09d}"
+            (user_id, district, state, lat, lon), farmers = agent()
+            ts = self.day() + timedelta(hours=self.hour(), minutes=rng.randint(0, 59))
+            timestamp = ts.strftime("%Y-%m-%d %H:%M:%S")
+            farmer_id = rng.choice(farmers) if rng.random() < 0.7 else None
+
+            mentioned = []
+            crop = None
+            for _ in range(self.entity_count()):
+                kind = self.entity_type()
+                if kind == "brand":
+                    code, name = self.brand()
+                elif kind == "crop" or crop is None:
+                    kind = "crop"
+                    code, name = crop = self.crop()
+                else:
+                    code, name = self.crop_pests[crop[0]]()
+                mentioned.append((kind, code, name))
+
+            topic, sentiment = self.topic(), self.sentiment()
+            low, high = SENTIMENT_SCORES[sentiment]
+            names = ", ".join(name for _, _, name in mentioned)
+            transcript = (
+                f"Farmer asked about {topic.replace('_', ' ')} on {names}. "
+                f"Agent discussed {rng.choice(SOLUTION_TYPES).replace('_', ' ')}."
+            )
+            conversations.append(
+                (
+                    conversation_id,
+                    timestamp,
+                    round(lat + rng.gauss(0, 0.15), 5),
+                    round(lon + rng.gauss(0, 0.15), 5),
+                    district,
+                    state,
+                    user_id,
+                    farmer_id,
+                    transcript,
+                    transcript[:80],
+                    rng.choice(("android", "android", "ios")),
+                    timestamp,
+                )
+            )
+            for position, (kind, code, name) in enumerate(mentioned):
+                mention = name.lower() + (" new offer" if rng.random() < 0.02 else "")
+                entities.append(
+                    (
+                        conversation_id,
+                        kind,
+                        code,
+                        name,
+                        mention,
+                        position,
+                        f"... {mention} ...",
+                        round(rng.uniform(0.6, 1.0), 3),
+                        "llm",
+                        timestamp,
+                    )
+                )
+            solution = rng.random() < 0.45
+            semantics.append(
+                (
+                    conversation_id,
+                    sentiment,
+                    round(rng.uniform(low, high), 3),
+                    rng.choice(FARMER_SENTIMENTS[sentiment]),
+                    self.intent(),
+                    self.urgency(),
+                    topic,
+                    int(topic in ("pest", "disease", "weed", "crop_damage")),
+                    topic,
+                    int(solution),
+                    rng.choice(SOLUTION_TYPES) if solution else None,
+                    rng.choice(EFFECTIVENESS) if solution else None,
+                    int(rng.random() < 0.3),
+                    round(rng.uniform(0.7, 1.0), 3),
+                    "synthetic",
+                    timestamp,
+                )
+            )
+
+        self.conn.executemany(
+            "INSERT INTO fact_conversations (conversation_id, timestamp, latitude,"
+            " longitude, district, state, user_id, farmer_id, transcript, user_text,"
+            " device_type, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            conversations,
+        )
+        self.conn.executemany(
+            "INSERT INTO fact_conversation_entities (conversation_id, entity_type,"
+            " entity_code, entity_name, mention_text, position_in_text, context_snippet,"
+            " confidence_score, extraction_method, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            entities,
+        )
+        self.conn.executemany(
+            "INSERT INTO fact_conversation_semantics (conversation_id, overall_sentiment,"
+            " sentiment_score, farmer_sentiment, intent, urgency, primary_topic,"
+            " problem_identified, problem_category, solution_provided, solution_type,"
+            " solution_effectiveness, requires_followup, confidence_score, model_version,"
+            " created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            semantics,
+        )
+
+
+# ETL marts read by the dashboard, rebuilt from the facts
+MARTS = [
+    """
+    INSERT INTO mart_daily_company_kpis (
+        kpi_date, company_code, company_name, company_type, total_mentions,
+        unique_conversations, mention_share_pct, avg_sentiment, positive_mentions,
+        neutral_mentions, negative_mentions, recommendation_count, problem_solve_count
+    )
+    SELECT
+        day, company_code, company_name,
+        CASE WHEN company_code = 7021 THEN 'Rallis' ELSE 'Competitor' END,
+        mentions, conversations,
+        ROUND(100.0 * mentions / SUM(mentions) OVER (PARTITION BY day), 2),
+        avg_sentiment, positive, neutral, negative, recommendations, solved
+    FROM (
+        SELECT
+            substr(fc.timestamp, 1, 10) as day,
+            db.company_code,
+            dc.company_name,
+            COUNT(*) as mentions,
+            COUNT(DISTINCT fc.conversation_id) as conversations,
+            AVG(fcs.sentiment_score) as avg_sentiment,
+            SUM(fcs.overall_sentiment = 'positive') as positive,
+            SUM(fcs.overall_sentiment = 'neutral') as neutral,
+            SUM(fcs.overall_sentiment = 'negative') as negative,
+            SUM(fcs.solution_type = 'product_recommendation') as recommendations,
+            SUM(fcs.solution_effectiveness = 'effective') as solved
+        FROM fact_conversation_entities fce
+        JOIN fact_conversations fc ON fc.conversation_id = fce.conversation_id
+        JOIN dim_brands db ON db.brand_code = fce.entity_code
+        JOIN dim_companies dc ON dc.company_code = db.company_code
+        LEFT JOIN fact_conversation_semantics fcs ON fcs.conversation_id = fc.conversation_id
+        WHERE fce.entity_type = 'brand'
+        GROUP BY day, db.company_code
+    )
+    """,
+    """
+    INSERT INTO mart_brand_mentions (
+        period_start, period_end, period_type, brand_code, brand_name, company_code,
+        total_mentions, unique_conversations, unique_farmers, avg_sentiment,
+        positive_pct, negative_pct, problem_context_count, solution_context_count
+    )
+    SELECT
+        substr(fc.timestamp, 1, 10), substr(fc.timestamp, 1, 10), 'daily',
+        fce.entity_code, db.brand_name, db.company_code,
+        COUNT(*), COUNT(DISTINCT fc.conversation_id), COUNT(DISTINCT fc.farmer_id),
+        AVG(fcs.sentiment_score),
+        ROUND(100.0 * SUM(fcs.overall_sentiment = 'positive') / COUNT(*), 2),
+        ROUND(100.0 * SUM(fcs.overall_sentiment = 'negative') / COUNT(*), 2),
+        SUM(fcs.problem_identified), SUM(fcs.solution_provided)
+    FROM fact_conversation_entities fce
+    JOIN fact_conversations fc ON fc.conversation_id = fce.conversation_id
+    JOIN dim_brands db ON db.brand_code = fce.entity_code
+    LEFT JOIN fact_conversation_semantics fcs ON fcs.conversation_id = fc.conversation_id
+    WHERE fce.entity_type = 'brand'
+    GROUP BY substr(fc.timestamp, 1, 10), fce.entity_code
+    """,
+    """
+    INSERT INTO mart_brand_crop_matrix (
+        brand_code, brand_name, crop_code, crop_name, co_mentions,
+        unique_conversations, solution_context_count, avg_sentiment,
+        first_mentioned, last_mentioned
+    )
+    SELECT
+        b.entity_code, db.brand_name, c.entity_code, dcr.crop_name,
+        COUNT(*), COUNT(DISTINCT b.conversation_id), SUM(fcs.solution_provided),
+        AVG(fcs.sentiment_score), MIN(b.created_at), MAX(b.created_at)
+    FROM fact_conversation_entities b
+    JOIN fact_conversation_entities c
+        ON c.conversation_id = b.conversation_id AND c.entity_type = 'crop'
+    JOIN dim_brands db ON db.brand_code = b.entity_code
+    JOIN dim_crops dcr ON dcr.crop_code = c.entity_code
+    LEFT JOIN fact_conversation_semantics fcs ON fcs.conversation_id = b.conversation_id
+    WHERE b.entity_type = 'brand'
+    GROUP BY b.entity_code, c.entity_code
+    """,
+]
+
+
+def generate(out, conversations, days=365, seed=7, source=None, quiet=False):
+    """Write a synthetic database with the given number of conversations to out"""
+    started = time.perf_counter()
+    copy_schema(source or os.path.join(ROOT, "fieldforce.db"), out)
+
+    # The app modules read their database path at import time
+    os.environ["FIELDFORCE_DB_PATH"] = os.path.abspath(out)
+    import db
+    import etl
+    import rollups
+    import schema
+
+    schema.apply_migrations()
+    with db.writer() as conn:
+        generator = Generator(conn, conversations, days, seed)
+        agent = generator.people()
+    for first in range(0, conversations, BATCH_SIZE):
+        with db.writer() as conn, etl.bulk_load(conn):
+            generator.conn = conn
+            generator.batch(first, min(BATCH_SIZE, conversations - first), agent)
+        if not quiet:
+            done = min(first + BATCH_SIZE, conversations)
+            rate = done / (time.perf_counter() - started)
+            print(f"  {done:,} conversations ({rate:,.0f}/s)", flush=True)
+    with db.writer() as conn:
+        for statement in MARTS:
+            conn.execute(statement)
+    rollups.refresh()
+    with db.writer() as conn:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.close_all()
+    return time.perf_counter() - started
+
+
+def database_stats(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in (
+                "fact_conversations",
+                "fact_conversation_entities",
+                "fact_conversation_metrics",
+                "dim_user",
+                "dim_farmers",
+            )
+        } | {"bytes": os.path.getsize(path)}
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("out", help="database file to write (replaced if it exists)")
+    parser.add_argument(
+        "--conversations", default="10k", help="number of conversations, e.g. 10k, 1m"
+    )
+    parser.add_argument("--days", type=int, default=365, help="period covered")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument(
+        "--source", help="database to take the schema and dimensions from"
+    )
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    elapsed = generate(
+        args.out, parse_count(args.conversations), args.days, args.seed, args.source
+    )
+    print(f"Generated {args.out} in {elapsed:.1f}s")
+    print(json.dumps(database_stats(args.out), indent=2))
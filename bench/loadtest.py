@@ -0,0 +1,201 @@
+"""
+Load test for the dashboard API.
+
+Each simulated user logs in once and then loads the dashboard over and over,
+requesting every widget endpoint of every module in turn, as the page does.
+
+    python bench/loadtest.py --url http://127.0.0.1:8000 --users 16 --duration 30
+    python bench/loadtest.py --workers 1,2,4,8
+
+With --workers, gunicorn is started from the repository (gunicorn.conf.py)
+once per worker count and stopped afterwards, and one line is printed per
+run. The response cache is disabled on those servers unless --cache is
+given, so the numbers measure query work rather than cache hits.
+"""
+
+import argparse
+import ast
+import http.cookiejar
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def widget_routes():
+    """Routes of every widget view in app.py, in source order"""
+    with open(os.path.join(ROOT, "app.py")) as f:
+        tree = ast.parse(f.read())
+    routes = []
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        calls = {
+            d.func.attr if isinstance(d.func, ast.Attribute) else d.func.id: d.args
+            for d in node.decorator_list
+            if isinstance(d, ast.Call)
+        }
+        if "widget" in calls and "route" in calls:
+            routes.append(calls["route"][0].value)
+    return routes
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def login(base, username, password):
+    """Return a urllib opener holding a logged-in session cookie"""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(jar), NoRedirect
+    )
+    data = urllib.parse.urlencode({"username": username, "password": password})
+    try:
+        opener.open(f"{base}/login", data.encode(), timeout=30)
+    except urllib.error.HTTPError as e:
+        if e.code == 302 and "login" not in e.headers.get("Location", ""):
+            return opener
+    raise SystemExit(f"Login as {username!r} failed on {base}")
+
+
+def run_load(base, routes, users, duration, date, username, password):
+    """Hammer the server from users threads for duration seconds; return stats"""
+    query = urllib.parse.urlencode({"date": date})
+    latencies, errors, dashboards = [], [0], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def user(opener):
+        while time.monotonic() < deadline:
+            for route in routes:
+                started = time.perf_counter()
+                try:
+                    with opener.open(f"{base}{route}?{query}", timeout=60) as resp:
+                        resp.read()
+                    failed = False
+                except (urllib.error.URLError, OSError):
+                    failed = True
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    errors[0] += failed
+            with lock:
+                dashboards[0] += 1
+
+    openers = [login(base, username, password) for _ in range(users)]
+    threads = [threading.Thread(target=user, args=(opener,)) for opener in openers]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "req_per_sec": len(latencies) / elapsed,
+        "dashboards_per_sec": dashboards[0] / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None,
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, cache):
+    port = free_port()
+    env = dict(
+        os.environ,
+        WEB_CONCURRENCY=str(workers),
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_ACCESS_LOG="",
+        RESPONSE_CACHE="1" if cache else "0",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=ROOT,
+        env=env,
+    )
+    for _ in range(600):
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited with status {server.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise SystemExit("gunicorn did not start listening within 60s")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def report(label, stats):
+    print(
+        f"{label:>8} {stats['requests']:>9} {stats['errors']:>7} "
+        f"{stats['req_per_sec']:>9.1f} {stats['dashboards_per_sec']:>12.2f} "
+        f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f}",
+        flush=True,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--url", help="test a running server instead of starting gunicorn"
+    )
+    parser.add_argument(
+        "--workers", default="1,2,4", help="comma-separated gunicorn worker counts"
+    )
+    parser.add_argument("--users", type=int, default=16, help="concurrent users")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per run")
+    parser.add_argument("--date", default="30", help="date filter sent with every call")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="adminpass")
+    parser.add_argument(
+        "--cache", action="store_true", help="keep the response cache enabled"
+    )
+    args = parser.parse_args()
+
+    routes = widget_routes()
+    print(
+        f"{len(routes)} API calls per dashboard load, {args.users} users, "
+        f"{args.duration:.0f}s per run"
+    )
+    print(
+        f"{'workers':>8} {'requests':>9} {'errors':>7} {'req/s':>9} "
+        f"{'dashboards/s':>12} {'p50 ms':>8} {'p95 ms':>8}"
+    )
+    load = (routes, args.users, args.duration, args.date, args.username, args.password)
+    if args.url:
+        report("-", run_load(args.url.rstrip("/"), *load))
+    else:
+        for workers in [int(w) for w in args.workers.split(",")]:
+            server, base = start_server(workers, args.cache)
+            try:
+                report(str(workers), run_load(base, *load))
+            finally:
+                stop_server(server)
@@ -0,0 +1,230 @@
+"""
+Benchmark suite: every /api/* route at several data sizes, against a baseline.
+
+    python bench/run.py --sizes 10k,100k              # run and compare
+    python bench/run.py --sizes 10k,100k --save       # record a new baseline
+    python bench/run.py --sizes 1m --routes marketing  # one module only
+
+For each size a synthetic database is generated once with bench/generate.py
+and kept in bench/data/ (delete it to regenerate). Each size is measured in a
+fresh process through the Flask test client, logged in as an admin, with the
+response cache off so every request does its query work: every GET route
+under /api/ (bundles once per widget module) for each --dates filter, after
+one warm-up request, --repeat times. Streaming routes (/api/stream,
+/api/export/*) are left to their own tools.
+
+Reported per route: p50/p95/p99 latency, response size and the peak Python
+memory allocated while serving it (tracemalloc, measured on a separate
+request so it does not slow the timed ones), and per size the process's
+maximum RSS. Results are compared with the baseline file when it exists;
+routes whose median grew by more than --threshold (and by at least --min-ms)
+are listed as regressions and the exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# bench/ is on sys.path when this file is run as a script
+from generate import parse_count
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.join(ROOT, "bench")
+
+SKIP = ("/api/stream", "/api/export/")
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def routes(app, modules):
+    """GET /api/* routes of app; <module> routes once per widget module"""
+    found = []
+    for rule in app.url_map.iter_rules():
+        path = rule.rule
+        if not path.startswith("/api/") or path.startswith(SKIP):
+            continue
+        if "GET" not in rule.methods:
+            continue
+        if rule.arguments == {"module"}:
+            found += [path.replace("<module>", module) for module in modules]
+        elif not rule.arguments:
+            found.append(path)
+    return sorted(found)
+
+
+def measure(db_path, repeat, dates, only):
+    """Time every route against db_path; run in a fresh process per database"""
+    os.environ["FIELDFORCE_DB_PATH"] = db_path
+    os.environ["RESPONSE_CACHE"] = "0"
+    sys.path.insert(0, ROOT)
+    from app import app
+    from widgets import WIDGETS
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["logged_in"] = True
+        session["username"] = "bench"
+        session["user_role"] = "admin"
+
+    results = {}
+    for path in routes(app, WIDGETS):
+        if only and not any(part in path for part in only):
+            continue
+        for date in dates:
+            url = f"{path}?date={date}"
+            response = client.get(url)  # warm-up: statement cache, page cache
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            tracemalloc.start()
+            client.get(url)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[url] = {
+                "status": response.status_code,
+                "bytes": len(response.data),
+                "p50_ms": round(percentile(timings, 50), 2),
+                "p95_ms": round(percentile(timings, 95), 2),
+                "p99_ms": round(percentile(timings, 99), 2),
+                "peak_kb": round(peak / 1024),
+            }
+    # ru_maxrss is in kilobytes on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"routes": results, "max_rss_mb": round(rss / 1024, 1)}
+
+
+def database(size, seed, data_dir, source):
+    path = os.path.join(data_dir, f"{size}-seed{seed}.db")
+    if not os.path.exists(path):
+        print(f"Generating {path} ...", flush=True)
+        command = [sys.executable, os.path.join(BENCH, "generate.py"), path]
+        command += ["--conversations", str(parse_count(size)), "--seed", str(seed)]
+        if source:
+            command += ["--source", source]
+        subprocess.run(command, check=True)
+    return path
+
+
+def run_size(path, args):
+    command = [sys.executable, os.path.abspath(__file__), "--measure", path]
+    command += ["--repeat", str(args.repeat), "--dates", args.dates]
+    if args.routes:
+        command += ["--routes", args.routes]
+    output = subprocess.run(command, check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+def report(results):
+    for size, result in results["sizes"].items():
+        print(f"\n{size} conversations (max RSS {result['max_rss_mb']} MB)")
+        print(f"{'route':<58} {'p50':>8} {'p95':>8} {'p99':>8} {'peak KB':>8} status")
+        for url, r in result["routes"].items():
+            print(
+                f"{url:<58} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f}"
+                f" {r['p99_ms']:>8.1f} {r['peak_kb']:>8} {r['status']}"
+            )
+
+
+def compare(results, baseline, threshold, min_ms):
+    """Print changes against baseline; return the regressions"""
+    regressions = []
+    print(f"\nCompared with baseline of {baseline['created']}:")
+    for size, result in results["sizes"].items():
+        before = baseline["sizes"].get(size, {}).get("routes", {})
+        for url, r in result["routes"].items():
+            old = before.get(url)
+            if old is None:
+                print(f"  {size} {url}: new")
+                continue
+            # p50 decides: with few repeats p95 is close to the slowest run
+            # and moves with any scheduling hiccup
+            delta = r["p50_ms"] - old["p50_ms"]
+            change = delta / old["p50_ms"] if old["p50_ms"] else 0
+            line = (
+                f"{size} {url}: p50 {old['p50_ms']} -> {r['p50_ms']} ms ({change:+.0%}),"
+                f" p95 {old['p95_ms']} -> {r['p95_ms']} ms"
+            )
+            if r["status"] != old["status"]:
+                regressions.append((size, url))
+                print(f"  REGRESSION {line}, status {old['status']} -> {r['status']}")
+            elif change > threshold and delta >= min_ms:
+                regressions.append((size, url))
+                print(f"  REGRESSION {line}")
+            elif change < -threshold and -delta >= min_ms:
+                print(f"  faster {line}")
+    if not regressions:
+        print("  no regressions")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10k,100k", help="e.g. 10k,1m,10m")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--dates", default="30,all", help="date filters to request")
+    parser.add_argument(
+        "--routes", help="only routes containing one of these, e.g. home,alert"
+    )
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--source", help="database for schema and dimensions")
+    parser.add_argument("--data-dir", default=os.path.join(BENCH, "data"))
+    parser.add_argument(
+        "--baseline", default=os.path.join(BENCH, "baselines", "baseline.json")
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="write results as the baseline"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="p50 growth that counts"
+    )
+    parser.add_argument(
+        "--min-ms", type=float, default=2.0, help="ignore smaller changes"
+    )
+    parser.add_argument("--output", help="also write this run's results here")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    only = args.routes.split(",") if args.routes else None
+    dates = args.dates.split(",")
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.repeat, dates, only)))
+        sys.exit(0)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "sizes": {},
+    }
+    for size in args.sizes.split(","):
+        path = database(size, args.seed, args.data_dir, args.source)
+        print(f"Measuring {size} ...", flush=True)
+        results["sizes"][size] = run_size(path, args)
+    report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold, args.min_ms):
+            sys.exit(1)
@@ -0,0 +1,179 @@
+"""
+Server-side response cache for the dashboard API.
+
+Responses are keyed on route plus normalized query args and shared by every
+user. Entries expire after a per-endpoint TTL and are dropped as soon as the
+database changes (see db.data_version). Concurrent misses for the same key
+wait for a single computation instead of all hitting SQLite.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, make_response, request
+
+import db
+
+CACHE_ENABLED = os.environ.get("RESPONSE_CACHE", "1").lower() not in (
+    "0",
+    "false",
+    "no",
+)
+CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+CACHE_DEFAULT_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "300"))
+# How often (seconds) to ask SQLite whether the data changed
+VERSION_CHECK_INTERVAL = float(os.environ.get("RESPONSE_CACHE_VERSION_CHECK", "2"))
+# How long a request waits for another request computing the same key
+INFLIGHT_WAIT = 30
+
+
+class ResponseCache:
+    """Size-bounded LRU of rendered responses with single-flight computation"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = 0.0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def current_version(self):
+        """Database version, re-read at most every VERSION_CHECK_INTERVAL seconds"""
+        now = time.monotonic()
+        if now - self._version_checked_at < VERSION_CHECK_INTERVAL:
+            return self._version
+        try:
+            version = db.data_version()
+        except Exception as e:
+            print(f"Error reading database version: {e}")
+            version = None
+        with self._lock:
+            self._version_checked_at = now
+            if version != self._version:
+                if self._entries:
+                    self._stats["invalidations"] += 1
+                self._entries.clear()
+                self._version = version
+        return version
+
+    def _lookup(self, key, version, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, entry_version, value = entry
+        if entry_version != version or expires_at <= now:
+            del self._entries[key]
+            self._stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, version, value, ttl):
+        self._entries[key] = (time.monotonic() + ttl, version, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get_or_compute(self, key, ttl, compute):
+        """Return the cached value for key, computing it at most once at a time
+
+        compute() returns (value, cacheable); uncacheable values (errors) are
+        handed to the caller but not stored.
+        """
+        while True:
+            version = self.current_version()
+            with self._lock:
+                value = self._lookup(key, version, time.monotonic())
+                if value is not None:
+                    self._stats["hits"] += 1
+                    return value
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    self._stats["misses"] += 1
+                    break
+                self._stats["coalesced"] += 1
+            # Another request is computing this key; wait and look again
+            if not event.wait(INFLIGHT_WAIT):
+                return compute()[0]
+
+        try:
+            value, cacheable = compute()
+            if cacheable:
+                with self._lock:
+                    self._store(key, version, value, ttl)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["max_entries"] = self.max_entries
+        stats["enabled"] = CACHE_ENABLED
+        return stats
+
+
+response_cache = ResponseCache()
+
+
+def normalized_args():
+    """Query args as a sorted tuple, ignoring empty values"""
+    return tuple(
+        sorted(
+            (name, value.strip())
+            for name, value in request.args.items(multi=True)
+            if value.strip()
+        )
+    )
+
+
+def cached(ttl=CACHE_DEFAULT_TTL):
+    """Cache a view's response, keyed on route plus normalized query args"""
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not CACHE_ENABLED:
+                return f(*args, **kwargs)
+
+            def compute():
+                # Views may return (body, status) tuples; only 200s are cached
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response, False
+                return (
+                    (response.get_data(), response.status_code, response.mimetype),
+                    True,
+                )
+
+            key = (request.path, normalized_args())
+            value = response_cache.get_or_compute(key, ttl, compute)
+            if isinstance(value, tuple):
+                body, status, mimetype = value
+                return Response(body, status=status, mimetype=mimetype)
+            return value
+
+        return decorated_function
+
+    return decorator
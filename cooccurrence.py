@@ -0,0 +1,255 @@
+"""
+Crop, pest and brand co-occurrence marts.
+
+    mart_crop_pest_matrix      per crop and pest mentioned in one conversation
+                               (ETL table; crop-pest heatmap)
+    mart_crop_pest_brand_flow  per crop, pest and brand mentioned in one
+                               conversation (solution-flow Sankey)
+
+Each combination has its co_mentions (the combinations of mentions, as a
+join of the mentions counts them), the number of conversations
+(unique_conversations, flow_count), the first and last conversation
+timestamps, and a trend_direction.
+
+update() runs inside rollups.refresh() with the watermark of its last
+update, which refresh() logs in the same transaction. It reads the crop,
+pest and brand mentions of every conversation with entities added since,
+grouped by conversation in one pass. Each conversation's counts with
+and without its new entities are compared, and the difference is added to
+the marts, so the cost follows the new entities rather than the history.
+Like the rollups, this assumes entities are only ever added.
+
+trend_direction compares the conversations of the last TREND_DAYS whole
+days, those before the day of the latest conversation, with those of the
+TREND_DAYS days before. A change of more than TREND_CHANGE either way is
+increasing or decreasing. The windows only move when a new day starts, so
+trends are recomputed then, or when older conversations within the windows
+are loaded, rather than on every refresh.
+"""
+
+import os
+from datetime import date, timedelta
+from itertools import groupby
+
+TREND_DAYS = int(os.environ.get("COOCCURRENCE_TREND_DAYS", "30"))
+TREND_CHANGE = 0.2
+
+DAY = "substr(fc.timestamp, 1, 10)"
+
+# Mentions of each crop, pest and brand per conversation: all of them, and
+# those up to an entity id. {conversations} selects the conversations.
+ENTITY_GROUPS = """
+    SELECT
+        fce.conversation_id,
+        fc.timestamp,
+        fce.entity_type,
+        fce.entity_code,
+        COUNT(*),
+        COUNT(CASE WHEN fce.entity_id <= ? THEN 1 END)
+    FROM fact_conversation_entities fce
+    JOIN fact_conversations fc ON fc.conversation_id = fce.conversation_id
+    WHERE fce.entity_type IN ('crop', 'pest', 'brand')
+    AND fce.conversation_id IN ({conversations})
+    GROUP BY fce.conversation_id, fce.entity_type, fce.entity_code
+    ORDER BY fce.conversation_id
+"""
+
+# Combinations of codes without a dimension row are left out, as on the
+# filtered heatmap (filters.MARTS)
+UPSERTS = {
+    "mart_crop_pest_matrix": """
+        INSERT INTO mart_crop_pest_matrix (
+            crop_code, crop_name, pest_code, pest_name, co_mentions,
+            unique_conversations, first_mentioned, last_mentioned, trend_direction
+        )
+        SELECT
+            dcr.crop_code, dcr.crop_name, dp.pest_code, dp.pest_name, :co_mentions,
+            :conversations, :first, :last, 'stable'
+        FROM dim_crops dcr, dim_pests dp
+        WHERE dcr.crop_code = :crop AND dp.pest_code = :pest
+        ON CONFLICT(crop_code, pest_code) DO UPDATE SET
+            co_mentions = co_mentions + excluded.co_mentions,
+            unique_conversations = unique_conversations + excluded.unique_conversations,
+            first_mentioned = MIN(
+                COALESCE(first_mentioned, excluded.first_mentioned),
+                COALESCE(excluded.first_mentioned, first_mentioned)
+            ),
+            last_mentioned = MAX(
+                COALESCE(last_mentioned, excluded.last_mentioned),
+                COALESCE(excluded.last_mentioned, last_mentioned)
+            ),
+            updated_at = CURRENT_TIMESTAMP
+    """,
+    "mart_crop_pest_brand_flow": """
+        INSERT INTO mart_crop_pest_brand_flow (
+            crop_code, crop_name, pest_code, pest_name, brand_code, brand_name,
+            co_mentions, flow_count, first_mentioned, last_mentioned, trend_direction
+        )
+        SELECT
+            dcr.crop_code, dcr.crop_name, dp.pest_code, dp.pest_name, db.brand_code,
+            db.brand_name, :co_mentions, :conversations, :first, :last, 'stable'
+        FROM dim_crops dcr, dim_pests dp, dim_brands db
+        WHERE dcr.crop_code = :crop AND dp.pest_code = :pest AND db.brand_code = :brand
+        ON CONFLICT(crop_code, pest_code, brand_code) DO UPDATE SET
+            co_mentions = co_mentions + excluded.co_mentions,
+            flow_count = flow_count + excluded.flow_count,
+            first_mentioned = MIN(
+                COALESCE(first_mentioned, excluded.first_mentioned),
+                COALESCE(excluded.first_mentioned, first_mentioned)
+            ),
+            last_mentioned = MAX(
+                COALESCE(last_mentioned, excluded.last_mentioned),
+                COALESCE(excluded.last_mentioned, last_mentioned)
+            ),
+            updated_at = CURRENT_TIMESTAMP
+    """,
+}
+KEYS = {
+    "mart_crop_pest_matrix": ("crop", "pest"),
+    "mart_crop_pest_brand_flow": ("crop", "pest", "brand"),
+}
+
+
+def conversations(conn, query, params):
+    """(timestamp, {type: {code: (mentions, earlier mentions)}}) per conversation"""
+    rows = conn.execute(ENTITY_GROUPS.format(conversations=query), params)
+    for _, group in groupby(rows, key=lambda row: row[0]):
+        entities = {}
+        for _, timestamp, entity_type, code, mentions, earlier in group:
+            entities.setdefault(entity_type, {})[code] = (mentions, earlier)
+        yield timestamp, entities
+
+
+def combinations(entities, earlier=False):
+    """{table: {codes: co_mentions}} of one conversation's entities
+
+    With earlier, only the mentions up to the entity id are counted.
+    """
+    column = 1 if earlier else 0
+    crops, pests, brands = (
+        [(code, m[column]) for code, m in entities.get(t, {}).items() if m[column]]
+        for t in ("crop", "pest", "brand")
+    )
+    pairs = {(c, p): cm * pm for c, cm in crops for p, pm in pests}
+    return {
+        "mart_crop_pest_matrix": pairs,
+        "mart_crop_pest_brand_flow": {
+            (*pair, b): mentions * bm
+            for pair, mentions in pairs.items()
+            for b, bm in brands
+        },
+    }
+
+
+def update(conn, watermark, days):
+    """Bring both marts up to date with the entities added since watermark
+
+    days include every day with rows added since, as from rollups.affected_days().
+    Without a watermark the marts are rebuilt from every conversation.
+    """
+    if watermark is None:
+        for table in UPSERTS:
+            conn.execute(f"DELETE FROM {table}")
+        mark = 0
+    else:
+        mark = watermark.get("fact_conversation_entities", 0)
+
+    # table -> codes -> [co_mentions, conversations, first, last]
+    deltas = {table: {} for table in UPSERTS}
+    changed = conversations(
+        conn,
+        "SELECT conversation_id FROM fact_conversation_entities WHERE entity_id > ?",
+        (mark, mark),
+    )
+    for timestamp, entities in changed:
+        before = combinations(entities, earlier=True)
+        for table, after in combinations(entities).items():
+            for codes, mentions in after.items():
+                previous = before[table].get(codes, 0)
+                if mentions == previous:
+                    continue
+                delta = deltas[table].setdefault(codes, [0, 0, timestamp, timestamp])
+                delta[0] += mentions - previous
+                if not previous:
+                    delta[1] += 1
+                    delta[2] = min(delta[2], timestamp)
+                    delta[3] = max(delta[3], timestamp)
+
+    for table, statement in UPSERTS.items():
+        conn.executemany(
+            statement,
+            [
+                {
+                    **dict(zip(KEYS[table], codes)),
+                    "co_mentions": co_mentions,
+                    "conversations": count,
+                    # A conversation that only adds mentions does not move them
+                    "first": first if count else None,
+                    "last": last if count else None,
+                }
+                for codes, (co_mentions, count, first, last) in deltas[table].items()
+            ],
+        )
+    update_trends(conn, watermark, days)
+
+
+def direction(recent, previous):
+    if recent > previous * (1 + TREND_CHANGE):
+        return "increasing"
+    if recent < previous * (1 - TREND_CHANGE):
+        return "decreasing"
+    return "stable"
+
+
+def update_trends(conn, watermark, days):
+    """Recompute trend_direction of every combination if its windows changed"""
+    # Rows with a malformed timestamp never become the latest day
+    latest = conn.execute(
+        f"""
+        SELECT MAX({DAY}) FROM fact_conversations fc
+        WHERE {DAY} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+        """
+    ).fetchone()[0]
+    if latest is None:
+        return
+    end = date.fromisoformat(latest) - timedelta(days=1)
+    middle = (end - timedelta(days=TREND_DAYS)).isoformat()
+    start = (end - timedelta(days=2 * TREND_DAYS)).isoformat()
+    end = end.isoformat()
+    # The windows are unchanged without new rows inside them or a new latest day
+    if watermark is not None and not any(start < day <= end for day in days):
+        started = conn.execute(
+            f"SELECT 1 FROM fact_conversations fc WHERE {DAY} = ? AND fc.rowid <= ?",
+            (latest, watermark.get("fact_conversations", 0)),
+        ).fetchone()
+        if started:
+            return
+
+    # table -> codes -> [conversations in the recent window, in the one before]
+    windows = {table: {} for table in UPSERTS}
+    recent = conversations(
+        conn,
+        f"""
+        SELECT fc.conversation_id FROM fact_conversations fc
+        WHERE {DAY} > ? AND {DAY} <= ?
+        """,
+        (0, start, end),
+    )
+    for timestamp, entities in recent:
+        window = 0 if timestamp[:10] > middle else 1
+        for table, found in combinations(entities).items():
+            for codes in found:
+                windows[table].setdefault(codes, [0, 0])[window] += 1
+
+    for table, keys in KEYS.items():
+        columns = ", ".join(f"{key}_code" for key in keys)
+        rows = conn.execute(f"SELECT {columns}, trend_direction FROM {table}")
+        changes = []
+        for *codes, current in rows:
+            trend = direction(*windows[table].get(tuple(codes), (0, 0)))
+            if trend != current:
+                changes.append((trend, *codes))
+        where = " AND ".join(f"{key}_code = ?" for key in keys)
+        conn.executemany(
+            f"UPDATE {table} SET trend_direction = ? WHERE {where}", changes
+        )
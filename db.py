@@ -0,0 +1,440 @@
+"""
+SQLite connection management for the dashboard.
+
+Read connections are pooled per worker process and reused across requests;
+handlers keep calling conn.close(), which hands the connection back to the
+pool instead of closing it. Writes go through a single writer connection.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+AZURE_DATA_DIR = os.environ.get("AZURE_DATA_DIR", "/home/site/data")
+
+
+def resolve_data_path(filename):
+    """Return the path of a data file, using the Azure data dir when deployed"""
+    if os.environ.get("WEBSITE_INSTANCE_ID"):  # Running on Azure
+        return os.path.join(AZURE_DATA_DIR, filename)
+    return filename
+
+
+DB_PATH = os.environ.get("FIELDFORCE_DB_PATH") or resolve_data_path("fieldforce.db")
+
+# Pool configuration (seconds unless noted)
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+POOL_MAX_AGE = float(os.environ.get("DB_POOL_MAX_AGE", "600"))
+POOL_HEALTH_CHECK_IDLE = float(os.environ.get("DB_POOL_HEALTH_CHECK_IDLE", "30"))
+BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", "5"))
+
+# Reader profile: dashboard connections only ever read
+JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "wal")
+CACHE_SIZE_KIB = int(os.environ.get("DB_CACHE_SIZE_KIB", "32768"))
+MMAP_MAX_BYTES = int(os.environ.get("DB_MMAP_MAX_BYTES", str(1024 * 1024 * 1024)))
+MMAP_HEADROOM_BYTES = 64 * 1024 * 1024
+# Snapshot deployments ship a database nobody writes to; immutable=1 skips all locking
+IMMUTABLE = os.environ.get("DB_IMMUTABLE", "0").lower() in ("1", "true", "yes")
+
+
+def mmap_size_for(path):
+    """mmap window covering the whole database file plus room to grow"""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return 0
+    return min(size + MMAP_HEADROOM_BYTES, MMAP_MAX_BYTES)
+
+
+def apply_reader_profile(conn, path):
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {mmap_size_for(path)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA query_only = ON")
+
+
+def reader_uri(path):
+    mode = "immutable=1" if IMMUTABLE else "mode=rw"
+    return f"file:{path}?{mode}"
+
+
+# Authorizer actions that change a database
+WRITE_ACTIONS = {
+    sqlite3.SQLITE_INSERT,
+    sqlite3.SQLITE_UPDATE,
+    sqlite3.SQLITE_DELETE,
+    sqlite3.SQLITE_CREATE_TABLE,
+    sqlite3.SQLITE_CREATE_INDEX,
+    sqlite3.SQLITE_CREATE_TRIGGER,
+    sqlite3.SQLITE_CREATE_VIEW,
+    sqlite3.SQLITE_DROP_TABLE,
+    sqlite3.SQLITE_DROP_INDEX,
+    sqlite3.SQLITE_DROP_TRIGGER,
+    sqlite3.SQLITE_DROP_VIEW,
+    sqlite3.SQLITE_ALTER_TABLE,
+}
+
+
+def _temp_only(action, arg1, arg2, database, source):
+    # SQLite registers an eponymous virtual table such as json_each in the
+    # schema on its first use; statements cannot write sqlite_master themselves
+    if action == sqlite3.SQLITE_UPDATE and arg1 == "sqlite_master":
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_ATTACH or (
+        action in WRITE_ACTIONS and database not in ("temp", None)
+    ):
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+@contextmanager
+def temp_writes(conn):
+    """Let a query_only read connection write its TEMP tables for the block
+
+    query_only also forbids TEMP tables, so it is lifted for the block, and an
+    authorizer denies every change to the database file meanwhile.
+    """
+    conn.set_authorizer(_temp_only)
+    conn.execute("PRAGMA query_only = OFF")
+    try:
+        yield conn
+    finally:
+        conn.execute("PRAGMA query_only = ON")
+        conn.set_authorizer(None)
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no read connection becomes free within POOL_TIMEOUT"""
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() returns it to the owning pool"""
+
+    # Cursor class used by execute(); profiling.install() swaps in a timing cursor
+    cursor_class = sqlite3.Cursor
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.checked_out = False
+        self.created_at = time.monotonic()
+        self.released_at = self.created_at
+
+    def execute(self, sql, parameters=()):
+        return self.cursor(self.cursor_class).execute(sql, parameters)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def discard(self):
+        """Really close the connection, bypassing the pool"""
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """Bounded pool of read connections shared by the threads of one process"""
+
+    def __init__(
+        self,
+        path,
+        size=POOL_SIZE,
+        timeout=POOL_TIMEOUT,
+        max_age=POOL_MAX_AGE,
+        health_check_idle=POOL_HEALTH_CHECK_IDLE,
+    ):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.health_check_idle = health_check_idle
+        self.pid = os.getpid()
+        # LIFO so the most recently used (warmest) connection is handed out first
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._stats = {
+            "acquired": 0,
+            "waited": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "health_check_failures": 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            reader_uri(self.path),
+            uri=True,
+            timeout=BUSY_TIMEOUT,
+            check_same_thread=False,
+            factory=PooledConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        apply_reader_profile(conn, self.path)
+        with self._lock:
+            self._stats["created"] += 1
+        return conn
+
+    def _usable(self, conn):
+        now = time.monotonic()
+        if now - conn.created_at > self.max_age:
+            return False
+        if now - conn.released_at > self.health_check_idle:
+            try:
+                conn.execute("SELECT 1").fetchone()
+            except sqlite3.Error:
+                with self._lock:
+                    self._stats["health_check_failures"] += 1
+                return False
+        return True
+
+    def _checkout(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if self._usable(conn):
+                return conn
+            conn.discard()
+            with self._lock:
+                self._stats["recycled"] += 1
+
+    def acquire(self):
+        started = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                raise PoolTimeout(
+                    f"No database connection available after {self.timeout}s"
+                )
+            waited_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self._stats["waited"] += 1
+                self._stats["wait_ms_total"] += waited_ms
+                self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], waited_ms)
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        conn.pool = self
+        conn.checked_out = True
+        with self._lock:
+            self._stats["acquired"] += 1
+            self._in_use += 1
+        return conn
+
+    def release(self, conn):
+        if not conn.checked_out:
+            return  # already returned (double close)
+        conn.checked_out = False
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.released_at = time.monotonic()
+            self._idle.put(conn)
+        except sqlite3.Error:
+            conn.discard()
+            with self._lock:
+                self._stats["recycled"] += 1
+        finally:
+            self._slots.release()
+
+    def warm(self, count=None):
+        """Open up to count idle connections ahead of demand (default: the pool size)"""
+        count = self.size if count is None else min(count, self.size)
+        while self._idle.qsize() + self._in_use < count:
+            conn = self._connect()
+            # Parses the schema, so the first real query does not pay for it
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            self._idle.put(conn)
+
+    def close_idle(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.discard()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_use"] = self._in_use
+        stats["size"] = self.size
+        stats["idle"] = self._idle.qsize()
+        stats["wait_ms_avg"] = (
+            round(stats["wait_ms_total"] / stats["waited"], 3) if stats["waited"] else 0
+        )
+        stats["wait_ms_total"] = round(stats["wait_ms_total"], 3)
+        stats["wait_ms_max"] = round(stats["wait_ms_max"], 3)
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.RLock()
+
+_monitor = None
+_monitor_pid = None
+_monitor_lock = threading.Lock()
+
+
+def get_pool():
+    """Return this process's read pool, creating a fresh one after a fork"""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+
+def get_read_connection():
+    """Borrow a pooled read connection; close() returns it to the pool"""
+    return get_pool().acquire()
+
+
+@contextmanager
+def writer():
+    """Yield the process-wide writer connection and commit when the block exits"""
+    global _writer, _writer_pid
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = sqlite3.connect(
+                DB_PATH, timeout=BUSY_TIMEOUT, check_same_thread=False
+            )
+            _writer.row_factory = sqlite3.Row
+            _writer_pid = os.getpid()
+        try:
+            yield _writer
+            _writer.commit()
+        except Exception:
+            _writer.rollback()
+            raise
+
+
+def data_version():
+    """Token that changes whenever another connection commits to the database
+
+    PRAGMA data_version is only comparable on one connection, so a dedicated
+    monitor connection is kept for it. The latest etl_processing_log id is
+    included so that ETL runs are noticed even on filesystems where
+    data_version is unreliable.
+    """
+    global _monitor, _monitor_pid
+    with _monitor_lock:
+        if _monitor is None or _monitor_pid != os.getpid():
+            _monitor = sqlite3.connect(
+                reader_uri(DB_PATH),
+                uri=True,
+                timeout=BUSY_TIMEOUT,
+                check_same_thread=False,
+            )
+            _monitor.execute("PRAGMA query_only = ON")
+            _monitor_pid = os.getpid()
+        version = _monitor.execute("PRAGMA data_version").fetchone()[0]
+        log_id = _monitor.execute(
+            "SELECT MAX(log_id) FROM etl_processing_log"
+        ).fetchone()[0]
+        return (version, log_id)
+
+
+def configure_database():
+    """Switch the database to the configured journal mode (WAL by default)
+
+    WAL lets dashboard readers keep reading while ETL commits. The journal
+    mode is persistent, so this only does work the first time it runs.
+    """
+    if IMMUTABLE:
+        return
+    try:
+        with writer() as conn:
+            conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}").fetchone()
+            if JOURNAL_MODE.lower() == "wal":
+                conn.execute("PRAGMA synchronous = NORMAL")
+    except sqlite3.Error as e:
+        print(f"Could not set journal_mode={JOURNAL_MODE} on {DB_PATH}: {e}")
+
+
+def reader_pragmas():
+    """Effective pragmas of a pooled read connection"""
+    conn = get_read_connection()
+    try:
+        pragmas = {
+            name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+            for name in (
+                "journal_mode",
+                "mmap_size",
+                "cache_size",
+                "temp_store",
+                "query_only",
+            )
+        }
+        pragmas["immutable"] = IMMUTABLE
+        return pragmas
+    finally:
+        conn.close()
+
+
+def log_reader_pragmas():
+    try:
+        pragmas = reader_pragmas()
+    except sqlite3.Error as e:
+        print(f"Could not read pragmas from {DB_PATH}: {e}")
+        return
+    print(
+        f"SQLite reader profile for {DB_PATH}: "
+        + ", ".join(f"{k}={v}" for k, v in pragmas.items())
+    )
+    if not IMMUTABLE and str(pragmas["journal_mode"]).lower() != JOURNAL_MODE.lower():
+        print(
+            f"WARNING: journal_mode is {pragmas['journal_mode']}, expected {JOURNAL_MODE}; "
+            "readers may stall while ETL writes"
+        )
+
+
+def warm_pool(count=None):
+    """Open this process's read connections before the first request needs them"""
+    get_pool().warm(count)
+
+
+def close_all():
+    """Close pooled, writer and monitor connections, e.g. before forking workers"""
+    global _pool, _writer, _monitor
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.close_idle()
+        _pool = None
+    with _writer_lock:
+        if _writer is not None and _writer_pid == os.getpid():
+            _writer.close()
+        _writer = None
+    with _monitor_lock:
+        if _monitor is not None and _monitor_pid == os.getpid():
+            _monitor.close()
+        _monitor = None
+
+
+def pool_stats():
+    return get_pool().stats()
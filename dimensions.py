@@ -0,0 +1,191 @@
+"""
+Process-wide cache of the dimension tables.
+
+dim_companies, dim_brands, dim_crops and dim_pests are small and change
+rarely, so they are loaded once into dicts keyed by code. Queries aggregate
+fact_conversation_entities on integer codes and names are attached in
+Python, instead of joining the dimensions on every request.
+
+get() returns the current snapshot. At most every CHECK_INTERVAL seconds it
+asks SQLite whether anything was committed (db.data_version) and, if so,
+reloads the tables; the snapshot's version only increases when their
+contents actually changed.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import db
+
+CHECK_INTERVAL = float(os.environ.get("DIMENSION_CHECK_INTERVAL", "30"))
+
+# A names(code, name) table for a FROM clause, filled from one JSON parameter
+# (name_pairs()). Joining it lets a query group by name, so that distinct
+# counts over codes sharing a name count each conversation once. SQLite
+# drives such a join from the names, so filters should probe
+# (Scope.filter_clause(probe=True)).
+NAMES = """
+    (
+        SELECT json_extract(value, '$[0]') as code, json_extract(value, '$[1]') as name
+        FROM json_each(?)
+    )
+"""
+
+# Tracked competitors: key -> (company name, fallback company code)
+COMPETITORS = {
+    "BAYER": ("BAYER CROP SCIENCE", 7002),
+    "UPL": ("UPL LIMITED", 7025),
+    "SYNGENTA": ("SYNGENTA INDIA LTD", 7024),
+}
+
+
+class Dimensions:
+    """Immutable snapshot of the dimension tables"""
+
+    def __init__(self, companies, brands, crops, pests, version):
+        self.version = version
+        self.companies = companies  # company_code -> company_name
+        self.brands = brands  # brand_code -> (brand_name, company_code)
+        self.crops = crops  # crop_code -> (crop_name, crop_type)
+        self.pests = pests  # pest_code -> pest_name
+        self.competitors = resolve_competitors(companies)
+        self._brands_by_company = {}
+        for code, (_, company_code) in brands.items():
+            self._brands_by_company.setdefault(company_code, []).append(code)
+
+    def brand_codes(self, *company_codes):
+        """Codes of every brand owned by the given companies"""
+        return [
+            code
+            for company_code in company_codes
+            for code in self._brands_by_company.get(company_code, [])
+        ]
+
+    def brand_names(self):
+        return {code: name for code, (name, _) in self.brands.items()}
+
+    def crop_names(self):
+        return {code: name for code, (name, _) in self.crops.items()}
+
+    def contents(self):
+        return (self.companies, self.brands, self.crops, self.pests)
+
+
+def resolve_competitors(companies):
+    """Company code of each tracked competitor, falling back to the known codes"""
+    names = {name for name, _ in COMPETITORS.values()}
+    fallbacks = {code for _, code in COMPETITORS.values()}
+    competitors = {key: code for key, (_, code) in COMPETITORS.items()}
+    for code, name in sorted(companies.items()):
+        if name in names or code in fallbacks:
+            for key in COMPETITORS:
+                if key in (name or "").upper():
+                    competitors[key] = code
+                    break
+    return competitors
+
+
+def load(version=0):
+    conn = db.get_read_connection()
+    try:
+        companies = {
+            row[0]: row[1]
+            for row in conn.execute(
+                "SELECT company_code, company_name FROM dim_companies"
+            )
+        }
+        brands = {
+            row[0]: (row[1], row[2])
+            for row in conn.execute(
+                "SELECT brand_code, brand_name, company_code FROM dim_brands"
+            )
+        }
+        crops = {
+            row[0]: (row[1], row[2])
+            for row in conn.execute(
+                "SELECT crop_code, crop_name, crop_type FROM dim_crops"
+            )
+        }
+        pests = {
+            row[0]: row[1]
+            for row in conn.execute("SELECT pest_code, pest_name FROM dim_pests")
+        }
+    finally:
+        conn.close()
+    return Dimensions(companies, brands, crops, pests, version)
+
+
+_current = None
+_data_version = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def refresh():
+    """Reload the dimension tables, bumping the version if they changed"""
+    global _current, _data_version, _checked_at
+    with _lock:
+        data_version = db.data_version()
+        latest = load(_current.version if _current else 1)
+        if _current is None:
+            _current = latest
+        elif latest.contents() != _current.contents():
+            latest.version = _current.version + 1
+            _current = latest
+        _data_version = data_version
+        _checked_at = time.monotonic()
+        return _current
+
+
+def get():
+    """Current dimension snapshot, reloaded when the database has changed"""
+    global _checked_at
+    if _current is not None and time.monotonic() - _checked_at < CHECK_INTERVAL:
+        return _current
+    try:
+        if _current is None or db.data_version() != _data_version:
+            return refresh()
+    except sqlite3.Error as e:
+        print(f"Error refreshing dimension cache: {e}")
+        if _current is None:
+            raise
+    _checked_at = time.monotonic()
+    return _current
+
+
+def warm():
+    """Load the cache ahead of the first request, reporting rather than raising errors"""
+    try:
+        refresh()
+    except sqlite3.Error as e:
+        print(f"Error loading dimension cache from {db.DB_PATH}: {e}")
+
+
+def name_pairs(names):
+    """The JSON parameter of NAMES for a code -> name dict"""
+    return json.dumps(
+        [[code, name] for code, name in names.items() if name is not None]
+    )
+
+
+def label_counts(rows, names, *fields, label="name"):
+    """Attach names to rows aggregated per code, summing fields of codes that share a name
+
+    Only for fields that add up, such as mentions; distinct counts are
+    grouped by name in SQL instead (NAMES). rows are (code, value, ...)
+    tuples with values in the order of fields. Codes missing from names are
+    dropped, like an inner join would. Returns one dict per name with the
+    name under label plus the summed fields, in first-seen order.
+    """
+    labelled = {}
+    for code, *values in rows:
+        name = names.get(code)
+        if name is None:
+            continue
+        entry = labelled.setdefault(name, {label: name, **dict.fromkeys(fields, 0)})
+        for field, value in zip(fields, values):
+            entry[field] += value
+    return list(labelled.values())
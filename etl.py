@@ -0,0 +1,136 @@
+"""
+Bulk-load support for writing batches into the fact tables.
+
+Some ETL triggers do per-row work that grows with the data already loaded:
+trg_update_daily_kpis_insert recounts the whole day with four
+COUNT(DISTINCT ...) subqueries for every inserted conversation, so loading
+a day of N conversations costs O(N^2), and trg_calculate_metrics upserts
+the metrics row and recounts the conversation's entities for every entity.
+bulk_load() suspends such triggers for the duration of a batch and
+afterwards brings their targets up to date with set-based statements over
+the rows the batch added.
+"""
+
+import json
+from contextlib import contextmanager
+
+import rollups
+import search
+
+
+def refresh_daily_kpis(conn, mark):
+    """Recompute mart_daily_kpis for the days of conversations added since mark"""
+    days = rollups.affected_days(conn, mark, ("fact_conversations",))
+    if days:
+        conn.execute(rollups.DAILY_KPIS, (json.dumps(days),))
+    return len(days)
+
+
+def refresh_conversation_metrics(conn, mark):
+    """Bring fact_conversation_metrics up to date for entities added since mark
+
+    Does what trg_calculate_metrics does per entity, once per conversation:
+    entity_extraction_count grows by the number of new entities and
+    data_completeness_score is recomputed from the final entity count (0.5
+    for a new conversation with a single entity, as the trigger leaves it).
+    Because the metrics rows only appear here, the alert flags that
+    trg_set_alert_flag would have set on them are applied here as well.
+    """
+    conn.execute(
+        """
+        INSERT INTO fact_conversation_metrics (
+            conversation_id, entity_extraction_count, data_completeness_score
+        )
+        SELECT
+            new.conversation_id,
+            new.entities,
+            CASE
+                WHEN new.entities = 1 AND NOT EXISTS (
+                    SELECT 1 FROM fact_conversation_metrics fcm
+                    WHERE fcm.conversation_id = new.conversation_id
+                ) THEN 0.5
+                ELSE (
+                    CASE WHEN fc.transcript IS NOT NULL THEN 0.3 ELSE 0 END
+                    + CASE WHEN fc.farmer_id IS NOT NULL THEN 0.2 ELSE 0 END
+                    + CASE WHEN fc.district IS NOT NULL THEN 0.2 ELSE 0 END
+                    + (
+                        SELECT COUNT(*) * 0.05 FROM fact_conversation_entities fce
+                        WHERE fce.conversation_id = new.conversation_id
+                    )
+                )
+            END
+        FROM (
+            SELECT conversation_id, COUNT(*) as entities
+            FROM fact_conversation_entities
+            WHERE entity_id > ?
+            GROUP BY conversation_id
+        ) new
+        LEFT JOIN fact_conversations fc ON fc.conversation_id = new.conversation_id
+        WHERE true
+        ON CONFLICT(conversation_id) DO UPDATE SET
+            entity_extraction_count = entity_extraction_count + excluded.entity_extraction_count,
+            data_completeness_score = excluded.data_completeness_score
+        """,
+        (mark["fact_conversation_entities"],),
+    )
+    conn.execute(
+        """
+        UPDATE fact_conversation_metrics
+        SET
+            alert_flag = 1,
+            alert_type = fcs.primary_topic,
+            alert_priority = CASE WHEN fcs.urgency = 'critical' THEN 10 ELSE 5 END
+        FROM fact_conversation_semantics fcs
+        WHERE fcs.conversation_id = fact_conversation_metrics.conversation_id
+        AND fcs.semantic_id > ?
+        AND fcs.urgency IN ('high', 'critical')
+        """,
+        (mark["fact_conversation_semantics"],),
+    )
+
+
+# Per-row trigger -> set-based catch-up run once per batch, in this order:
+# the daily KPIs count alerts, so metrics are brought up to date first.
+# The full-text indexes take a batch in one INSERT ... SELECT instead of a
+# trigger program per row.
+DEFERRED_TRIGGERS = {
+    "trg_calculate_metrics": refresh_conversation_metrics,
+    "trg_update_daily_kpis_insert": refresh_daily_kpis,
+    "trg_search_conversations_insert": search.index_conversations,
+    "trg_search_snippets_insert": search.index_snippets,
+}
+
+
+def trigger_sql(conn, name):
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+@contextmanager
+def bulk_load(conn):
+    """Suspend the per-row triggers in DEFERRED_TRIGGERS while a batch is loaded
+
+    Use inside a write transaction that is rolled back on error, e.g.
+    `with db.writer() as conn, etl.bulk_load(conn):`. The triggers are dropped
+    and recreated inside that transaction, so other connections never see
+    them missing, and the catch-up statements run before it commits.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    mark = rollups.high_water(conn)
+    suspended = {}
+    for name in DEFERRED_TRIGGERS:
+        sql = trigger_sql(conn, name)
+        if sql:
+            conn.execute(f"DROP TRIGGER {name}")
+            suspended[name] = sql
+    try:
+        yield conn
+        for catch_up in DEFERRED_TRIGGERS.values():
+            catch_up(conn, mark)
+    finally:
+        for name, sql in suspended.items():
+            if trigger_sql(conn, name) is None:
+                conn.execute(sql)
@@ -0,0 +1,348 @@
+"""
+Streaming exports of row-level datasets.
+
+/api/export/<dataset>?format=csv|ndjson|parquet streams every row of a
+dataset, optionally limited by the dashboard's `date` filter (default: all
+time). Rows are read in pages of PAGE_SIZE ordered by the dataset's key, each
+page starting after the last key of the previous one (keyset pagination),
+each on its own short read. Memory stays flat however many rows are exported,
+and a long download neither holds a pooled connection nor pins a read
+snapshot. `after=<key>` resumes an interrupted export.
+
+The datasets follow the ETL views of the same name (view_conversations_enriched,
+view_alert_dashboard, view_farmer_journey, view_sales_pipeline_overview), but
+read the base tables in key order; the views' own ORDER BY would sort the
+whole result for every page.
+"""
+
+import csv
+import io
+import json
+import os
+
+from flask import Response, jsonify
+
+import db
+import timerange
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional; only format=parquet needs it
+    pyarrow = None
+
+PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", "5000"))
+
+# name -> (key column, timestamp column for the date filter or None, query,
+# declared types of the numeric columns). The key is the first selected
+# column and must be unique. Columns without a declared type are text.
+DATASETS = {
+    "conversations": (
+        "fc.conversation_id",
+        "fc.timestamp",
+        """
+        SELECT
+            fc.conversation_id,
+            fc.timestamp,
+            fc.district,
+            fc.state,
+            fc.village,
+            du.full_name AS agent_name,
+            du.user_id,
+            df.farmer_name,
+            df.farmer_id,
+            fc.transcript,
+            fcs.overall_sentiment,
+            fcs.sentiment_score,
+            fcs.urgency,
+            fcs.primary_topic,
+            fcs.solution_provided,
+            fcm.alert_flag,
+            fcm.conversation_depth_score,
+            fcm.data_completeness_score
+        FROM fact_conversations fc
+        LEFT JOIN dim_user du ON fc.user_id = du.user_id
+        LEFT JOIN dim_farmers df ON fc.farmer_id = df.farmer_id
+        LEFT JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+        LEFT JOIN fact_conversation_metrics fcm ON fc.conversation_id = fcm.conversation_id
+        WHERE true
+        """,
+        {
+            "sentiment_score": "REAL",
+            "solution_provided": "INTEGER",
+            "alert_flag": "INTEGER",
+            "conversation_depth_score": "REAL",
+            "data_completeness_score": "REAL",
+        },
+    ),
+    "alerts": (
+        "fcm.conversation_id",
+        "fc.timestamp",
+        """
+        SELECT
+            fcm.conversation_id,
+            fc.timestamp,
+            fcm.alert_type,
+            fcm.alert_priority,
+            fc.district,
+            fc.state,
+            du.full_name AS agent_name,
+            df.farmer_name,
+            fcs.urgency,
+            fcs.primary_topic,
+            fcs.overall_sentiment,
+            fc.transcript
+        FROM fact_conversation_metrics fcm
+        JOIN fact_conversations fc ON fcm.conversation_id = fc.conversation_id
+        LEFT JOIN dim_user du ON fc.user_id = du.user_id
+        LEFT JOIN dim_farmers df ON fc.farmer_id = df.farmer_id
+        LEFT JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+        WHERE fcm.alert_flag = 1
+        """,
+        {"alert_priority": "INTEGER"},
+    ),
+    "farmer-journeys": (
+        "fft.touchpoint_id",
+        "fc.timestamp",
+        """
+        SELECT
+            fft.touchpoint_id,
+            fft.farmer_id,
+            df.farmer_name,
+            df.district,
+            df.primary_crop_code,
+            fft.touch_number,
+            fft.conversation_id,
+            fc.timestamp,
+            fft.topic_category,
+            fft.sentiment,
+            fft.was_solution_provided,
+            fft.followup_needed,
+            fft.days_since_first_touch,
+            fft.days_since_last_touch,
+            du.full_name AS agent_name
+        FROM fact_farmer_touchpoints fft
+        JOIN dim_farmers df ON fft.farmer_id = df.farmer_id
+        JOIN fact_conversations fc ON fft.conversation_id = fc.conversation_id
+        LEFT JOIN dim_user du ON fft.user_id = du.user_id
+        WHERE true
+        """,
+        {
+            "touchpoint_id": "INTEGER",
+            "primary_crop_code": "INTEGER",
+            "touch_number": "INTEGER",
+            "was_solution_provided": "INTEGER",
+            "followup_needed": "INTEGER",
+            "days_since_first_touch": "INTEGER",
+            "days_since_last_touch": "INTEGER",
+        },
+    ),
+    "sales-pipeline": (
+        "fsp.pipeline_id",
+        None,
+        """
+        SELECT
+            fsp.pipeline_id,
+            fsp.stage,
+            fsp.stage_entered_date,
+            df.farmer_name,
+            df.district AS farmer_district,
+            du.full_name AS agent_name,
+            db.brand_name,
+            dc.company_name,
+            fsp.estimated_value,
+            fsp.probability_pct,
+            fsp.is_closed,
+            JULIANDAY('now') - JULIANDAY(fsp.stage_entered_date) AS days_in_stage
+        FROM fact_sales_pipeline fsp
+        LEFT JOIN dim_farmers df ON fsp.farmer_id = df.farmer_id
+        LEFT JOIN dim_user du ON fsp.user_id = du.user_id
+        LEFT JOIN dim_brands db ON fsp.brand_code = db.brand_code
+        LEFT JOIN dim_companies dc ON db.company_code = dc.company_code
+        WHERE true
+        """,
+        {
+            "pipeline_id": "INTEGER",
+            "estimated_value": "REAL",
+            "probability_pct": "INTEGER",
+            "is_closed": "INTEGER",
+            "days_in_stage": "REAL",
+        },
+    ),
+}
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def pages(dataset, date_filter="all", after=None, page_size=PAGE_SIZE):
+    """Yield (columns, rows) pages of a dataset in key order
+
+    The first page is yielded even when empty, so formats with a header or
+    schema still produce a valid file.
+    """
+    key, timestamp, query, _ = DATASETS[dataset]
+    start, end = timerange.parse_date_filter(date_filter)
+    filters, params = "", []
+    if timestamp and start:
+        # Unary + keeps the key index driving the scan; a timestamp index
+        # would return rows out of key order and sort the range per page.
+        filters = f"AND +{timestamp} >= ? AND +{timestamp} < ?"
+        params = [start, end]
+
+    first = True
+    while True:
+        keyset = f"AND {key} > ?" if after is not None else ""
+        conn = db.get_read_connection()
+        try:
+            cursor = conn.execute(
+                f"{query} {filters} {keyset} ORDER BY {key} LIMIT ?",
+                [*params, *([after] if after is not None else []), page_size],
+            )
+            columns = [d[0] for d in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+        if rows or first:
+            yield columns, rows
+        if len(rows) < page_size:
+            return
+        after, first = rows[-1][0], False
+
+
+def csv_stream(pages):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header = False
+    for columns, rows in pages:
+        if not header:
+            writer.writerow(columns)
+            header = True
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def ndjson_stream(pages):
+    for columns, rows in pages:
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows
+        )
+
+
+class ChunkSink:
+    """Write-only file object whose contents are handed out as they are written"""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def integer_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value if isinstance(value, int) else None
+
+
+def real_value(value):
+    return float(value) if isinstance(value, (int, float)) else None
+
+
+def text_value(value):
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+# Declared type -> (Arrow type name, conversion of a SQLite value)
+ARROW_TYPES = {
+    "INTEGER": ("int64", integer_value),
+    "REAL": ("float64", real_value),
+    "TEXT": ("string", text_value),
+}
+
+
+def parquet_stream(pages, types):
+    """One row group per page, with the schema declared for the dataset
+
+    SQLite does not enforce column types, so values are converted to the
+    declared type; one that cannot be represented exactly, such as text in a
+    numeric column, is written as null rather than truncated.
+    """
+    sink = ChunkSink()
+    writer = schema = None
+    for columns, rows in pages:
+        declared = [ARROW_TYPES[types.get(name, "TEXT")] for name in columns]
+        if schema is None:
+            schema = pyarrow.schema(
+                [
+                    (name, getattr(pyarrow, arrow_type)())
+                    for name, (arrow_type, _) in zip(columns, declared)
+                ]
+            )
+            writer = pyarrow.parquet.ParquetWriter(
+                pyarrow.PythonFile(sink, mode="w"), schema
+            )
+        values = list(zip(*rows)) or [()] * len(columns)
+        arrays = [
+            pyarrow.array([convert(v) for v in column], type=field.type)
+            for field, (_, convert), column in zip(schema, declared, values)
+        ]
+        writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+STREAMS = {"csv": csv_stream, "ndjson": ndjson_stream}
+
+
+def export_response(dataset, args):
+    """Flask response streaming a dataset in the format requested by args"""
+    if dataset not in DATASETS:
+        return jsonify({"error": f"Unknown dataset: {dataset}"}), 404
+    fmt = args.get("format", "csv")
+    if fmt not in FORMATS:
+        return jsonify({"error": f"Unknown format: {fmt}"}), 400
+    if fmt == "parquet" and pyarrow is None:
+        return jsonify({"error": "Parquet export needs pyarrow installed"}), 501
+
+    # A numeric key column applies its affinity to the text `after`
+    pages_ = pages(dataset, args.get("date", "all"), args.get("after"))
+    mimetype, extension = FORMATS[fmt]
+    if fmt == "parquet":
+        stream = parquet_stream(pages_, DATASETS[dataset][3])
+    else:
+        stream = STREAMS[fmt](pages_)
+    return Response(
+        stream,
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename={dataset}.{extension}",
+            "X-Accel-Buffering": "no",
+        },
+    )
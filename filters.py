@@ -0,0 +1,233 @@
+"""
+Dashboard filters pushed down into every widget query.
+
+Besides `date`, widgets and bundles accept any combination of
+
+    crop        crop codes (see /api/filters/crops)
+    crop_type   crop types (see /api/filters/crop-types)
+    district    district of the conversation (see /api/filters/regions)
+    state       state of the conversation
+    company     company codes (see /api/filters/companies); conversations
+                mentioning one of its brands
+    agent       user ids of field agents (see /api/filters/agents)
+
+as comma-separated values. Values of one filter are alternatives; different
+filters must all match.
+
+A scope compiles its filters once into temp.filter_conversations, the ids of
+the matching conversations: each filter is read from a covering index
+(schema.INDEXES) and the results are intersected. Widget queries add
+`conversation_id IN temp.filter_conversations` (Scope.filter_clause), a
+semi-join SQLite runs either as index lookups driven by the set or as a
+primary key probe per row, whichever its size makes cheaper. `date` keeps its
+own day-range pushdown and applies exactly where it did before.
+
+The trend and matrix marts have no crop or region dimension. With filters,
+Scope.mart() replaces a mart with the equivalent aggregate over the matching
+conversations, with the mart's column names, so the widget query is the same.
+"""
+
+import json
+
+import db
+import timerange
+
+TABLE = "filter_conversations"
+
+# filter -> query for the ids of matching conversations, given the values as
+# one JSON array
+FILTERS = {
+    "crop": """
+        SELECT conversation_id FROM fact_conversation_entities
+        WHERE entity_type = 'crop'
+        AND entity_code IN (SELECT value FROM json_each(?))
+    """,
+    "crop_type": """
+        SELECT conversation_id FROM fact_conversation_entities
+        WHERE entity_type = 'crop'
+        AND entity_code IN (
+            SELECT crop_code FROM dim_crops
+            WHERE crop_type IN (SELECT value FROM json_each(?))
+        )
+    """,
+    "district": """
+        SELECT conversation_id FROM fact_conversations
+        WHERE district IN (SELECT value FROM json_each(?))
+    """,
+    "state": """
+        SELECT conversation_id FROM fact_conversations
+        WHERE state IN (SELECT value FROM json_each(?))
+    """,
+    "company": """
+        SELECT conversation_id FROM fact_conversation_companies
+        WHERE company_code IN (SELECT value FROM json_each(?))
+    """,
+    "agent": """
+        SELECT conversation_id FROM fact_conversations
+        WHERE user_id IN (SELECT value FROM json_each(?))
+    """,
+}
+CODE_FILTERS = ("crop", "company")
+
+DAY = timerange.day_bucket()
+
+# Mart -> the same columns aggregated over the filtered conversations.
+# {conversations} and {entities} are the filter predicates on
+# fact_conversations fc and fact_conversation_entities b, {dates} the date
+# filter on fc.
+MARTS = {
+    "mart_daily_kpis": f"""
+        SELECT
+            {DAY} as kpi_date,
+            COUNT(DISTINCT fc.conversation_id) as total_conversations,
+            COUNT(DISTINCT CASE WHEN fcm.alert_flag = 1 THEN fc.conversation_id END) as alert_count,
+            COUNT(fcs.conversation_id) as semantics_count,
+            COUNT(CASE WHEN fcs.overall_sentiment = 'positive' THEN 1 END) as positive_count,
+            COUNT(CASE WHEN fcs.overall_sentiment = 'neutral' THEN 1 END) as neutral_count,
+            COUNT(CASE WHEN fcs.overall_sentiment = 'negative' THEN 1 END) as negative_count
+        FROM fact_conversations fc
+        LEFT JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+        LEFT JOIN fact_conversation_metrics fcm ON fc.conversation_id = fcm.conversation_id
+        WHERE 1 = 1
+        {{conversations}}
+        {{dates}}
+        GROUP BY {DAY}
+    """,
+    "mart_daily_topic_kpis": f"""
+        SELECT
+            {DAY} as kpi_date,
+            fcs.primary_topic,
+            fcs.intent,
+            COUNT(*) as conversations
+        FROM fact_conversations fc
+        JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+        WHERE 1 = 1
+        {{conversations}}
+        {{dates}}
+        GROUP BY {DAY}, fcs.primary_topic, fcs.intent
+    """,
+    "mart_daily_agent_kpis": f"""
+        SELECT
+            {DAY} as kpi_date,
+            fc.user_id,
+            COUNT(*) as total_conversations
+        FROM fact_conversations fc
+        WHERE 1 = 1
+        {{conversations}}
+        {{dates}}
+        GROUP BY {DAY}, fc.user_id
+    """,
+    "mart_daily_company_kpis": f"""
+        SELECT
+            {DAY} as kpi_date,
+            db.company_code,
+            dc.company_name,
+            COUNT(DISTINCT fce.entity_id) as total_mentions,
+            COUNT(DISTINCT fc.conversation_id) as unique_conversations
+        FROM fact_conversations fc
+        CROSS JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
+        JOIN dim_brands db ON fce.entity_code = db.brand_code
+        LEFT JOIN dim_companies dc ON db.company_code = dc.company_code
+        WHERE fce.entity_type = 'brand'
+        {{conversations}}
+        {{dates}}
+        GROUP BY {DAY}, db.company_code
+    """,
+    "mart_brand_mentions": f"""
+        SELECT
+            {DAY} as period_start,
+            'daily' as period_type,
+            fce.entity_code as brand_code,
+            COUNT(*) as total_mentions
+        FROM fact_conversations fc
+        CROSS JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
+        WHERE fce.entity_type = 'brand'
+        {{conversations}}
+        {{dates}}
+        GROUP BY {DAY}, fce.entity_code
+    """,
+    # The matrices are all-time, like the ETL marts
+    "mart_brand_crop_matrix": """
+        SELECT
+            b.entity_code as brand_code,
+            dcr.crop_name,
+            COUNT(*) as co_mentions
+        FROM fact_conversation_entities b
+        JOIN fact_conversation_entities c
+            ON c.conversation_id = b.conversation_id AND c.entity_type = 'crop'
+        JOIN dim_crops dcr ON c.entity_code = dcr.crop_code
+        WHERE b.entity_type = 'brand'
+        {entities}
+        GROUP BY b.entity_code, c.entity_code
+    """,
+    "mart_crop_pest_matrix": """
+        SELECT
+            dcr.crop_name,
+            dp.pest_name,
+            COUNT(*) as co_mentions
+        FROM fact_conversation_entities b
+        JOIN fact_conversation_entities p
+            ON p.conversation_id = b.conversation_id AND p.entity_type = 'pest'
+        JOIN dim_crops dcr ON b.entity_code = dcr.crop_code
+        JOIN dim_pests dp ON p.entity_code = dp.pest_code
+        WHERE b.entity_type = 'crop'
+        {entities}
+        GROUP BY b.entity_code, p.entity_code
+    """,
+    "mart_crop_pest_brand_flow": """
+        SELECT
+            dcr.crop_name,
+            dp.pest_name,
+            db.brand_name,
+            COUNT(DISTINCT b.conversation_id) as flow_count
+        FROM fact_conversation_entities b
+        JOIN fact_conversation_entities p
+            ON p.conversation_id = b.conversation_id AND p.entity_type = 'pest'
+        JOIN fact_conversation_entities br
+            ON br.conversation_id = b.conversation_id AND br.entity_type = 'brand'
+        JOIN dim_crops dcr ON b.entity_code = dcr.crop_code
+        JOIN dim_pests dp ON p.entity_code = dp.pest_code
+        JOIN dim_brands db ON br.entity_code = db.brand_code
+        WHERE b.entity_type = 'crop'
+        {entities}
+        GROUP BY b.entity_code, p.entity_code, br.entity_code
+    """,
+}
+
+
+def parse(args):
+    """{filter: [values]} of the filters present in request args"""
+    parsed = {}
+    for name in FILTERS:
+        raw = args.getlist(name) if hasattr(args, "getlist") else [args.get(name)]
+        values = [v.strip() for item in raw if item for v in item.split(",")]
+        values = [v for v in values if v]
+        if name in CODE_FILTERS:
+            values = [int(v) if v.isdigit() else v for v in values]
+        if values:
+            parsed[name] = sorted(set(values), key=str)
+    return parsed
+
+
+def build(conn, parsed):
+    """Fill temp.filter_conversations with the conversations matching parsed
+
+    Returns the number of matching conversations.
+    """
+    compound = " INTERSECT ".join(FILTERS[name] for name in parsed)
+    params = [json.dumps(values) for values in parsed.values()]
+    with db.temp_writes(conn):
+        conn.execute(
+            f"""
+            CREATE TEMP TABLE IF NOT EXISTS {TABLE} (
+                conversation_id TEXT PRIMARY KEY
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(f"DELETE FROM temp.{TABLE}")
+        # A single filter can list a conversation once per mention
+        conn.execute(f"INSERT OR IGNORE INTO temp.{TABLE} {compound}", params)
+        # Its size lets the planner drive small sets from the table and test
+        # large ones against it
+        conn.execute(f"ANALYZE temp.{TABLE}")
+    return conn.execute(f"SELECT COUNT(*) FROM temp.{TABLE}").fetchone()[0]
@@ -0,0 +1,294 @@
+"""
+Conversation counts and sentiment by map tile.
+
+Locations are binned into Web Mercator map tiles, the z/x/y scheme of
+Leaflet, OpenLayers and other web maps. tiles() returns every tile with
+conversations inside a bounding box at a zoom level. Two structures sit
+behind it, both rebuilt for the affected days by rollups.refresh():
+
+    mart_geo_tiles     per zoom (0 to TILE_MAX_ZOOM), tile and day
+    geo_conversations  R*Tree of conversations by fact rowid, with integer
+                       dimensions for the location in world coordinates (tile
+                       x, y at BASE_ZOOM), the day number and the sentiment
+
+Up to TILE_MAX_ZOOM, a request reads the mart rows of the tiles in view, so
+its cost follows the tiles and days shown rather than the conversations
+behind them. Deeper zooms, and requests with crop/region/company/agent
+filters (the mart has no such dimensions), aggregate the R*Tree entries in
+the box and date range instead. A tile at zoom z is the world coordinates
+shifted right by BASE_ZOOM - z bits, so this reads the index alone; only
+filters look up each entry's conversation_id.
+
+fact_conversations has no INTEGER PRIMARY KEY, so a VACUUM may renumber its
+rowids; run `python rollups.py --rebuild` after one.
+"""
+
+import json
+import math
+import os
+from datetime import date
+
+import timerange
+from widgets import Scope
+
+TILE_MAX_ZOOM = int(os.environ.get("GEO_TILE_MAX_ZOOM", "10"))
+# Most tiles one request may cover, so a deep zoom needs a small bbox
+MAX_TILES = int(os.environ.get("GEO_MAX_TILES", "16384"))
+# World coordinates are tile coordinates at this zoom, about 2 m apart
+BASE_ZOOM = 24
+MAX_ZOOM = 22
+DEFAULT_ZOOM = 5
+# Web Mercator stops short of the poles
+MAX_LATITUDE = 85.0511287798
+WORLD = (-180.0, -MAX_LATITUDE, 180.0, MAX_LATITUDE)
+
+DAY = timerange.day_bucket()
+
+# Per tile: conversations, positive, neutral, negative, and the sums of the
+# world coordinates for the tile's centroid
+MEASURES = 6
+
+# geo_conversations sentiment dimension, numbered as the measures above; 0 for
+# conversations without one
+SENTIMENTS = {"positive": 1, "neutral": 2, "negative": 3}
+
+
+class QueryError(ValueError):
+    """Raised for a malformed bounding box or one covering too many tiles"""
+
+
+def tile_xy(latitude, longitude, zoom=BASE_ZOOM):
+    """(x, y) of the tile containing a location at a zoom level"""
+    n = 1 << zoom
+    latitude = max(-MAX_LATITUDE, min(latitude, MAX_LATITUDE))
+    x = (longitude + 180.0) / 360.0 * n
+    sin = math.sin(math.radians(latitude))
+    y = (0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * n
+    return min(max(int(x), 0), n - 1), min(max(int(y), 0), n - 1)
+
+
+def world_location(x, y):
+    """(latitude, longitude) of a point in world coordinates"""
+    n = 1 << BASE_ZOOM
+    latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return latitude, x / n * 360.0 - 180.0
+
+
+def day_number(day):
+    return date.fromisoformat(day).toordinal()
+
+
+def tile_range(bbox, zoom):
+    """(x0, y0, x1, y1) of the tiles covering bbox (west, south, east, north)"""
+    west, south, east, north = bbox
+    x0, y0 = tile_xy(north, west, zoom)
+    x1, y1 = tile_xy(south, east, zoom)
+    return x0, y0, x1, y1
+
+
+def parse_bbox(text):
+    """(west, south, east, north) from "west,south,east,north" in degrees"""
+    if not text:
+        return WORLD
+    try:
+        west, south, east, north = (float(v) for v in text.split(","))
+    except ValueError:
+        raise QueryError("bbox must be west,south,east,north in degrees") from None
+    if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+        raise QueryError("bbox must be west,south,east,north in degrees")
+    return west, south, east, north
+
+
+def rollup_days(conn, days):
+    """Recompute geo_conversations and mart_geo_tiles for the given days
+
+    The conversations are binned once at TILE_MAX_ZOOM; every coarser zoom
+    adds up the four tiles below it.
+    """
+    param = json.dumps(days)
+    conn.execute(
+        f"""
+        DELETE FROM geo_conversations WHERE id IN (
+            SELECT fc.rowid FROM fact_conversations fc
+            WHERE {DAY} IN (SELECT value FROM json_each(?))
+        )
+        """,
+        (param,),
+    )
+    conn.execute(
+        "DELETE FROM mart_geo_tiles WHERE kpi_date IN (SELECT value FROM json_each(?))",
+        (param,),
+    )
+    rows = conn.execute(
+        f"""
+        SELECT
+            fc.rowid, fc.conversation_id, {DAY}, fcs.overall_sentiment,
+            fc.latitude, fc.longitude
+        FROM fact_conversations fc
+        -- One entry per conversation: the latest analysis if there are several
+        LEFT JOIN fact_conversation_semantics fcs ON fcs.semantic_id = (
+            SELECT MAX(semantic_id) FROM fact_conversation_semantics
+            WHERE conversation_id = fc.conversation_id
+        )
+        WHERE {DAY} IN (SELECT value FROM json_each(?))
+        AND fc.latitude IS NOT NULL AND fc.longitude IS NOT NULL
+        """,
+        (param,),
+    ).fetchall()
+    points = []
+    for rowid, conversation_id, day, sentiment, latitude, longitude in rows:
+        try:
+            number = day_number(day)
+        except ValueError:
+            continue  # A malformed timestamp has no day to count it under
+        x, y = tile_xy(latitude, longitude)
+        s = SENTIMENTS.get(sentiment, 0)
+        points.append((rowid, conversation_id, day, number, s, x, y))
+    conn.executemany(
+        """
+        INSERT INTO geo_conversations (
+            id, min_x, max_x, min_y, max_y, min_day, max_day,
+            min_sentiment, max_sentiment, conversation_id
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (rowid, x, x, y, y, number, number, s, s, conversation_id)
+            for rowid, conversation_id, _, number, s, x, y in points
+        ],
+    )
+
+    shift = BASE_ZOOM - TILE_MAX_ZOOM
+    level = {}
+    for _, _, day, _, sentiment, x, y in points:
+        key = (x >> shift, y >> shift, day)
+        tile = level.get(key)
+        if tile is None:
+            tile = level[key] = [0] * MEASURES
+        tile[0] += 1
+        if sentiment:
+            tile[sentiment] += 1
+        tile[4] += x
+        tile[5] += y
+
+    for zoom in range(TILE_MAX_ZOOM, -1, -1):
+        conn.executemany(
+            """
+            INSERT INTO mart_geo_tiles (
+                zoom, tile_x, tile_y, kpi_date, conversations, positive_count,
+                neutral_count, negative_count, x_sum, y_sum
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(zoom, *key, *measures) for key, measures in level.items()],
+        )
+        parent = {}
+        for (x, y, day), measures in level.items():
+            key = (x >> 1, y >> 1, day)
+            if key in parent:
+                parent[key] = [a + b for a, b in zip(parent[key], measures)]
+            else:
+                parent[key] = measures
+        level = parent
+
+
+def mart_tiles(scope, zoom, tiles):
+    """Measures of the tiles with data, read from mart_geo_tiles"""
+    x0, y0, x1, y1 = tiles
+    date_clause, date_params = scope.day_clause("kpi_date")
+    return scope.conn.execute(
+        f"""
+        SELECT
+            tile_x, tile_y,
+            SUM(conversations), SUM(positive_count), SUM(neutral_count),
+            SUM(negative_count), SUM(x_sum), SUM(y_sum)
+        FROM mart_geo_tiles
+        WHERE zoom = ?
+        AND tile_x BETWEEN ? AND ?
+        AND tile_y BETWEEN ? AND ?
+        {date_clause}
+        GROUP BY tile_x, tile_y
+        ORDER BY tile_x, tile_y
+        """,
+        [zoom, x0, x1, y0, y1, *date_params],
+    ).fetchall()
+
+
+def point_tiles(scope, zoom, tiles):
+    """Measures of the tiles with data, aggregated from geo_conversations"""
+    x0, y0, x1, y1 = tiles
+    shift = BASE_ZOOM - zoom
+    params = [
+        x0 << shift,
+        ((x1 + 1) << shift) - 1,
+        y0 << shift,
+        ((y1 + 1) << shift) - 1,
+    ]
+    # The same whole days as the mart
+    date_clause, days = scope.day_clause("g.min_day")
+    params += [day_number(day) for day in days]
+    return scope.conn.execute(
+        f"""
+        SELECT
+            g.min_x >> {shift} as tile_x,
+            g.min_y >> {shift} as tile_y,
+            COUNT(*),
+            COUNT(CASE WHEN g.min_sentiment = {SENTIMENTS["positive"]} THEN 1 END),
+            COUNT(CASE WHEN g.min_sentiment = {SENTIMENTS["neutral"]} THEN 1 END),
+            COUNT(CASE WHEN g.min_sentiment = {SENTIMENTS["negative"]} THEN 1 END),
+            SUM(g.min_x),
+            SUM(g.min_y)
+        FROM geo_conversations g
+        WHERE g.min_x >= ? AND g.min_x <= ?
+        AND g.min_y >= ? AND g.min_y <= ?
+        {date_clause}
+        {scope.filter_clause("g", probe=True)}
+        GROUP BY tile_x, tile_y
+        ORDER BY tile_x, tile_y
+        """,
+        params,
+    ).fetchall()
+
+
+def tile_payload(row):
+    x, y, count, positive, neutral, negative, x_sum, y_sum = row
+    # Centre of the mean world coordinate
+    latitude, longitude = world_location(x_sum / count + 0.5, y_sum / count + 0.5)
+    return {
+        "x": x,
+        "y": y,
+        "conversations": count,
+        "positive": positive,
+        "neutral": neutral,
+        "negative": negative,
+        "latitude": round(latitude, 5),
+        "longitude": round(longitude, 5),
+    }
+
+
+def tiles(conn, args):
+    """Conversations and sentiment of every tile with data in args["bbox"]
+
+    `zoom` is the zoom level of the tiles; the dashboard's `date` and filter
+    args apply as on every widget.
+    """
+    bbox = parse_bbox(args.get("bbox"))
+    zoom = max(0, min(args.get("zoom", DEFAULT_ZOOM, type=int), MAX_ZOOM))
+    scope = Scope(conn, args)
+    covering = tile_range(bbox, zoom)
+    x0, y0, x1, y1 = covering
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_TILES:
+        raise QueryError(
+            f"bbox covers more than {MAX_TILES} tiles at zoom {zoom}; "
+            "use a smaller bbox or zoom"
+        )
+    if zoom <= TILE_MAX_ZOOM and not scope.filters():
+        source, rows = "tiles", mart_tiles(scope, zoom, covering)
+    else:
+        source, rows = "points", point_tiles(scope, zoom, covering)
+    return {
+        "zoom": zoom,
+        "bbox": list(bbox),
+        "source": source,
+        "tiles": [tile_payload(row) for row in rows],
+    }
@@ -0,0 +1,58 @@
+"""
+Gunicorn settings for serving the dashboard in production:
+
+    gunicorn app:app
+
+gunicorn reads this file from the working directory, which is also how
+Azure App Service starts Python apps. The app is imported once in the master
+(database setup, migrations, rollup catch-up) and then forked into worker
+processes. Each worker serves requests on a few threads, with its own
+connection pool, dimension cache and rollup refresher.
+
+Send HUP to the master to replace the workers gracefully. Because the app is
+preloaded, picking up new code needs a restart of the master (or USR2 to
+start a new master next to the old one).
+"""
+
+import multiprocessing
+import os
+import sqlite3
+
+bind = os.environ.get("GUNICORN_BIND") or f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# SQLite reads are CPU-bound and run in parallel across processes, so one
+# worker per core; the threads overlap the waits inside each request.
+workers = int(os.environ.get("WEB_CONCURRENCY") or max(2, multiprocessing.cpu_count()))
+worker_class = "gthread"
+request_threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+# Plus one thread per open /api/stream connection (live.py), which only
+# waits for events and never holds a database connection
+threads = request_threads + int(os.environ.get("LIVE_MAX_CLIENTS", "8"))
+
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-") or None
+errorlog = "-"
+
+
+def pre_fork(server, worker):
+    # SQLite connections must not be shared across a fork
+    import db
+
+    db.close_all()
+
+
+def post_worker_init(worker):
+    import db
+    import dimensions
+    import rollups
+
+    try:
+        db.warm_pool(request_threads)
+        dimensions.refresh()
+    except sqlite3.Error as e:
+        worker.log.warning(f"Could not warm worker {worker.pid}: {e}")
+    rollups.ensure_refresher()
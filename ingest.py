@@ -0,0 +1,417 @@
+"""
+Bulk ingest of field transcripts from staging_transcript_raw into the fact tables.
+
+Each staging row holds one conversation as JSON: the fact_conversations
+columns at the top level, plus an optional "entities" list of
+fact_conversation_entities rows and an optional "semantics" object holding
+one fact_conversation_semantics row:
+
+    {"conversation_id": "c-1001", "timestamp": "2025-11-11 09:30:00",
+     "user_id": "U12", "farmer_id": "F77", "district": "Guntur",
+     "transcript": "...",
+     "entities": [{"entity_type": "brand", "entity_code": 2567,
+                   "mention_text": "grosmart", "extraction_method": "regex"}],
+     "semantics": {"overall_sentiment": "positive", "primary_topic": "pest",
+                   "intent": "purchase", "urgency": "low"}}
+
+Pending rows are claimed and loaded in chunks, one write transaction per
+chunk. Claiming, inserting and marking rows completed or failed commit
+together, so every committed chunk is a checkpoint: an interrupted run loses
+at most the chunk in flight, and the next run carries on with the rows that
+are still pending.
+
+Usage: python ingest.py [--chunk-size N] [--limit N] [--retry-failed] [--no-rollups]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import db
+import etl
+import rollups
+import schema
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:  # orjson is optional; it roughly halves parse time
+    loads = json.loads
+
+JOB_NAME = "staging_ingest"
+CHUNK_SIZE = 5000
+
+# The fact tables hold local times without an offset; timestamps staged with
+# one are converted to this zone
+TIMEZONE = ZoneInfo(os.environ.get("INGEST_TIMEZONE", "Asia/Kolkata"))
+
+CONVERSATION_COLUMNS = [
+    "conversation_id",
+    "timestamp",
+    "latitude",
+    "longitude",
+    "village",
+    "district",
+    "state",
+    "user_id",
+    "farmer_id",
+    "transcript",
+    "user_text",
+    "conversation_length",
+    "device_type",
+    "app_version",
+    "sync_timestamp",
+    "participant_type",
+    "is_offline_entry",
+]
+ENTITY_COLUMNS = [
+    "conversation_id",
+    "entity_type",
+    "entity_code",
+    "entity_name",
+    "mention_text",
+    "position_in_text",
+    "context_snippet",
+    "confidence_score",
+    "extraction_method",
+]
+SEMANTIC_COLUMNS = [
+    "conversation_id",
+    "overall_sentiment",
+    "sentiment_score",
+    "farmer_sentiment",
+    "intent",
+    "urgency",
+    "primary_topic",
+    "sub_topic",
+    "topic_tags",
+    "problem_identified",
+    "problem_category",
+    "solution_provided",
+    "solution_type",
+    "solution_effectiveness",
+    "is_actionable",
+    "requires_followup",
+    "followup_date",
+    "confidence_score",
+    "model_version",
+    "processing_timestamp",
+]
+
+
+def insert_sql(table, columns):
+    placeholders = ", ".join("?" for _ in columns)
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+
+INSERT_CONVERSATION = insert_sql("fact_conversations", CONVERSATION_COLUMNS)
+INSERT_ENTITY = insert_sql("fact_conversation_entities", ENTITY_COLUMNS)
+INSERT_SEMANTICS = insert_sql("fact_conversation_semantics", SEMANTIC_COLUMNS)
+
+
+def normalize_timestamp(value):
+    """ISO 8601 timestamp as stored in the fact tables: 'YYYY-MM-DD HH:MM:SS'
+
+    Raises ValueError for anything that is not an ISO 8601 date or time.
+    """
+    if not isinstance(value, str):
+        raise ValueError("timestamp is not an ISO 8601 string")
+    value = value.strip()
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"timestamp is not ISO 8601: {value[:40]!r}") from None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(TIMEZONE).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def column_values(values, columns, name):
+    """Tuple of values for columns; ValueError for a nested JSON value"""
+    row = tuple(values.get(column) for column in columns)
+    for column, value in zip(columns, row):
+        if isinstance(value, (dict, list)):
+            raise ValueError(f"{name} {column} is not a single value")
+    return row
+
+
+def parse_record(raw):
+    """Return (conversation row, entity rows, semantics row or None) for a staging row
+
+    Raises ValueError for records that cannot be loaded.
+    """
+    record = loads(raw)
+    if not isinstance(record, dict):
+        raise ValueError("record is not a JSON object")
+    conversation_id = record.get("conversation_id")
+    if not conversation_id or not record.get("timestamp"):
+        raise ValueError("conversation_id and timestamp are required")
+    conversation_id = str(conversation_id)
+    timestamp = normalize_timestamp(record["timestamp"])
+
+    values = dict(record, conversation_id=conversation_id, timestamp=timestamp)
+    values.setdefault("is_offline_entry", 0)
+    # Filled here so trg_calculate_conversation_length has nothing to update
+    if values.get("conversation_length") is None and values.get("transcript"):
+        values["conversation_length"] = len(values["transcript"])
+    conversation = column_values(values, CONVERSATION_COLUMNS, "conversation")
+
+    entities = []
+    for entity in record.get("entities") or []:
+        if not isinstance(entity, dict):
+            raise ValueError("entity is not a JSON object")
+        values = dict(entity, conversation_id=conversation_id)
+        entities.append(column_values(values, ENTITY_COLUMNS, "entity"))
+
+    semantics = None
+    if record.get("semantics"):
+        values = dict(record["semantics"], conversation_id=conversation_id)
+        if isinstance(values.get("topic_tags"), list):
+            values["topic_tags"] = json.dumps(values["topic_tags"])
+        values.setdefault("processing_timestamp", time.strftime("%Y-%m-%d %H:%M:%S"))
+        semantics = column_values(values, SEMANTIC_COLUMNS, "semantics")
+
+    return conversation, entities, semantics
+
+
+def claim_chunk(conn, chunk_size):
+    """Mark the next chunk of pending staging rows as processing and return them"""
+    rows = conn.execute(
+        """
+        UPDATE staging_transcript_raw
+        SET processing_status = 'processing'
+        WHERE staging_id IN (
+            SELECT staging_id FROM staging_transcript_raw
+            WHERE processing_status = 'pending'
+            ORDER BY staging_id
+            LIMIT ?
+        )
+        RETURNING staging_id, raw_json
+        """,
+        (chunk_size,),
+    ).fetchall()
+    return sorted(rows, key=lambda row: row[0])
+
+
+def insert_records(conn, records):
+    # Entities before semantics: trg_set_alert_flag updates the metrics rows
+    # that entity inserts create.
+    conn.executemany(INSERT_CONVERSATION, [r[1] for r in records])
+    conn.executemany(INSERT_ENTITY, [e for r in records for e in r[2]])
+    conn.executemany(INSERT_SEMANTICS, [r[3] for r in records if r[3] is not None])
+
+
+def insert_chunk(conn, records):
+    """Insert parsed records; return (loaded staging ids, [(error, staging id)])
+
+    The whole chunk goes in with executemany. If a constraint or trigger
+    rejects any row, the chunk is retried record by record so only the bad
+    records fail.
+    """
+    conn.execute("SAVEPOINT chunk")
+    try:
+        insert_records(conn, records)
+        conn.execute("RELEASE chunk")
+        return [r[0] for r in records], []
+    except (sqlite3.IntegrityError, sqlite3.ProgrammingError):
+        conn.execute("ROLLBACK TO chunk")
+        conn.execute("RELEASE chunk")
+
+    loaded, failures = [], []
+    for record in records:
+        conn.execute("SAVEPOINT record")
+        try:
+            insert_records(conn, [record])
+            conn.execute("RELEASE record")
+            loaded.append(record[0])
+        # ProgrammingError: a value sqlite3 cannot bind
+        except (sqlite3.IntegrityError, sqlite3.ProgrammingError) as e:
+            conn.execute("ROLLBACK TO record")
+            conn.execute("RELEASE record")
+            failures.append((str(e), record[0]))
+    return loaded, failures
+
+
+def load_chunk(conn, chunk_size):
+    """Claim, parse and insert one chunk; return (loaded, failed, last staging id)"""
+    claimed = claim_chunk(conn, chunk_size)
+    if not claimed:
+        return 0, 0, None
+
+    records, failures = [], []
+    for staging_id, raw in claimed:
+        try:
+            records.append((staging_id, *parse_record(raw)))
+        except (ValueError, TypeError) as e:
+            failures.append((f"Invalid record: {e}", staging_id))
+
+    # Conversations already loaded, or repeated within the chunk
+    ids = [record[1][0] for record in records]
+    existing = {
+        row[0]
+        for row in conn.execute(
+            """
+            SELECT conversation_id FROM fact_conversations
+            WHERE conversation_id IN (SELECT value FROM json_each(?))
+            """,
+            (json.dumps(ids),),
+        )
+    }
+    unique = []
+    for record in records:
+        if record[1][0] in existing:
+            failures.append(("Duplicate conversation_id", record[0]))
+        else:
+            existing.add(record[1][0])
+            unique.append(record)
+
+    loaded, rejected = insert_chunk(conn, unique)
+    failures.extend(rejected)
+
+    conn.execute(
+        """
+        UPDATE staging_transcript_raw
+        SET processing_status = 'completed', error_message = NULL
+        WHERE staging_id IN (SELECT value FROM json_each(?))
+        """,
+        (json.dumps(loaded),),
+    )
+    conn.executemany(
+        """
+        UPDATE staging_transcript_raw
+        SET processing_status = 'failed', error_message = ?
+        WHERE staging_id = ?
+        """,
+        failures,
+    )
+    return len(loaded), len(failures), claimed[-1][0]
+
+
+def start_log():
+    with db.writer() as conn:
+        return conn.execute(
+            """
+            INSERT INTO etl_processing_log (
+                job_name, job_type, start_time, status, records_processed, records_failed
+            )
+            VALUES (?, 'ingestion', CURRENT_TIMESTAMP, 'running', 0, 0)
+            """,
+            (JOB_NAME,),
+        ).lastrowid
+
+
+def checkpoint(conn, log_id, loaded, failed, last_staging_id, elapsed):
+    """Record progress and throughput on the run's etl_processing_log row"""
+    conn.execute(
+        """
+        UPDATE etl_processing_log
+        SET records_processed = ?, records_failed = ?, watermark = ?
+        WHERE log_id = ?
+        """,
+        (
+            loaded,
+            failed,
+            json.dumps(
+                {
+                    "staging_id": last_staging_id,
+                    "rows_per_sec": round(loaded / elapsed, 1) if elapsed else None,
+                }
+            ),
+            log_id,
+        ),
+    )
+
+
+def finish_log(log_id, status, error=None):
+    with db.writer() as conn:
+        conn.execute(
+            """
+            UPDATE etl_processing_log
+            SET status = ?, end_time = CURRENT_TIMESTAMP, error_details = ?
+            WHERE log_id = ?
+            """,
+            (status, error, log_id),
+        )
+
+
+def reset_claims(retry_failed=False):
+    """Return rows left 'processing' by an earlier crash (and optionally failed rows) to pending
+
+    Claims only ever commit together with their outcome, so a committed
+    'processing' row belongs to no running ingest.
+    """
+    statuses = ("processing", "failed") if retry_failed else ("processing",)
+    with db.writer() as conn:
+        conn.execute(
+            f"""
+            UPDATE staging_transcript_raw
+            SET processing_status = 'pending', error_message = NULL
+            WHERE processing_status IN ({", ".join("?" for _ in statuses)})
+            """,
+            statuses,
+        )
+
+
+def run(chunk_size=CHUNK_SIZE, limit=None, retry_failed=False, refresh_rollups=True):
+    """Drain staging_transcript_raw; return (loaded, failed)"""
+    db.configure_database()
+    schema.apply_migrations()
+    reset_claims(retry_failed)
+
+    log_id = start_log()
+    started = time.perf_counter()
+    loaded = failed = 0
+    try:
+        while limit is None or loaded + failed < limit:
+            size = (
+                chunk_size
+                if limit is None
+                else min(chunk_size, limit - loaded - failed)
+            )
+            with db.writer() as conn, etl.bulk_load(conn):
+                chunk_loaded, chunk_failed, last_id = load_chunk(conn, size)
+                if last_id is None:
+                    break
+                loaded += chunk_loaded
+                failed += chunk_failed
+                elapsed = time.perf_counter() - started
+                checkpoint(conn, log_id, loaded, failed, last_id, elapsed)
+            print(
+                f"Loaded {loaded} conversations ({failed} failed), "
+                f"{loaded / elapsed:.0f}/s, up to staging_id {last_id}"
+            )
+    except Exception as e:
+        finish_log(log_id, "failed", str(e))
+        raise
+    finish_log(log_id, "completed")
+
+    if refresh_rollups and loaded:
+        rollups.refresh()
+    return loaded, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--limit", type=int, help="stop after this many staging rows")
+    parser.add_argument(
+        "--retry-failed", action="store_true", help="requeue rows that failed before"
+    )
+    parser.add_argument(
+        "--no-rollups", action="store_true", help="skip refreshing the trend marts"
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    loaded, failed = run(
+        args.chunk_size, args.limit, args.retry_failed, not args.no_rollups
+    )
+    elapsed = time.perf_counter() - started
+    print(f"Done: {loaded} loaded, {failed} failed in {elapsed:.1f}s")
@@ -0,0 +1,232 @@
+"""
+Server-sent events pushing live dashboard updates.
+
+GET /api/stream?date=30 keeps a text/event-stream open and sends:
+
+    event: kpis     the home KPIs (as /api/home/kpis) for the stream's date
+                    filter, on connect and whenever they change
+    event: alerts   alerts raised or re-prioritized since the previous
+                    event, rows as in /api/operations/alert-feed
+
+One watcher thread per process checks db.data_version() every CHECK_INTERVAL
+seconds. When the data has changed it computes the KPIs once per date filter
+in use and reads the new alerts once, then queues the results to every open
+stream, so the cost of a change does not grow with the number of viewers.
+
+An open stream holds a server thread while it waits (gunicorn.conf.py adds
+MAX_CLIENTS threads per worker for them), but never a database connection.
+Streams beyond MAX_CLIENTS get a 503 and should fall back to polling, and
+streams end after MAX_DURATION seconds; EventSource reconnects by itself,
+which spreads viewers across workers again.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+from flask import Response, jsonify
+
+import alerts
+import db
+from widgets import WIDGETS, Scope
+
+CHECK_INTERVAL = float(os.environ.get("LIVE_CHECK_INTERVAL", "2"))
+MAX_CLIENTS = int(os.environ.get("LIVE_MAX_CLIENTS", "8"))
+MAX_DURATION = float(os.environ.get("LIVE_MAX_DURATION", "600"))
+# Comment line sent when idle, so proxies keep the connection and dead
+# clients are noticed
+HEARTBEAT_INTERVAL = 15
+# Events a stream may fall behind by before it is closed
+QUEUE_SIZE = 100
+RECONNECT_MS = 5000
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class Subscriber:
+    def __init__(self, date):
+        self.date = date
+        self.events = queue.Queue(QUEUE_SIZE)
+        self.closed = False
+
+
+class Broadcaster:
+    """Open streams of this process and the watcher thread feeding them"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        # Serializes computations, which also own _kpis, _version and _alert_seq
+        self._compute_lock = threading.Lock()
+        self._kpis = {}
+        self._version = None
+        self._alert_seq = None
+        self._watcher_pid = None
+        self._stats = {
+            "computations": 0,
+            "events": 0,
+            "rejected": 0,
+            "dropped": 0,
+        }
+
+    def compute_kpis(self, conn, date):
+        self._stats["computations"] += 1
+        return WIDGETS["home"]["kpis"](Scope(conn, {"date": date}))
+
+    def subscribe(self, date):
+        """Register a stream and queue its initial KPIs; None when full"""
+        self.ensure_watcher()
+        with self._lock:
+            if len(self._subscribers) >= MAX_CLIENTS:
+                self._stats["rejected"] += 1
+                return None
+            subscriber = Subscriber(date)
+            self._subscribers.add(subscriber)
+        try:
+            with self._compute_lock:
+                if date not in self._kpis:
+                    conn = db.get_read_connection()
+                    try:
+                        self._kpis[date] = self.compute_kpis(conn, date)
+                    finally:
+                        conn.close()
+                subscriber.events.put_nowait(format_event("kpis", self._kpis[date]))
+        except Exception:
+            self.unsubscribe(subscriber)
+            raise
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event, data, date=None):
+        """Queue an event to every stream (or those with date filter date)"""
+        message = format_event(event, data)
+        with self._lock:
+            for subscriber in list(self._subscribers):
+                if date is not None and subscriber.date != date:
+                    continue
+                try:
+                    subscriber.events.put_nowait(message)
+                    self._stats["events"] += 1
+                except queue.Full:
+                    # Too slow to keep up; its stream closes and the client
+                    # reconnects with fresh KPIs
+                    subscriber.closed = True
+                    self._subscribers.discard(subscriber)
+                    self._stats["dropped"] += 1
+
+    def publish_changes(self):
+        """Compute what changed once and queue it to the streams that need it"""
+        with self._lock:
+            dates = {subscriber.date for subscriber in self._subscribers}
+        with self._compute_lock:
+            conn = db.get_read_connection()
+            try:
+                # One snapshot, so the alerts and KPIs sent agree with each other
+                conn.execute("BEGIN")
+                if not dates:
+                    # Nobody to tell; start the next viewers from here
+                    self._kpis.clear()
+                    self._alert_seq = alerts.latest_seq(conn)
+                    return
+                new_alerts = []
+                while True:
+                    page = alerts.changes_since(
+                        conn, self._alert_seq, alerts.FEED_MAX_PAGE_SIZE
+                    )
+                    new_alerts += page
+                    if len(page) < alerts.FEED_MAX_PAGE_SIZE:
+                        break
+                    self._alert_seq = page[-1]["alert_seq"]
+                kpis = {date: self.compute_kpis(conn, date) for date in dates}
+            finally:
+                conn.close()
+
+            if new_alerts:
+                self._alert_seq = new_alerts[-1]["alert_seq"]
+                self.publish("alerts", {"alerts": new_alerts, "since": self._alert_seq})
+            for date, payload in kpis.items():
+                if payload != self._kpis.get(date):
+                    self._kpis[date] = payload
+                    self.publish("kpis", payload, date)
+            # Forget filters nobody watches any more
+            for date in set(self._kpis) - dates:
+                del self._kpis[date]
+
+    def _watch(self):
+        while True:
+            time.sleep(CHECK_INTERVAL)
+            try:
+                version = db.data_version()
+                if version != self._version:
+                    self.publish_changes()
+                    self._version = version
+            except Exception as e:
+                # Keep watching; the thread is this process's only publisher
+                print(f"Error publishing live updates: {e}")
+
+    def ensure_watcher(self):
+        """Start this process's watcher thread if it is not running
+
+        Threads do not survive a fork, so this is checked per process id.
+        """
+        if self._watcher_pid == os.getpid():
+            return
+        with self._compute_lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._subscribers = set()
+            self._kpis = {}
+            self._version = db.data_version()
+            conn = db.get_read_connection()
+            try:
+                self._alert_seq = alerts.latest_seq(conn)
+            finally:
+                conn.close()
+            threading.Thread(target=self._watch, daemon=True).start()
+            self._watcher_pid = os.getpid()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["clients"] = len(self._subscribers)
+        stats["max_clients"] = MAX_CLIENTS
+        stats["date_filters"] = len(self._kpis)
+        return stats
+
+
+broadcaster = Broadcaster()
+
+
+def stream(subscriber):
+    deadline = time.monotonic() + MAX_DURATION
+    try:
+        yield f"retry: {RECONNECT_MS}\n\n"
+        while not subscriber.closed and time.monotonic() < deadline:
+            try:
+                yield subscriber.events.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+def stream_response(args):
+    """Flask response for /api/stream"""
+    subscriber = broadcaster.subscribe(args.get("date", "30"))
+    if subscriber is None:
+        response = jsonify({"error": "Too many live streams; poll instead"})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(RECONNECT_MS // 1000)
+        return response
+    return Response(
+        stream(subscriber),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
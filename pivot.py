@@ -0,0 +1,83 @@
+"""
+Pivot long (index, series, value) rows into the aligned arrays charts take.
+
+Trend queries return one row per (day, series), e.g. (date, topic, count).
+Chart.js wants the reverse: one label list and, per series, a data list
+aligned with it. pivot() builds that in one pass over the rows, placing each
+value through a label -> position dict, so the cost is O(rows + series *
+labels) whatever the number of days or series.
+
+It also fills date gaps (days without rows get `fill` instead of vanishing
+from the axis), ranks series by their total so "top N" means the biggest N,
+and sums the remaining series into an "Other" dataset.
+"""
+
+import timerange
+
+OTHER = "Other"
+
+
+def pivot(
+    rows,
+    index,
+    series,
+    value,
+    *,
+    keys=None,
+    top=None,
+    other=None,
+    fill=0,
+    fill_dates=False,
+    name=str,
+):
+    """Return {"labels": [...], "datasets": [{"label", "data"}, ...]} for rows
+
+    rows hold at most one row per (index, series). value is a column name or
+    a function of the row. Series appear in the order of keys, which also
+    keeps series without rows and drops the others, or else by total
+    descending. With top, only the first top series are kept, and with other
+    the rest are summed into a dataset of that name. fill_dates makes the
+    labels every day from the first to the last one present. name maps a
+    series key to its dataset label.
+    """
+    labels = sorted({row[index] for row in rows})
+    if fill_dates and labels:
+        labels = timerange.days_between(labels[0], labels[-1])
+    position = {label: i for i, label in enumerate(labels)}
+    get = value if callable(value) else lambda row: row[value]
+
+    columns = {key: [fill] * len(labels) for key in keys or ()}
+    for row in rows:
+        key = row[series]
+        column = columns.get(key)
+        if column is None:
+            if keys is not None:
+                continue
+            column = columns[key] = [fill] * len(labels)
+        column[position[row[index]]] = get(row)
+
+    if keys is None:
+        totals = {key: total(column) for key, column in columns.items()}
+        order = sorted(columns, key=lambda key: (-totals[key], str(key)))
+    else:
+        order = list(keys)
+    rest = order[top:] if top is not None else []
+    datasets = [{"label": name(key), "data": columns[key]} for key in order[:top]]
+    if other and rest:
+        datasets.append(
+            {"label": other, "data": sum_columns([columns[key] for key in rest])}
+        )
+    return {"labels": labels, "datasets": datasets}
+
+
+def total(column):
+    return sum(v for v in column if v is not None)
+
+
+def sum_columns(columns):
+    """Element-wise sum; None only where every column is None"""
+    summed = []
+    for values in zip(*columns):
+        present = [v for v in values if v is not None]
+        summed.append(sum(present) if present else None)
+    return summed
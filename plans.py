@@ -0,0 +1,242 @@
+"""
+Query-plan check for every dashboard endpoint.
+
+Requests every GET route under /api/ through the Flask test client (module
+bundles once per widget module) for each date filter, unfiltered and with
+each --filters query string, with the response cache off, and signs in once
+with a wrong password. It collects the plan of every distinct SELECT and
+INSERT they ran from the profiler. The check fails when a plan reads a
+fact_* table in full: a SCAN of the table itself or of an index that does
+not cover the query, each row of which costs a table lookup. Scans of a
+covering index read only the index and are listed but pass.
+
+The statements of an incremental rollup refresh (rollups.py) over the
+newest --recent rows of every source table are explained too, in a
+transaction that is rolled back. The check also fails when an index of
+schema.INDEXES is used by none of these plans.
+
+Plans follow the planner's statistics, so by default the check runs against
+the 10k bench database (bench/generate.py, seed 7), generated once into
+bench/data/ as by bench/run.py; its data and ANALYZE statistics are always
+the same. --db checks another database, with its own statistics.
+
+Usage: python plans.py [--db PATH] [--dates 30,all] [--filters QUERY]...
+                       [--recent N] [--verbose]
+Exit status 1 when any query falls back to a full scan or an index is unused.
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+
+os.environ["RESPONSE_CACHE"] = "0"
+os.environ["PROFILING"] = "1"
+# The sign-in checks the SQLite user store's lookup
+os.environ["AUTH_STORE"] = "sqlite"
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BENCH = os.path.join(ROOT, "bench")
+BENCH_SIZE = "10k"
+BENCH_SEED = 7
+
+# Every dashboard filter, in two requests: one that matches a small set of
+# conversations and one that matches none
+DEFAULT_FILTERS = [
+    "district=Guntur&crop=900018",
+    "state=Telangana&crop_type=Cereal&company=7002&agent=A000001",
+]
+
+SKIP = ("/api/stream", "/api/export/")
+EXPLAINED = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+REFRESH = "(rollups refresh)"
+INDEX_NAME = re.compile(r"INDEX (?:IF NOT EXISTS )?(\w+)", re.IGNORECASE)
+USED_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+
+def bench_database():
+    """Path of the bench database, generated if it does not exist yet"""
+    path = os.path.join(BENCH, "data", f"{BENCH_SIZE}-seed{BENCH_SEED}.db")
+    if not os.path.exists(path):
+        print(f"Generating {path} ...", flush=True)
+        command = [sys.executable, os.path.join(BENCH, "generate.py"), path]
+        command += ["--conversations", BENCH_SIZE, "--seed", str(BENCH_SEED)]
+        subprocess.run(command, check=True)
+    return path
+
+
+def api_routes(app, modules):
+    """GET /api/* routes of app; <module> routes once per widget module"""
+    found = []
+    for rule in app.url_map.iter_rules():
+        if not rule.rule.startswith("/api/") or rule.rule.startswith(SKIP):
+            continue
+        if "GET" not in rule.methods:
+            continue
+        if rule.arguments == {"module"}:
+            found += [rule.rule.replace("<module>", module) for module in modules]
+        elif not rule.arguments:
+            found.append(rule.rule)
+    return sorted(found)
+
+
+def table_scans(statement):
+    """Fact tables a plan reads row by row in full; covering-index scans pass"""
+    import profiling
+
+    plan = [
+        (parent, detail)
+        for parent, detail in statement["plan"]
+        if "USING COVERING INDEX" not in detail
+    ]
+    return profiling.full_scans(statement["sql"], plan)
+
+
+class RecordingConnection(sqlite3.Connection):
+    """Connection that keeps the first parameters of every statement it runs"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = {}
+
+    def execute(self, sql, parameters=()):
+        self.statements.setdefault(sql, parameters)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        rows = list(seq_of_parameters)
+        if rows:
+            self.statements.setdefault(sql, rows[0])
+        return super().executemany(sql, rows)
+
+
+def refresh_statements(recent):
+    """Run an incremental refresh of the newest rows; return its explained statements
+
+    The refresh runs the steps of rollups.refresh() from a watermark `recent`
+    rows behind every source table, and is rolled back.
+    """
+    import cooccurrence
+    import db
+    import profiling
+    import rollups
+
+    conn = sqlite3.connect(db.DB_PATH, factory=RecordingConnection)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        rollups.last_watermark(conn)
+        rollups.last_watermark(conn, rollups.COOCCURRENCE_JOB)
+        current = rollups.high_water(conn)
+        watermark = {
+            **{table: max(0, mark - recent) for table, mark in current.items()},
+            "version": rollups.MARTS_VERSION,
+        }
+        days = rollups.affected_days(conn, watermark)
+        cooccurrence.update(conn, watermark, days)
+        rollups.rollup_days(conn, days)
+        statements = []
+        for sql, parameters in conn.statements.items():
+            if not sql.lstrip()[:6].upper().startswith(EXPLAINED):
+                continue
+            plan = [
+                (row[1], row[3])
+                for row in sqlite3.Connection.execute(
+                    conn, f"EXPLAIN QUERY PLAN {sql}", parameters
+                )
+            ]
+            statements.append(
+                {
+                    "sql": sql,
+                    "plan": plan,
+                    "full_scans": profiling.full_scans(sql, plan),
+                    "endpoints": [REFRESH],
+                }
+            )
+        return statements
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def check(dates, filter_sets):
+    """Run every endpoint and a failed sign-in; return the explained statements"""
+    # The app modules read their database path at import time
+    import profiling
+    from app import app
+    from widgets import WIDGETS
+
+    client = app.test_client()
+    profiling.profiler.reset()
+    client.post("/login", data={"username": "plans", "password": "plans"})
+    with client.session_transaction() as session:
+        session["logged_in"] = True
+        session["username"] = "plans"
+        session["user_role"] = "admin"
+    for path in api_routes(app, WIDGETS):
+        for filters in ["", *filter_sets]:
+            for date in dates:
+                response = client.get(f"{path}?date={date}&{filters}")
+                if response.status_code >= 500:
+                    print(
+                        f"  {path}?date={date}&{filters}: HTTP {response.status_code}"
+                    )
+    return profiling.profiler.explained()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--db", help="database to check instead of the generated bench database"
+    )
+    parser.add_argument("--dates", default="30,all", help="date filters to request")
+    parser.add_argument(
+        "--filters",
+        action="append",
+        help="dashboard filters to request with, as a query string; repeatable"
+        " (default: every filter, in two requests)",
+    )
+    parser.add_argument(
+        "--recent",
+        type=int,
+        default=100,
+        help="newest rows per source table the explained refresh recomputes",
+    )
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    os.environ["FIELDFORCE_DB_PATH"] = os.path.abspath(args.db or bench_database())
+    import profiling
+    import schema
+
+    statements = check(args.dates.split(","), args.filters or DEFAULT_FILTERS)
+    statements += refresh_statements(args.recent)
+    failures = 0
+    used = set()
+    for statement in statements:
+        scans = table_scans(statement)
+        failures += bool(scans)
+        used.update(
+            name
+            for _, detail in statement["plan"]
+            for name in USED_INDEX.findall(detail)
+        )
+        if scans or args.verbose:
+            label = f"FULL SCAN of {', '.join(scans)}" if scans else "ok"
+            print(f"\n{label} in {', '.join(statement['endpoints'])}")
+            print(f"  {profiling.one_line(statement['sql'])[:300]}")
+            for _, detail in statement["plan"]:
+                print(f"    {detail}")
+
+    managed = [INDEX_NAME.search(statement).group(1) for statement in schema.INDEXES]
+    unused = [name for name in managed if name not in used]
+    for name in unused:
+        print(f"\nUNUSED INDEX {name}: no endpoint, sign-in or refresh plan uses it")
+    print(
+        f"\n{len(statements)} statements explained, {failures} with full scans,"
+        f" {len(unused)} of {len(managed)} managed indexes unused"
+        f" ({os.environ['FIELDFORCE_DB_PATH']})"
+    )
+    sys.exit(1 if failures or unused else 0)
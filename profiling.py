@@ -0,0 +1,406 @@
+"""
+Query-level profiling for the dashboard API.
+
+install() makes every pooled read connection create TimingCursor cursors,
+which time each statement (execute plus fetches) and count the rows it
+returns. Statements are attributed to the request being served on the
+thread, and at the end of the request they are folded into per-endpoint and
+per-statement totals for this worker process:
+
+- /api/admin/perf: endpoints by total time, the costliest statements and the
+  slow-query log (statements over SLOW_QUERY_MS, with their query plans)
+- /metrics: the same per-endpoint numbers in Prometheus text format
+
+Each distinct SELECT, and each INSERT such as the fill of the dashboard
+filters' temp table, is run through EXPLAIN QUERY PLAN the first time it is
+seen, and plans that scan a whole fact_* table are flagged, whether or not
+the statement has been slow yet. Work outside a request (the rollup
+refresher, live updates, the body of streamed responses) is recorded under
+the endpoint "(background)".
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import db
+
+ENABLED = os.environ.get("PROFILING", "1").lower() not in ("0", "false", "no")
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get("SLOW_QUERY_LOG_SIZE", "200"))
+# Distinct statements tracked; later ones are totalled under "(other)"
+MAX_STATEMENTS = 500
+# Request duration histogram buckets (seconds) for /metrics
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BACKGROUND = "(background)"
+
+SQL_KEYWORDS = {
+    "as", "on", "where", "join", "left", "inner", "cross", "natural", "using",
+    "group", "order", "limit", "union", "having", "window",
+}  # fmt: skip
+FACT_TABLE = re.compile(r"\b(fact_\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+SCAN = re.compile(r"^SCAN (\w+)")
+
+
+def one_line(sql):
+    return " ".join(sql.split())
+
+
+def full_scans(sql, plan):
+    """Fact tables that a query plan reads in full (SCAN rather than SEARCH)"""
+    if not plan:
+        return []
+    names = {}
+    for table, alias in FACT_TABLE.findall(sql):
+        names[table] = table
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            names[alias] = table
+    scanned = {m.group(1) for _, detail in plan if (m := SCAN.match(detail))}
+    return sorted({names[name] for name in scanned if name in names})
+
+
+class Statement:
+    """One execution of a statement: time so far and rows fetched"""
+
+    def __init__(self, sql, ms):
+        self.sql = sql
+        self.ms = ms
+        self.rows = 0
+        self.finished = False
+
+
+class RequestProfile:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.statements = []
+
+
+_current = threading.local()
+
+
+class Profiler:
+    """Per-process timing totals, statement plans and the slow-query log"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self._statements = {}
+            self._plans = {}
+            self._slow = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+            self._slow_total = 0
+
+    def plan(self, conn, sql, parameters):
+        """(plan rows, fully scanned fact tables) of a SELECT or INSERT, explained once
+
+        Once MAX_STATEMENTS texts are cached, new ones are not explained at all
+        (they are counted as "(other)"), so varying SQL costs no extra EXPLAIN.
+        """
+        explained = self._plans.get(sql)
+        if explained is not None:
+            return explained
+        if len(self._plans) >= MAX_STATEMENTS:
+            return None, []
+        plan = None
+        if sql.lstrip()[:6].upper().startswith(("SELECT", "WITH", "INSERT")):
+            try:
+                # The base class method, so the EXPLAIN is not itself profiled
+                plan = [
+                    (row[1], row[3])
+                    for row in sqlite3.Connection.execute(
+                        conn, f"EXPLAIN QUERY PLAN {sql}", parameters
+                    )
+                ]
+            except sqlite3.Error:
+                plan = None
+        explained = (plan, full_scans(sql, plan))
+        with self._lock:
+            if len(self._plans) < MAX_STATEMENTS:
+                self._plans[sql] = explained
+        return explained
+
+    def finish(self, statement, endpoint):
+        if statement.finished:
+            return
+        statement.finished = True
+        plan, scans = self._plans.get(statement.sql, (None, []))
+        key = statement.sql if statement.sql in self._plans else "(other)"
+        with self._lock:
+            totals = self._statements.get(key)
+            if totals is None:
+                totals = self._statements[key] = {
+                    "calls": 0,
+                    "ms_total": 0.0,
+                    "ms_max": 0.0,
+                    "rows": 0,
+                    "endpoints": set(),
+                }
+            totals["calls"] += 1
+            totals["ms_total"] += statement.ms
+            totals["ms_max"] = max(totals["ms_max"], statement.ms)
+            totals["rows"] += statement.rows
+            totals["endpoints"].add(endpoint)
+            if statement.ms < SLOW_QUERY_MS:
+                return
+            self._slow_total += 1
+            self._slow.append(
+                {
+                    "at": datetime.now().isoformat(timespec="seconds"),
+                    "endpoint": endpoint,
+                    "ms": round(statement.ms, 2),
+                    "rows": statement.rows,
+                    "sql": one_line(statement.sql),
+                    "plan": [detail for _, detail in plan or []],
+                    "full_scans": scans,
+                }
+            )
+        print(
+            f"Slow query ({statement.ms:.0f}ms, {statement.rows} rows) on {endpoint}: "
+            f"{one_line(statement.sql)[:200]}"
+            + (f" [full scan of {', '.join(scans)}]" if scans else "")
+        )
+
+    def begin(self, endpoint):
+        _current.profile = RequestProfile(endpoint)
+
+    def end(self, status):
+        """Fold the thread's current request into the endpoint totals"""
+        profile = getattr(_current, "profile", None)
+        if profile is None:
+            return
+        _current.profile = None
+        wall = time.perf_counter() - profile.started
+        for statement in profile.statements:
+            self.finish(statement, profile.endpoint)
+        with self._lock:
+            totals = self._endpoints.get(profile.endpoint)
+            if totals is None:
+                totals = self._endpoints[profile.endpoint] = {
+                    "requests": 0,
+                    "errors": 0,
+                    "wall_ms_total": 0.0,
+                    "wall_ms_max": 0.0,
+                    "sql_ms_total": 0.0,
+                    "statements": 0,
+                    "rows": 0,
+                    "buckets": [0] * len(BUCKETS),
+                }
+            totals["requests"] += 1
+            totals["errors"] += status >= 500
+            totals["wall_ms_total"] += wall * 1000
+            totals["wall_ms_max"] = max(totals["wall_ms_max"], wall * 1000)
+            totals["sql_ms_total"] += sum(s.ms for s in profile.statements)
+            totals["statements"] += len(profile.statements)
+            totals["rows"] += sum(s.rows for s in profile.statements)
+            for i, bound in enumerate(BUCKETS):
+                if wall <= bound:
+                    totals["buckets"][i] += 1
+
+    def started(self, sql, ms):
+        statement = Statement(sql, ms)
+        profile = getattr(_current, "profile", None)
+        if profile is not None:
+            profile.statements.append(statement)
+        return statement
+
+    def ended(self, statement):
+        """Called when a statement's rows are exhausted"""
+        if getattr(_current, "profile", None) is None:
+            self.finish(statement, BACKGROUND)
+
+    def report(self, top=20):
+        with self._lock:
+            endpoints = [
+                {
+                    "endpoint": name,
+                    "requests": t["requests"],
+                    "errors": t["errors"],
+                    "wall_ms_avg": round(t["wall_ms_total"] / t["requests"], 2),
+                    "wall_ms_max": round(t["wall_ms_max"], 2),
+                    "wall_ms_total": round(t["wall_ms_total"], 2),
+                    "sql_ms_avg": round(t["sql_ms_total"] / t["requests"], 2),
+                    "statements_avg": round(t["statements"] / t["requests"], 2),
+                    "rows_avg": round(t["rows"] / t["requests"], 2),
+                }
+                for name, t in self._endpoints.items()
+            ]
+            statements = [
+                {
+                    "sql": one_line(sql),
+                    "calls": t["calls"],
+                    "ms_avg": round(t["ms_total"] / t["calls"], 2),
+                    "ms_max": round(t["ms_max"], 2),
+                    "ms_total": round(t["ms_total"], 2),
+                    "rows_avg": round(t["rows"] / t["calls"], 2),
+                    "endpoints": sorted(t["endpoints"]),
+                    "full_scans": self._plans.get(sql, (None, []))[1],
+                }
+                for sql, t in self._statements.items()
+            ]
+            slow = list(reversed(self._slow))
+            full_scan_statements = [
+                one_line(sql) for sql, (_, scans) in self._plans.items() if scans
+            ]
+        return {
+            "enabled": ENABLED,
+            "slow_query_ms": SLOW_QUERY_MS,
+            "endpoints": sorted(endpoints, key=lambda e: -e["wall_ms_total"]),
+            "statements": sorted(statements, key=lambda s: -s["ms_total"])[:top],
+            "full_scan_statements": full_scan_statements,
+            "slow_queries": slow,
+        }
+
+    def explained(self):
+        """Every statement explained so far, with its plan and endpoints"""
+        with self._lock:
+            return [
+                {
+                    "sql": sql,
+                    "plan": plan,
+                    "full_scans": scans,
+                    "endpoints": sorted(
+                        self._statements.get(sql, {}).get("endpoints", ())
+                    ),
+                }
+                for sql, (plan, scans) in self._plans.items()
+                if plan is not None
+            ]
+
+    def metrics(self):
+        """Prometheus text exposition of the per-endpoint totals"""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            endpoints = {name: dict(t) for name, t in self._endpoints.items()}
+            slow_total = self._slow_total
+            full_scan_count = sum(1 for _, scans in self._plans.values() if scans)
+
+        family(
+            "dashboard_request_duration_seconds",
+            "histogram",
+            "Request wall time by endpoint",
+        )
+        for name, t in endpoints.items():
+            label = f'endpoint="{escape(name)}"'
+            for bound, count in zip(BUCKETS, t["buckets"]):
+                lines.append(
+                    f'dashboard_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'dashboard_request_duration_seconds_bucket{{{label},le="+Inf"}} {t["requests"]}'
+            )
+            lines.append(
+                f"dashboard_request_duration_seconds_sum{{{label}}} {t['wall_ms_total'] / 1000}"
+            )
+            lines.append(
+                f"dashboard_request_duration_seconds_count{{{label}}} {t['requests']}"
+            )
+        for metric, key, scale, help_text in (
+            (
+                "dashboard_request_errors_total",
+                "errors",
+                1,
+                "Requests answered with 5xx",
+            ),
+            (
+                "dashboard_sql_duration_seconds_total",
+                "sql_ms_total",
+                1000,
+                "Time spent in SQL statements",
+            ),
+            ("dashboard_sql_statements_total", "statements", 1, "SQL statements run"),
+            ("dashboard_sql_rows_total", "rows", 1, "Rows returned by SQL statements"),
+        ):
+            family(metric, "counter", f"{help_text} by endpoint")
+            for name, t in endpoints.items():
+                lines.append(f'{metric}{{endpoint="{escape(name)}"}} {t[key] / scale}')
+        family(
+            "dashboard_slow_queries_total",
+            "counter",
+            f"Statements slower than {SLOW_QUERY_MS:g}ms",
+        )
+        lines.append(f"dashboard_slow_queries_total {slow_total}")
+        family(
+            "dashboard_full_scan_statements",
+            "gauge",
+            "Distinct statements whose plan scans a whole fact table",
+        )
+        lines.append(f"dashboard_full_scan_statements {full_scan_count}")
+        return "\n".join(lines) + "\n"
+
+
+def escape(label):
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+profiler = Profiler()
+
+
+class TimingCursor(sqlite3.Cursor):
+    """Cursor that reports statement time and row counts to the profiler"""
+
+    def execute(self, sql, parameters=()):
+        profiler.plan(self.connection, sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._statement = profiler.started(
+                sql, (time.perf_counter() - started) * 1000
+            )
+
+    def _fetched(self, started, rows, exhausted):
+        statement = self._statement
+        statement.ms += (time.perf_counter() - started) * 1000
+        statement.rows += rows
+        if exhausted:
+            profiler.ended(statement)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, True)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0, True)
+            raise
+        self._fetched(started, 1, False)
+        return row
+
+
+def install():
+    """Profile the statements of every pooled read connection, if ENABLED"""
+    if ENABLED:
+        db.PooledConnection.cursor_class = TimingCursor
@@ -0,0 +1,413 @@
+"""
+Incremental daily rollups behind the dashboard trend charts.
+
+Trend endpoints read per-day marts instead of aggregating the fact tables on
+every request:
+
+    mart_daily_kpis          per day (ETL table, extra sentiment columns)
+    mart_daily_company_kpis  per day and company
+    mart_brand_mentions      per day and brand (period_type 'daily')
+    mart_daily_topic_kpis    per day, primary topic and intent
+    mart_daily_agent_kpis    per day and agent
+    mart_geo_tiles           per day, zoom and map tile (geo.py)
+
+and the crop/pest/brand co-occurrence marts of cooccurrence.py, which are
+kept up to date from the entities added since the last run.
+
+refresh() finds the days touched by fact rows added since the last run and
+recomputes just those days, so its cost follows the size of the new data,
+not of the history. The high-water ids of the source tables are stored as
+a JSON watermark on the run's etl_processing_log row, along with
+MARTS_VERSION; a watermark written for another version recomputes every day.
+The co-occurrence marts add deltas rather than recompute days, so they log
+their own watermark (COOCCURRENCE_JOB) in the transaction that applies them
+and are never updated twice for the same rows.
+
+Run `python rollups.py` after an ETL load, or `python rollups.py --rebuild`
+to recompute every day.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+import cooccurrence
+import db
+import geo
+import schema
+
+JOB_NAME = "dashboard_rollups"
+COOCCURRENCE_JOB = "dashboard_cooccurrence"
+DAYS_PER_BATCH = int(os.environ.get("ROLLUP_DAYS_PER_BATCH", "31"))
+REFRESH_INTERVAL = float(os.environ.get("ROLLUP_REFRESH_INTERVAL", "60"))
+
+DAY = "substr(fc.timestamp, 1, 10)"
+
+# Bump when a mart is added or its definition changes, so that the next
+# refresh rebuilds it for every day
+MARTS_VERSION = 3
+
+# Source table -> (id column, days of the conversations behind rows past an id).
+# Ids only grow, so "id > watermark" is exactly the rows added since the last run.
+SOURCES = {
+    "fact_conversations": (
+        "rowid",
+        f"""
+        SELECT DISTINCT {DAY} FROM fact_conversations fc WHERE fc.rowid > ?
+        """,
+    ),
+    "fact_conversation_semantics": (
+        "semantic_id",
+        f"""
+        SELECT DISTINCT {DAY}
+        FROM fact_conversation_semantics fcs
+        JOIN fact_conversations fc ON fc.conversation_id = fcs.conversation_id
+        WHERE fcs.semantic_id > ?
+        """,
+    ),
+    "fact_conversation_entities": (
+        "entity_id",
+        f"""
+        SELECT DISTINCT {DAY}
+        FROM fact_conversation_entities fce
+        JOIN fact_conversations fc ON fc.conversation_id = fce.conversation_id
+        WHERE fce.entity_id > ?
+        """,
+    ),
+    "fact_conversation_metrics": (
+        "metric_id",
+        f"""
+        SELECT DISTINCT {DAY}
+        FROM fact_conversation_metrics fcm
+        JOIN fact_conversations fc ON fc.conversation_id = fcm.conversation_id
+        WHERE fcm.metric_id > ?
+        """,
+    ),
+}
+
+# Days are passed as one JSON array parameter
+IN_DAYS = f"{DAY} IN (SELECT value FROM json_each(?))"
+
+# Upsert so the ETL's own mart_daily_kpis columns are left alone. Also used by
+# etl.bulk_load() in place of the per-row trg_update_daily_kpis_insert trigger.
+DAILY_KPIS = f"""
+    INSERT INTO mart_daily_kpis (
+        kpi_date, total_conversations, unique_farmers, unique_agents,
+        districts_covered, villages_covered, alert_count, high_priority_alerts,
+        semantics_count, positive_count, neutral_count, negative_count, updated_at
+    )
+    SELECT
+        {DAY},
+        COUNT(DISTINCT fc.conversation_id),
+        COUNT(DISTINCT fc.farmer_id),
+        COUNT(DISTINCT fc.user_id),
+        COUNT(DISTINCT fc.district),
+        COUNT(DISTINCT fc.village),
+        COUNT(DISTINCT CASE WHEN fcm.alert_flag = 1 THEN fc.conversation_id END),
+        COUNT(DISTINCT CASE
+            WHEN fcm.alert_flag = 1 AND fcm.alert_priority >= 10 THEN fc.conversation_id
+        END),
+        COUNT(fcs.conversation_id),
+        COUNT(CASE WHEN fcs.overall_sentiment = 'positive' THEN 1 END),
+        COUNT(CASE WHEN fcs.overall_sentiment = 'neutral' THEN 1 END),
+        COUNT(CASE WHEN fcs.overall_sentiment = 'negative' THEN 1 END),
+        CURRENT_TIMESTAMP
+    FROM fact_conversations fc
+    LEFT JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+    LEFT JOIN fact_conversation_metrics fcm ON fc.conversation_id = fcm.conversation_id
+    WHERE {IN_DAYS}
+    GROUP BY {DAY}
+    ON CONFLICT(kpi_date) DO UPDATE SET
+        total_conversations = excluded.total_conversations,
+        unique_farmers = excluded.unique_farmers,
+        unique_agents = excluded.unique_agents,
+        districts_covered = excluded.districts_covered,
+        villages_covered = excluded.villages_covered,
+        alert_count = excluded.alert_count,
+        high_priority_alerts = excluded.high_priority_alerts,
+        semantics_count = excluded.semantics_count,
+        positive_count = excluded.positive_count,
+        neutral_count = excluded.neutral_count,
+        negative_count = excluded.negative_count,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+ROLLUPS = [
+    DAILY_KPIS,
+    "DELETE FROM mart_daily_company_kpis WHERE kpi_date IN (SELECT value FROM json_each(?))",
+    f"""
+    INSERT INTO mart_daily_company_kpis (
+        kpi_date, company_code, company_name, total_mentions, unique_conversations,
+        mention_share_pct, avg_sentiment, positive_mentions, neutral_mentions,
+        negative_mentions, recommendation_count, problem_solve_count
+    )
+    SELECT
+        {DAY},
+        db.company_code,
+        dc.company_name,
+        COUNT(DISTINCT fce.entity_id),
+        COUNT(DISTINCT fc.conversation_id),
+        ROUND(
+            COUNT(DISTINCT fc.conversation_id) * 100.0
+            / SUM(COUNT(DISTINCT fc.conversation_id)) OVER (PARTITION BY {DAY}),
+            2
+        ),
+        AVG(fcs.sentiment_score),
+        COUNT(DISTINCT CASE WHEN fcs.overall_sentiment = 'positive' THEN fc.conversation_id END),
+        COUNT(DISTINCT CASE WHEN fcs.overall_sentiment = 'neutral' THEN fc.conversation_id END),
+        COUNT(DISTINCT CASE WHEN fcs.overall_sentiment = 'negative' THEN fc.conversation_id END),
+        COUNT(DISTINCT CASE WHEN fcs.solution_provided = 1 THEN fc.conversation_id END),
+        COUNT(DISTINCT CASE
+            WHEN fcs.problem_identified = 1 AND fcs.solution_provided = 1 THEN fc.conversation_id
+        END)
+    FROM fact_conversations fc
+    -- CROSS JOIN keeps the day index driving instead of a scan of all brand mentions
+    CROSS JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
+    JOIN dim_brands db ON fce.entity_code = db.brand_code
+    LEFT JOIN dim_companies dc ON db.company_code = dc.company_code
+    LEFT JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+    WHERE fce.entity_type = 'brand'
+    AND {IN_DAYS}
+    GROUP BY {DAY}, db.company_code
+    """,
+    """
+    DELETE FROM mart_brand_mentions
+    WHERE period_type = 'daily'
+    AND period_start IN (SELECT value FROM json_each(?))
+    """,
+    f"""
+    INSERT INTO mart_brand_mentions (
+        period_start, period_end, period_type, brand_code, brand_name, company_code,
+        total_mentions, unique_conversations, unique_farmers, avg_sentiment,
+        positive_pct, negative_pct, problem_context_count, solution_context_count
+    )
+    SELECT
+        {DAY},
+        {DAY},
+        'daily',
+        fce.entity_code,
+        db.brand_name,
+        db.company_code,
+        COUNT(DISTINCT fce.entity_id),
+        COUNT(DISTINCT fc.conversation_id),
+        COUNT(DISTINCT fc.farmer_id),
+        AVG(fcs.sentiment_score),
+        ROUND(
+            COUNT(DISTINCT CASE WHEN fcs.overall_sentiment = 'positive' THEN fc.conversation_id END)
+            * 100.0 / COUNT(DISTINCT fc.conversation_id),
+            2
+        ),
+        ROUND(
+            COUNT(DISTINCT CASE WHEN fcs.overall_sentiment = 'negative' THEN fc.conversation_id END)
+            * 100.0 / COUNT(DISTINCT fc.conversation_id),
+            2
+        ),
+        COUNT(DISTINCT CASE WHEN fcs.problem_identified = 1 THEN fc.conversation_id END),
+        COUNT(DISTINCT CASE WHEN fcs.solution_provided = 1 THEN fc.conversation_id END)
+    FROM fact_conversations fc
+    -- CROSS JOIN keeps the day index driving instead of a scan of all brand mentions
+    CROSS JOIN fact_conversation_entities fce ON fc.conversation_id = fce.conversation_id
+    LEFT JOIN dim_brands db ON fce.entity_code = db.brand_code
+    LEFT JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+    WHERE fce.entity_type = 'brand'
+    AND {IN_DAYS}
+    GROUP BY {DAY}, fce.entity_code
+    """,
+    "DELETE FROM mart_daily_topic_kpis WHERE kpi_date IN (SELECT value FROM json_each(?))",
+    f"""
+    INSERT INTO mart_daily_topic_kpis (kpi_date, primary_topic, intent, conversations)
+    SELECT {DAY}, fcs.primary_topic, fcs.intent, COUNT(*)
+    FROM fact_conversations fc
+    JOIN fact_conversation_semantics fcs ON fc.conversation_id = fcs.conversation_id
+    WHERE {IN_DAYS}
+    GROUP BY {DAY}, fcs.primary_topic, fcs.intent
+    """,
+    "DELETE FROM mart_daily_agent_kpis WHERE kpi_date IN (SELECT value FROM json_each(?))",
+    f"""
+    INSERT INTO mart_daily_agent_kpis (
+        kpi_date, user_id, total_conversations, unique_farmers, alert_count
+    )
+    SELECT
+        {DAY},
+        fc.user_id,
+        COUNT(*),
+        COUNT(DISTINCT fc.farmer_id),
+        COUNT(CASE WHEN fcm.alert_flag = 1 THEN 1 END)
+    FROM fact_conversations fc
+    LEFT JOIN fact_conversation_metrics fcm ON fc.conversation_id = fcm.conversation_id
+    WHERE {IN_DAYS}
+    GROUP BY {DAY}, fc.user_id
+    """,
+]
+
+
+def high_water(conn):
+    """Current highest id of every source table"""
+    return {
+        table: conn.execute(
+            f"SELECT COALESCE(MAX({column}), 0) FROM {table}"
+        ).fetchone()[0]
+        for table, (column, _) in SOURCES.items()
+    }
+
+
+def last_watermark(conn, job=JOB_NAME):
+    """Watermark of the last completed run of job, or None if it never ran
+
+    A watermark written for another MARTS_VERSION counts as none.
+    """
+    row = conn.execute(
+        """
+        SELECT watermark FROM etl_processing_log
+        WHERE job_name = ? AND status = 'completed' AND watermark IS NOT NULL
+        ORDER BY log_id DESC
+        LIMIT 1
+        """,
+        (job,),
+    ).fetchone()
+    watermark = json.loads(row[0]) if row else None
+    if watermark and watermark.get("version") != MARTS_VERSION:
+        return None
+    return watermark
+
+
+def affected_days(conn, watermark, tables=tuple(SOURCES)):
+    """Days with rows of the given tables newer than the watermark
+
+    Without a watermark every day is affected.
+    """
+    if watermark is None:
+        return [
+            row[0]
+            for row in conn.execute(
+                f"SELECT DISTINCT {DAY} FROM fact_conversations fc ORDER BY 1"
+            )
+        ]
+    days = set()
+    for table in tables:
+        _, query = SOURCES[table]
+        days.update(row[0] for row in conn.execute(query, (watermark.get(table, 0),)))
+    days.discard(None)
+    return sorted(days)
+
+
+def rollup_days(conn, days):
+    """Recompute every mart for the given days"""
+    param = json.dumps(days)
+    for statement in ROLLUPS:
+        conn.execute(statement, (param,))
+    geo.rollup_days(conn, days)
+
+
+def log_run(conn, watermark, days, started_at, job=JOB_NAME):
+    conn.execute(
+        """
+        INSERT INTO etl_processing_log (
+            job_name, job_type, start_time, end_time, status,
+            records_processed, records_failed, watermark
+        )
+        VALUES (?, 'aggregation', ?, ?, 'completed', ?, 0, ?)
+        """,
+        (
+            job,
+            started_at,
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            days,
+            json.dumps(watermark),
+        ),
+    )
+
+
+def refresh(rebuild=False):
+    """Bring the marts up to date and return the number of days recomputed
+
+    The first batch of days is recomputed in the transaction that reads the
+    watermark, which holds the write lock, so concurrent refreshes from other
+    workers find nothing left to do. Backfills larger than DAYS_PER_BATCH
+    days commit batch by batch to keep ETL writers from waiting on one long
+    transaction.
+    """
+    started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with db.writer() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        watermark = None if rebuild else last_watermark(conn)
+        current = {**high_water(conn), "version": MARTS_VERSION}
+        if watermark == current:
+            return 0
+        days = affected_days(conn, watermark)
+        # Newer than watermark if a refresh failed after its first batch
+        cooccurrence_watermark = (
+            None if rebuild else last_watermark(conn, COOCCURRENCE_JOB)
+        )
+        if cooccurrence_watermark != current:
+            cooccurrence.update(conn, cooccurrence_watermark, days)
+            log_run(conn, current, len(days), started_at, COOCCURRENCE_JOB)
+        rollup_days(conn, days[:DAYS_PER_BATCH])
+        if len(days) <= DAYS_PER_BATCH:
+            log_run(conn, current, len(days), started_at)
+            return len(days)
+
+    for i in range(DAYS_PER_BATCH, len(days), DAYS_PER_BATCH):
+        with db.writer() as conn:
+            rollup_days(conn, days[i : i + DAYS_PER_BATCH])
+    with db.writer() as conn:
+        log_run(conn, current, len(days), started_at)
+    return len(days)
+
+
+def refresh_quietly(rebuild=False):
+    """refresh(), printing instead of raising; used from the web process"""
+    if db.IMMUTABLE:
+        return 0
+    try:
+        started = time.perf_counter()
+        days = refresh(rebuild)
+        if days:
+            print(f"Rolled up {days} day(s) in {time.perf_counter() - started:.2f}s")
+        return days
+    except Exception as e:
+        # A mart that fails to refresh must not stop the web process starting
+        print(f"Error refreshing rollups: {e!r}")
+        return 0
+
+
+_refresher_pid = None
+_refresher_lock = threading.Lock()
+
+
+def _refresh_loop():
+    version = None
+    while True:
+        try:
+            if db.data_version() != version:
+                refresh_quietly()
+                # Our own log row changes the version; read it after the refresh
+                version = db.data_version()
+        except sqlite3.Error as e:
+            print(f"Error reading data version: {e}")
+        time.sleep(REFRESH_INTERVAL)
+
+
+def ensure_refresher():
+    """Start this process's background refresh thread if it is not running
+
+    Threads do not survive a fork, so this is checked per process id.
+    """
+    global _refresher_pid
+    if REFRESH_INTERVAL <= 0 or db.IMMUTABLE or _refresher_pid == os.getpid():
+        return
+    with _refresher_lock:
+        if _refresher_pid != os.getpid():
+            threading.Thread(target=_refresh_loop, daemon=True).start()
+            _refresher_pid = os.getpid()
+
+
+if __name__ == "__main__":
+    schema.apply_migrations()
+    started = time.perf_counter()
+    days = refresh(rebuild="--rebuild" in sys.argv)
+    print(f"Rolled up {days} day(s) in {time.perf_counter() - started:.2f}s")
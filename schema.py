@@ -0,0 +1,433 @@
+"""
+Schema additions the dashboard relies on, applied idempotently at startup.
+
+fieldforce.db is created by the ETL project; everything here only adds
+indexes, columns, derived tables and the triggers that maintain them on top
+of that schema, and drops ETL indexes that one of these indexes supersedes.
+
+`python plans.py` checks that every endpoint query still has an index to use.
+"""
+
+import sqlite3
+
+import db
+
+TABLES = [
+    # Daily rollups maintained by rollups.py, next to the ETL's own marts
+    """
+    CREATE TABLE IF NOT EXISTS mart_daily_topic_kpis (
+        topic_kpi_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kpi_date TEXT NOT NULL,
+        primary_topic TEXT,
+        intent TEXT,
+        conversations INTEGER,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(kpi_date, primary_topic, intent)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS mart_daily_agent_kpis (
+        agent_kpi_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kpi_date TEXT NOT NULL,
+        user_id TEXT,
+        total_conversations INTEGER,
+        unique_farmers INTEGER,
+        alert_count INTEGER,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(kpi_date, user_id)
+    )
+    """,
+    # Companies whose brands each conversation mentions, one row per pair, so
+    # share-of-voice counts read the primary key instead of a DISTINCT over
+    # entities joined to dim_brands. Brands without a known company are
+    # recorded under UNKNOWN_COMPANY_CODE.
+    """
+    CREATE TABLE IF NOT EXISTS fact_conversation_companies (
+        company_code INTEGER NOT NULL,
+        conversation_id TEXT NOT NULL,
+        PRIMARY KEY (company_code, conversation_id)
+    ) WITHOUT ROWID
+    """,
+    # Password hashes for auth.SqliteUserStore, apart from dim_dashboard_users
+    # so that no dashboard query on the users can return them
+    """
+    CREATE TABLE IF NOT EXISTS dashboard_credentials (
+        username TEXT PRIMARY KEY,
+        password_hash TEXT NOT NULL
+    ) WITHOUT ROWID
+    """,
+    # Full-text indexes for search.py, with the fact tables as external
+    # content; kept in sync by the trg_search_* triggers
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_conversations USING fts5(
+        transcript,
+        user_text,
+        content = 'fact_conversations',
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_snippets USING fts5(
+        context_snippet,
+        mention_text,
+        content = 'fact_conversation_entities',
+        content_rowid = 'entity_id',
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+    """,
+    # Conversations for geo.py by fact rowid: location in Web Mercator world
+    # coordinates, day number and sentiment, so aggregations stay in the
+    # index; and their per-zoom tile rollup. rollups.py maintains both.
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS geo_conversations USING rtree_i32(
+        id,
+        min_x, max_x,
+        min_y, max_y,
+        min_day, max_day,
+        min_sentiment, max_sentiment,
+        +conversation_id
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS mart_geo_tiles (
+        zoom INTEGER NOT NULL,
+        tile_x INTEGER NOT NULL,
+        tile_y INTEGER NOT NULL,
+        kpi_date TEXT NOT NULL,
+        conversations INTEGER,
+        positive_count INTEGER,
+        neutral_count INTEGER,
+        negative_count INTEGER,
+        x_sum INTEGER,
+        y_sum INTEGER,
+        PRIMARY KEY (zoom, tile_x, tile_y, kpi_date)
+    ) WITHOUT ROWID
+    """,
+    # Crop -> pest -> brand flows for the solution-flow Sankey, shaped like the
+    # ETL's mart_crop_pest_matrix; cooccurrence.py maintains both
+    """
+    CREATE TABLE IF NOT EXISTS mart_crop_pest_brand_flow (
+        flow_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        crop_code INTEGER NOT NULL,
+        crop_name TEXT,
+        pest_code INTEGER NOT NULL,
+        pest_name TEXT,
+        brand_code INTEGER NOT NULL,
+        brand_name TEXT,
+        flow_count INTEGER,
+        co_mentions INTEGER,
+        first_mentioned TEXT,
+        last_mentioned TEXT,
+        trend_direction TEXT CHECK(
+            trend_direction IN ('increasing', 'stable', 'decreasing')
+        ),
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(crop_code, pest_code, brand_code)
+    )
+    """,
+]
+
+# (table, column, declaration) added to existing ETL tables
+COLUMNS = [
+    ("etl_processing_log", "watermark", "TEXT"),
+    ("mart_daily_kpis", "semantics_count", "INTEGER"),
+    ("mart_daily_kpis", "positive_count", "INTEGER"),
+    ("mart_daily_kpis", "neutral_count", "INTEGER"),
+    ("mart_daily_kpis", "negative_count", "INTEGER"),
+    # Login name for auth.SqliteUserStore (AUTH_STORE=sqlite)
+    ("dim_dashboard_users", "username", "TEXT"),
+    # Alert feed (alerts.py): the conversation's timestamp, copied so the feed
+    # order is one index, and a sequence number bumped whenever an alert is
+    # raised or its priority changes, for "what's new since" polling.
+    ("fact_conversation_metrics", "alert_timestamp", "TEXT"),
+    ("fact_conversation_metrics", "alert_seq", "INTEGER"),
+]
+
+INDEXES = [
+    # Day bucket first so the per-day reads are index range scans in day
+    # order: the rollup refresh (affected days, recomputed days, trend
+    # windows) and the filtered marts (filters.MARTS). Covers the join and
+    # agent columns as well.
+    """
+    CREATE INDEX IF NOT EXISTS idx_conv_day_cover
+    ON fact_conversations(substr(timestamp, 1, 10), timestamp, conversation_id, user_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_etl_log_job
+    ON etl_processing_log(job_name, log_id)
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_dashboard_users_username
+    ON dim_dashboard_users(username)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_metrics_alert_feed
+    ON fact_conversation_metrics(alert_flag, alert_priority, alert_timestamp, conversation_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_metrics_alert_seq
+    ON fact_conversation_metrics(alert_seq)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_conversation_companies_conversation
+    ON fact_conversation_companies(conversation_id, company_code)
+    """,
+    # Brand, crop and pest aggregations filter on the type, group by the code
+    # and count distinct conversations: all three columns in the index make
+    # them covering reads in group order, without a lookup per mention.
+    """
+    CREATE INDEX IF NOT EXISTS idx_entity_type_code_conversation
+    ON fact_conversation_entities(entity_type, entity_code, conversation_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_sem_intent
+    ON fact_conversation_semantics(intent)
+    """,
+    # Dashboard filters (filters.py): each filter column leads an index that
+    # ends in conversation_id, so a filter compiles to its conversation ids
+    # from the index alone; the entity one joins filtered conversations to
+    # their mentions by type without a table lookup.
+    """
+    CREATE INDEX IF NOT EXISTS idx_entity_conversation_type_code
+    ON fact_conversation_entities(conversation_id, entity_type, entity_code)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_conv_location_conversation
+    ON fact_conversations(district, state, conversation_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_conv_state_conversation
+    ON fact_conversations(state, conversation_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_conv_user_conversation
+    ON fact_conversations(user_id, conversation_id)
+    """,
+    # Lets rollups.py replace the tiles of the days it recomputes
+    """
+    CREATE INDEX IF NOT EXISTS idx_geo_tiles_date
+    ON mart_geo_tiles(kpi_date)
+    """,
+]
+
+# ETL indexes that are a prefix of one in INDEXES; dropping them saves a
+# b-tree update per inserted row and leaves the planner a single choice.
+SUPERSEDED_INDEXES = {
+    "idx_entity_type": "idx_entity_type_code_conversation",
+    "idx_entity_conversation": "idx_entity_conversation_type_code",
+    "idx_conv_location": "idx_conv_location_conversation",
+    "idx_conv_user": "idx_conv_user_conversation",
+}
+
+UNKNOWN_COMPANY_CODE = 0
+
+# Trigger name -> (CREATE statement, backfill run when the trigger is first created)
+TRIGGERS = {
+    "trg_conversation_companies_insert": (
+        f"""
+        CREATE TRIGGER trg_conversation_companies_insert
+        AFTER INSERT ON fact_conversation_entities
+        WHEN NEW.entity_type = 'brand'
+        BEGIN
+            INSERT OR IGNORE INTO fact_conversation_companies (company_code, conversation_id)
+            VALUES (
+                COALESCE(
+                    (SELECT company_code FROM dim_brands WHERE brand_code = NEW.entity_code),
+                    {UNKNOWN_COMPANY_CODE}
+                ),
+                NEW.conversation_id
+            );
+        END
+        """,
+        f"""
+        INSERT OR IGNORE INTO fact_conversation_companies (company_code, conversation_id)
+        SELECT COALESCE(db.company_code, {UNKNOWN_COMPANY_CODE}), fce.conversation_id
+        FROM fact_conversation_entities fce
+        LEFT JOIN dim_brands db ON fce.entity_code = db.brand_code
+        WHERE fce.entity_type = 'brand'
+        """,
+    ),
+    "trg_conversation_companies_delete": (
+        f"""
+        CREATE TRIGGER trg_conversation_companies_delete
+        AFTER DELETE ON fact_conversation_entities
+        WHEN OLD.entity_type = 'brand'
+        BEGIN
+            DELETE FROM fact_conversation_companies
+            WHERE conversation_id = OLD.conversation_id
+            AND company_code = COALESCE(
+                (SELECT company_code FROM dim_brands WHERE brand_code = OLD.entity_code),
+                {UNKNOWN_COMPANY_CODE}
+            )
+            AND NOT EXISTS (
+                SELECT 1
+                FROM fact_conversation_entities fce
+                LEFT JOIN dim_brands db ON fce.entity_code = db.brand_code
+                WHERE fce.conversation_id = OLD.conversation_id
+                AND fce.entity_type = 'brand'
+                AND COALESCE(db.company_code, {UNKNOWN_COMPANY_CODE})
+                    = fact_conversation_companies.company_code
+            );
+        END
+        """,
+        None,
+    ),
+    # Every path that raises an alert (trg_set_alert_flag, etl.bulk_load)
+    # updates an existing metrics row, so one UPDATE trigger covers them.
+    "trg_alert_feed_raise": (
+        """
+        CREATE TRIGGER trg_alert_feed_raise
+        AFTER UPDATE OF alert_flag, alert_priority ON fact_conversation_metrics
+        WHEN NEW.alert_flag = 1 AND (
+            NEW.alert_seq IS NULL
+            OR OLD.alert_flag IS NOT 1
+            OR OLD.alert_priority IS NOT NEW.alert_priority
+        )
+        BEGIN
+            UPDATE fact_conversation_metrics
+            SET
+                alert_timestamp = (
+                    SELECT timestamp FROM fact_conversations
+                    WHERE conversation_id = NEW.conversation_id
+                ),
+                alert_seq = (
+                    SELECT COALESCE(MAX(alert_seq), 0) + 1 FROM fact_conversation_metrics
+                )
+            WHERE metric_id = NEW.metric_id;
+        END
+        """,
+        """
+        UPDATE fact_conversation_metrics
+        SET alert_timestamp = alerts.timestamp, alert_seq = alerts.seq
+        FROM (
+            SELECT
+                fcm.metric_id,
+                fc.timestamp,
+                ROW_NUMBER() OVER (ORDER BY fc.timestamp, fcm.conversation_id) as seq
+            FROM fact_conversation_metrics fcm
+            LEFT JOIN fact_conversations fc ON fc.conversation_id = fcm.conversation_id
+            WHERE fcm.alert_flag = 1
+        ) alerts
+        WHERE fact_conversation_metrics.metric_id = alerts.metric_id
+        """,
+    ),
+    # External-content FTS5 tables are told about every change to their
+    # content; an update is a delete of the old text and an insert of the new.
+    # The insert triggers' backfill indexes the existing rows.
+    "trg_search_conversations_insert": (
+        """
+        CREATE TRIGGER trg_search_conversations_insert
+        AFTER INSERT ON fact_conversations
+        BEGIN
+            INSERT INTO search_conversations (rowid, transcript, user_text)
+            VALUES (NEW.rowid, NEW.transcript, NEW.user_text);
+        END
+        """,
+        "INSERT INTO search_conversations (search_conversations) VALUES ('rebuild')",
+    ),
+    "trg_search_conversations_delete": (
+        """
+        CREATE TRIGGER trg_search_conversations_delete
+        AFTER DELETE ON fact_conversations
+        BEGIN
+            INSERT INTO search_conversations (
+                search_conversations, rowid, transcript, user_text
+            )
+            VALUES ('delete', OLD.rowid, OLD.transcript, OLD.user_text);
+        END
+        """,
+        None,
+    ),
+    "trg_search_conversations_update": (
+        """
+        CREATE TRIGGER trg_search_conversations_update
+        AFTER UPDATE OF transcript, user_text ON fact_conversations
+        BEGIN
+            INSERT INTO search_conversations (
+                search_conversations, rowid, transcript, user_text
+            )
+            VALUES ('delete', OLD.rowid, OLD.transcript, OLD.user_text);
+            INSERT INTO search_conversations (rowid, transcript, user_text)
+            VALUES (NEW.rowid, NEW.transcript, NEW.user_text);
+        END
+        """,
+        None,
+    ),
+    "trg_search_snippets_insert": (
+        """
+        CREATE TRIGGER trg_search_snippets_insert
+        AFTER INSERT ON fact_conversation_entities
+        BEGIN
+            INSERT INTO search_snippets (rowid, context_snippet, mention_text)
+            VALUES (NEW.entity_id, NEW.context_snippet, NEW.mention_text);
+        END
+        """,
+        "INSERT INTO search_snippets (search_snippets) VALUES ('rebuild')",
+    ),
+    "trg_search_snippets_delete": (
+        """
+        CREATE TRIGGER trg_search_snippets_delete
+        AFTER DELETE ON fact_conversation_entities
+        BEGIN
+            INSERT INTO search_snippets (
+                search_snippets, rowid, context_snippet, mention_text
+            )
+            VALUES ('delete', OLD.entity_id, OLD.context_snippet, OLD.mention_text);
+        END
+        """,
+        None,
+    ),
+    "trg_search_snippets_update": (
+        """
+        CREATE TRIGGER trg_search_snippets_update
+        AFTER UPDATE OF context_snippet, mention_text ON fact_conversation_entities
+        BEGIN
+            INSERT INTO search_snippets (
+                search_snippets, rowid, context_snippet, mention_text
+            )
+            VALUES ('delete', OLD.entity_id, OLD.context_snippet, OLD.mention_text);
+            INSERT INTO search_snippets (rowid, context_snippet, mention_text)
+            VALUES (NEW.entity_id, NEW.context_snippet, NEW.mention_text);
+        END
+        """,
+        None,
+    ),
+}
+
+
+def add_column(conn, table, column, declaration):
+    existing = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in existing:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+def migrate(conn):
+    for statement in TABLES:
+        conn.execute(statement)
+    for table, column, declaration in COLUMNS:
+        add_column(conn, table, column, declaration)
+    for statement in INDEXES:
+        conn.execute(statement)
+    for name in SUPERSEDED_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    existing = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+    }
+    for name, (statement, backfill) in TRIGGERS.items():
+        if name not in existing:
+            conn.execute(statement)
+            if backfill:
+                conn.execute(backfill)
+
+
+def apply_migrations():
+    """Bring the database up to date; a no-op for immutable snapshots"""
+    if db.IMMUTABLE:
+        return
+    try:
+        with db.writer() as conn:
+            migrate(conn)
+            conn.execute("PRAGMA optimize")
+    except sqlite3.Error as e:
+        print(f"Error applying schema migrations to {db.DB_PATH}: {e}")
@@ -0,0 +1,168 @@
+"""
+Full-text search over conversation transcripts and entity context snippets.
+
+Two FTS5 indexes (schema.TABLES) use the fact tables as external content, so
+the text is stored once and only the index is added:
+
+    search_conversations   fact_conversations.transcript, user_text (by rowid)
+    search_snippets        fact_conversation_entities.context_snippet,
+                           mention_text (by entity_id)
+
+Triggers in schema.TRIGGERS keep them in sync with every insert, update and
+delete; etl.bulk_load() suspends the insert triggers and indexes a batch in
+one statement instead (index_conversations, index_snippets).
+
+search() ranks matches by BM25 and returns highlighted snippets, restricted
+by the dashboard's date and crop/region/company/agent filters.
+
+fact_conversations has no INTEGER PRIMARY KEY, so a VACUUM may renumber its
+rowids; run `python search.py --rebuild` after one.
+"""
+
+import argparse
+import re
+
+import db
+from widgets import Scope
+
+CONVERSATIONS = "search_conversations"
+SNIPPETS = "search_snippets"
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+HIGHLIGHT = ("<mark>", "</mark>")
+ELLIPSIS = "…"
+SNIPPET_TOKENS = 16
+
+# Words, with an optional trailing * for a prefix search
+TERM = re.compile(r"(\w+)(\*?)")
+
+
+class QueryError(ValueError):
+    """Raised for a search query without any searchable word"""
+
+
+def match_query(text):
+    """FTS5 MATCH expression for free text: every word must occur
+
+    Words are quoted, so FTS5 operators and punctuation in the input are
+    searched as text rather than parsed; `word*` searches a prefix.
+    """
+    terms = [f'"{word}"{star}' for word, star in TERM.findall(text or "")]
+    if not terms:
+        raise QueryError("Search query has no words to search for")
+    return " ".join(terms)
+
+
+def index_conversations(conn, mark):
+    """Index conversations added since mark; trg_search_conversations_insert in bulk"""
+    conn.execute(
+        f"""
+        INSERT INTO {CONVERSATIONS} (rowid, transcript, user_text)
+        SELECT rowid, transcript, user_text FROM fact_conversations
+        WHERE rowid > ?
+        """,
+        (mark["fact_conversations"],),
+    )
+
+
+def index_snippets(conn, mark):
+    """Index entities added since mark; trg_search_snippets_insert in bulk"""
+    conn.execute(
+        f"""
+        INSERT INTO {SNIPPETS} (rowid, context_snippet, mention_text)
+        SELECT entity_id, context_snippet, mention_text FROM fact_conversation_entities
+        WHERE entity_id > ?
+        """,
+        (mark["fact_conversation_entities"],),
+    )
+
+
+def rebuild(conn):
+    """Rebuild both indexes from the fact tables"""
+    for table in (CONVERSATIONS, SNIPPETS):
+        conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+
+
+def highlight(table, column):
+    start, end = HIGHLIGHT
+    return (
+        f"snippet({table}, {column}, '{start}', '{end}', '{ELLIPSIS}', "
+        f"{SNIPPET_TOKENS})"
+    )
+
+
+def search(conn, args):
+    """Conversations and entity mentions matching args["q"], best first
+
+    Takes the dashboard's `date` and filter args; `limit` caps each list.
+    """
+    query = match_query(args.get("q"))
+    limit = max(1, min(args.get("limit", DEFAULT_LIMIT, type=int), MAX_LIMIT))
+    scope = Scope(conn, args)
+    date_clause, date_params = scope.date_clause()
+
+    # ORDER BY rank lets FTS5 sort by BM25 itself; the fact row is joined by
+    # rowid, so the date and filter predicates cost one lookup per match
+    conversations = conn.execute(
+        f"""
+        SELECT
+            fc.conversation_id,
+            fc.timestamp,
+            fc.district,
+            fc.state,
+            fc.user_id,
+            {CONVERSATIONS}.rank as score,
+            {highlight(CONVERSATIONS, 0)} as transcript,
+            {highlight(CONVERSATIONS, 1)} as user_text
+        FROM {CONVERSATIONS}
+        JOIN fact_conversations fc ON fc.rowid = {CONVERSATIONS}.rowid
+        WHERE {CONVERSATIONS} MATCH ?
+        {date_clause}
+        {scope.filter_clause("fc", probe=True)}
+        ORDER BY rank
+        LIMIT ?
+        """,
+        [query, *date_params, limit],
+    ).fetchall()
+    snippets = conn.execute(
+        f"""
+        SELECT
+            fce.conversation_id,
+            fc.timestamp,
+            fce.entity_type,
+            fce.entity_code,
+            fce.entity_name,
+            {SNIPPETS}.rank as score,
+            {highlight(SNIPPETS, 0)} as context_snippet
+        FROM {SNIPPETS}
+        JOIN fact_conversation_entities fce ON fce.entity_id = {SNIPPETS}.rowid
+        JOIN fact_conversations fc ON fc.conversation_id = fce.conversation_id
+        WHERE {SNIPPETS} MATCH ?
+        {date_clause}
+        {scope.filter_clause("fc", probe=True)}
+        ORDER BY rank
+        LIMIT ?
+        """,
+        [query, *date_params, limit],
+    ).fetchall()
+    return {
+        "query": query,
+        "conversations": [dict(row) for row in conversations],
+        "snippets": [dict(row) for row in snippets],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--rebuild", action="store_true", help="rebuild the indexes from the facts"
+    )
+    args = parser.parse_args()
+
+    if args.rebuild:
+        with db.writer() as conn:
+            rebuild(conn)
+        print("Rebuilt the full-text indexes")
+    else:
+        parser.print_help()
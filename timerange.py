@@ -0,0 +1,99 @@
+"""
+Date filter handling for dashboard queries.
+
+The `date` query arg ("30", "all" or "2024-01-01,2024-12-31") becomes a
+half-open range of ISO timestamps on fact_conversations.timestamp, the event
+time of a conversation. Queries filter and group on the day bucket
+substr(timestamp, 1, 10), which idx_conv_day_cover stores precomputed, so a
+30-day view only reads the index entries of those 30 days.
+"""
+
+from datetime import date, datetime, timedelta
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+DEFAULT_DAYS = 30
+
+
+def parse_date_filter(date_filter, now=None):
+    """Return (start, end) timestamps for a date filter, or (None, None) for all time
+
+    start is inclusive and end exclusive. Unparseable filters fall back to the
+    last DEFAULT_DAYS days.
+    """
+    now = now or datetime.now()
+    date_filter = (date_filter or "").strip()
+
+    if date_filter == "all":
+        return None, None
+    if date_filter.isdigit():
+        days = int(date_filter)
+    elif "-" in date_filter:  # Custom date range: "2024-01-01,2024-12-31"
+        try:
+            parts = [
+                date.fromisoformat(part.strip()[:10]) for part in date_filter.split(",")
+            ]
+        except ValueError:
+            parts = []
+        if parts:
+            first, last = min(parts), max(parts)
+            return (
+                first.strftime("%Y-%m-%d 00:00:00"),
+                (last + timedelta(days=1)).strftime("%Y-%m-%d 00:00:00"),
+            )
+        days = DEFAULT_DAYS
+    else:
+        days = DEFAULT_DAYS
+
+    return (
+        (now - timedelta(days=days)).strftime(TIMESTAMP_FORMAT),
+        (now + timedelta(seconds=1)).strftime(TIMESTAMP_FORMAT),
+    )
+
+
+def day_bucket(alias="fc"):
+    """SQL expression for the conversation day; matches idx_conv_day_cover"""
+    return f"substr({alias}.timestamp, 1, 10)"
+
+
+def range_clause(start, end, alias="fc"):
+    """("AND ..." predicate, params) restricting alias.timestamp to [start, end)
+
+    The redundant day-bucket bounds let SQLite seek idx_conv_day_cover and read
+    the rows already grouped by day.
+    """
+    if not (start and end):
+        return "", []
+    day = day_bucket(alias)
+    clause = " ".join(
+        [
+            f"AND {day} >= ? AND {day} <= ?",
+            f"AND {alias}.timestamp >= ? AND {alias}.timestamp < ?",
+        ]
+    )
+    return clause, [start[:10], end[:10], start, end]
+
+
+def day_clause(start, end, column="kpi_date"):
+    """("AND ..." predicate, params) restricting a mart's day column to [start, end)
+
+    Marts hold whole days, so the first day of a rolling range is counted in
+    full.
+    """
+    if not (start and end):
+        return "", []
+    last = datetime.strptime(end, TIMESTAMP_FORMAT) - timedelta(seconds=1)
+    return (
+        f"AND {column} >= ? AND {column} <= ?",
+        [start[:10], last.strftime("%Y-%m-%d")],
+    )
+
+
+def days_between(first, last):
+    """Every day from first to last inclusive, as YYYY-MM-DD strings"""
+    day = date.fromisoformat(first[:10])
+    end = date.fromisoformat(last[:10])
+    days = []
+    while day <= end:
+        days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
@@ -0,0 +1,136 @@
+"""
+Dashboard widgets and module bundles.
+
+Every module chart is a widget: a function that takes a Scope and returns
+JSON-serialisable data. Registered widgets are served individually as Flask
+views and together by run_bundle(), which computes a whole module on one
+connection inside one read transaction, so widgets can share intermediate
+results through Scope.memo(). Scopes also apply the dashboard filters
+(filters.py) to the queries widgets build with Scope.filter_clause() and
+Scope.mart().
+"""
+
+from functools import wraps
+
+from flask import jsonify, request
+
+import db
+import filters
+import timerange
+
+# module -> {widget name -> compute function}, in registration order
+WIDGETS = {}
+
+
+class Scope:
+    """Connection, request args and shared intermediate results for one computation"""
+
+    def __init__(self, conn, args):
+        self.conn = conn
+        self.args = args
+        self._memo = {}
+
+    def memo(self, name, compute):
+        """Return compute(), evaluated at most once per scope"""
+        if name not in self._memo:
+            self._memo[name] = compute()
+        return self._memo[name]
+
+    def date_range(self):
+        """(start, end) of the `date` filter, fixed once for the whole scope"""
+        return self.memo(
+            "date_range",
+            lambda: timerange.parse_date_filter(self.args.get("date", "30")),
+        )
+
+    def date_clause(self, alias="fc"):
+        """("AND ..." predicate, params) applying the date filter to alias.timestamp"""
+        start, end = self.date_range()
+        return timerange.range_clause(start, end, alias)
+
+    def day_clause(self, column="kpi_date"):
+        """("AND ..." predicate, params) applying the date filter to a mart day column"""
+        start, end = self.date_range()
+        return timerange.day_clause(start, end, column)
+
+    def filters(self):
+        """{filter: [values]} of the crop, region, company and agent filters"""
+        return self.memo("filters", lambda: filters.parse(self.args))
+
+    def candidates(self):
+        """Compile the filters into temp.filter_conversations once; return its size"""
+        return self.memo("candidates", lambda: filters.build(self.conn, self.filters()))
+
+    def filter_clause(self, alias="fc", probe=False):
+        """Predicate ("AND ...") restricting alias.conversation_id to the filtered conversations
+
+        With probe, each row is looked up in the set instead of the set
+        driving an index search: for queries that already search the index by
+        another IN list, where SQLite would otherwise seek every combination.
+        """
+        if not self.filters():
+            return ""
+        self.candidates()
+        column = f"{'+' if probe else ''}{alias}.conversation_id"
+        return f"AND {column} IN temp.{filters.TABLE}"
+
+    def mart(self, name):
+        """(FROM item, params) for a mart, aggregated from the filtered facts if filtered"""
+        if not self.filters():
+            return name, []
+        template = filters.MARTS[name]
+        dates, params = self.day_clause(timerange.day_bucket())
+        query = template.format(
+            conversations=self.filter_clause("fc"),
+            entities=self.filter_clause("b"),
+            dates=dates,
+        )
+        return f"({query})", params if "{dates}" in template else []
+
+
+def widget(module, name):
+    """Register a view function as a widget of a dashboard module
+
+    The decorated function takes a Scope; as a Flask view it runs on its own
+    pooled connection and its return value is sent as JSON.
+    """
+
+    def decorator(f):
+        WIDGETS.setdefault(module, {})[name] = f
+
+        @wraps(f)
+        def decorated_function():
+            conn = db.get_read_connection()
+            try:
+                return jsonify(f(Scope(conn, request.args)))
+            finally:
+                conn.close()
+
+        return decorated_function
+
+    return decorator
+
+
+def run_bundle(module, args):
+    """Compute every widget of a module in one pass
+
+    Returns ({name: payload}, failed). A widget that raised is logged here and
+    its payload is only a generic error, so no database detail reaches clients.
+    """
+    conn = db.get_read_connection()
+    try:
+        # One snapshot for the whole bundle so widgets agree with each other
+        conn.execute("BEGIN")
+        scope = Scope(conn, args)
+        payloads = {}
+        failed = False
+        for name, compute in WIDGETS[module].items():
+            try:
+                payloads[name] = compute(scope)
+            except Exception as e:
+                print(f"Error computing {module}/{name}: {e!r}")
+                payloads[name] = {"error": "Widget failed"}
+                failed = True
+        return payloads, failed
+    finally:
+        conn.close()